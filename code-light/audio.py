@@ -0,0 +1,339 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Audio input for the RGB Floodlight application.
+#
+# Raw PCM audio, signed 16 bit little endian samples with the channels
+# interleaved, comes in on a FIFO or a Unix datagram socket...
+#
+#   arecord -t raw -f S16_LE -c 1 -r 44100 > /tmp/rgbfloodlight-audio
+#
+# The AudioAnalyzer keeps the last Audio_Window samples and once a frame
+# takes the FFT of them. The energies of the bass, mid and treble bands
+# are scaled by their recent peak, follow attack and decay envelopes and
+# become the red, green and blue of the color. The buffers are made once,
+# so the memory used stays the same however long the audio plays.
+#
+# The AudioInput has the methods of the other live color inputs (dmx.py,
+# colorstream.py), the renderer writes the color the moment the samples of
+# a frame are in. While the audio is silent the effect shows.
+#
+import logging
+import math
+import os
+import socket
+import stat
+from time import monotonic
+
+import numpy
+
+from color import Color
+
+# logger for this module
+logger = logging.getLogger(__name__)
+
+# name and frequency range in Hz of the bands for red, green and blue
+BANDS = [('bass', 20.0, 250.0), ('mid', 250.0, 2000.0),
+         ('treble', 2000.0, 16000.0)]
+# band levels under this part of full scale are silence
+NOISEFLOOR = 0.003
+# bands under this part of the loudest band's peak are dark
+BANDFLOOR = 0.05
+# seconds for the peak a band is scaled by to fall to a third
+PEAKDECAY = 10.0
+# bytes read at once, datagrams are at most this long
+READSIZE = 65536
+
+"""Turns PCM audio into band levels and a color."""
+class AudioAnalyzer:
+    def __init__(self, rate=44100, channels=1, window=1024, attack=0.02,
+                 decay=0.3):
+        """
+        Make the buffers and the band tables.
+
+        :param rate: Samples per second.
+        :param channels: Number of interleaved channels, they are mixed.
+        :param window: Number of samples of each FFT.
+        :param attack: Seconds for a band to rise to two thirds of a louder
+                       level.
+        :param decay: Seconds for a band to fall to a third of its level.
+        """
+        self.rate = rate
+        self.channels = channels
+        self.window = window
+        self.attack = attack
+        self.decay = decay
+        self._samples = numpy.zeros(window, dtype=numpy.float32)
+        self._windowed = numpy.zeros(window, dtype=numpy.float32)
+        self._hann = numpy.hanning(window).astype(numpy.float32)
+        self._mono = numpy.zeros(window, dtype=numpy.float32)
+        # the FFT and the power are computed into these every frame
+        self._spectrum = numpy.zeros(window // 2 + 1, dtype=numpy.complex64)
+        self._power = numpy.zeros(window // 2 + 1, dtype=numpy.float32)
+        self._square = numpy.zeros(window // 2 + 1, dtype=numpy.float32)
+        try:
+            numpy.fft.rfft(self._windowed, out=self._spectrum)
+            self._rfftout = True
+        except TypeError:
+            # numpy before 2.0 always returns a new array
+            self._rfftout = False
+        # a full scale sine in a band has level 1
+        self._norm = 4.0 / (window * float(numpy.sum(self._hann ** 2)))
+        freqs = numpy.fft.rfftfreq(window, 1.0 / rate)
+        self._bins = []
+        for _name, low, high in BANDS:
+            start = int(numpy.searchsorted(freqs, low))
+            end = int(numpy.searchsorted(freqs, min(high, rate / 2)))
+            self._bins.append((start, max(end, start + 1)))
+        self._peaks = [NOISEFLOOR] * len(BANDS)
+        self.levels = [0.0] * len(BANDS)
+        self.loudest = 0.0
+        # samples added since the last analysis
+        self.pending = 0
+
+    def add(self, data):
+        """
+        Add PCM samples.
+
+        :param data: Bytes like object with whole frames of samples.
+        """
+        pcm = numpy.frombuffer(data, dtype='<i2')
+        count = len(pcm) // self.channels
+        if count == 0:
+            return
+        self.pending += count
+        # only the last window of samples is analyzed
+        used = min(count, self.window)
+        pcm = pcm[(count - used) * self.channels:count * self.channels]
+        if self.channels == 1:
+            mono = pcm
+        else:
+            mono = self._mono[:used]
+            numpy.mean(pcm.reshape(used, self.channels), axis=1, out=mono)
+        samples = self._samples
+        if used < self.window:
+            # slide the window along
+            samples[:-used] = samples[used:]
+        numpy.multiply(mono, 1 / 32768, out=samples[-used:])
+
+    def analyze(self):
+        """
+        Compute the band levels of the last window.
+
+        :return: Returns the Color of the levels.
+        """
+        elapsed = self.pending / self.rate
+        self.pending = 0
+        numpy.multiply(self._samples, self._hann, out=self._windowed)
+        if self._rfftout:
+            spectrum = numpy.fft.rfft(self._windowed, out=self._spectrum)
+        else:
+            spectrum = numpy.fft.rfft(self._windowed)
+        power = self._power
+        numpy.square(spectrum.real, out=power)
+        numpy.square(spectrum.imag, out=self._square)
+        power += self._square
+        fall = math.exp(-elapsed / PEAKDECAY)
+        rise = 1.0 - math.exp(-elapsed / self.attack) if self.attack > 0 \
+            else 1.0
+        drop = 1.0 - math.exp(-elapsed / self.decay) if self.decay > 0 \
+            else 1.0
+        levels = [math.sqrt(float(power[start:end].sum()) * self._norm)
+                  for start, end in self._bins]
+        peaks = [max(level, peak * fall)
+                 for level, peak in zip(levels, self._peaks)]
+        # a band much quieter than the loudest one stays dark
+        floor = max(max(peaks) * BANDFLOOR, NOISEFLOOR)
+        for i, level in enumerate(levels):
+            # scaled by the recent peak so quiet music shows too
+            self._peaks[i] = max(peaks[i], floor)
+            target = min(level / self._peaks[i], 1.0)
+            current = self.levels[i]
+            if target > current:
+                current += (target - current) * rise
+            else:
+                current += (target - current) * drop
+            self.levels[i] = current
+        loudest = max(levels)
+        self.loudest = loudest
+        return Color(*(level * 255 for level in self.levels))
+
+"""Reads PCM audio from a FIFO or a Unix datagram socket."""
+class AudioInput:
+    name = 'Audio frame'
+
+    def __init__(self, kind, path, rate=44100, channels=1, window=1024,
+                 framerate=30, timeout=2.0):
+        """
+        Open the FIFO or bind the socket, they are made when missing.
+
+        :param kind: fifo or socket.
+        :param path: Path of the FIFO or socket.
+        :param rate: Samples per second.
+        :param channels: Number of interleaved channels.
+        :param window: Number of samples of each FFT.
+        :param framerate: Frames per second, the audio is analyzed and the
+                          color written once a frame.
+        :param timeout: Seconds of silence after which the effect comes
+                        back.
+        """
+        self.kind = kind
+        self.path = path
+        self.analyzer = AudioAnalyzer(rate, channels, window)
+        self.framerate = framerate
+        self.timeout = timeout
+        self._framebytes = 2 * channels
+        self._buffer = bytearray(READSIZE)
+        self._view = memoryview(self._buffer)
+        self._carry = 0
+        self._socket = None
+        self._fd = None
+        if os.path.exists(path):
+            mode = os.stat(path).st_mode
+            if kind == 'socket' and stat.S_ISSOCK(mode):
+                # left over from the last run
+                os.unlink(path)
+            elif kind == 'fifo' and not stat.S_ISFIFO(mode):
+                raise OSError("'%s' is not a FIFO" % path)
+            elif kind == 'socket':
+                raise OSError("'%s' is not a socket" % path)
+        if kind == 'socket':
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._socket.bind(path)
+            self._socket.setblocking(False)
+        else:
+            if not os.path.exists(path):
+                os.mkfifo(path, 0o660)
+            # opened for writing too so the FIFO never reads as closed when
+            # the player stops
+            self._fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+        self.color = None
+        self.received = 0.0
+        self._sound = None
+        self.packets = 0
+        self.outoforder = 0
+        self.ignored = 0
+
+    @property
+    def attack(self):
+        """Seconds for a band to rise to two thirds of a louder level."""
+        return self.analyzer.attack
+
+    @attack.setter
+    def attack(self, value):
+        self.analyzer.attack = value
+
+    @property
+    def decay(self):
+        """Seconds for a band to fall to a third of its level."""
+        return self.analyzer.decay
+
+    @decay.setter
+    def decay(self, value):
+        self.analyzer.decay = value
+
+    def fileno(self):
+        """
+        Get the FIFO or socket the renderer waits on.
+
+        :return: Returns the file descriptor.
+        """
+        if self._socket is not None:
+            return self._socket.fileno()
+        return self._fd
+
+    def close(self):
+        """Close the FIFO or socket, the socket file is removed."""
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _read(self, view):
+        """Read into the view, returns the number of bytes, 0 for none."""
+        try:
+            if self._socket is not None:
+                return self._socket.recv_into(view)
+            return os.readv(self._fd, [view])
+        except (BlockingIOError, InterruptedError):
+            return 0
+
+    def receive(self):
+        """
+        Read the waiting samples and analyze them once a frame.
+
+        :return: Returns True when the color was changed, color is the
+                 latest color and received the monotonic time the samples
+                 that completed the frame were read.
+        """
+        analyzer = self.analyzer
+        while True:
+            count = self._read(self._view[self._carry:])
+            if count == 0:
+                break
+            end = self._carry + count
+            whole = end - end % self._framebytes
+            analyzer.add(self._view[:whole])
+            # a sample split between two reads waits for the rest
+            self._carry = end - whole
+            self._buffer[:self._carry] = self._buffer[whole:end]
+        hop = max(int(analyzer.rate / self.framerate), 1)
+        if analyzer.pending < hop:
+            return False
+        now = monotonic()
+        color = analyzer.analyze()
+        if analyzer.loudest >= NOISEFLOOR:
+            self._sound = now
+        if self._sound is None or now - self._sound > self.timeout:
+            # silence, the effect shows
+            return False
+        self.color = color
+        self.received = now
+        self.packets += 1
+        return True
+
+    def expire(self, now):
+        """
+        Check whether there is sound.
+
+        :param now: The monotonic time.
+
+        :return: Returns True until the audio has been silent for timeout
+                 seconds.
+        """
+        return self._sound is not None and now - self._sound <= self.timeout
+
+    @property
+    def sources(self):
+        """
+        The sources property.
+
+        :return: The names of the sources sending.
+        """
+        return ["the audio %s '%s'" % (self.kind, self.path)]
@@ -0,0 +1,353 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Audio sender for testing the audio input of the RGB Floodlight application.
+#
+# Sends a WAV file, or raw PCM audio on stdin, to the FIFO or socket of the
+# audio input. A WAV file is sent in real time...
+#
+#   ./audiosend.py song.wav
+#   arecord -t raw -f S16_LE -c 1 -r 44100 | ./audiosend.py -
+#
+# With --csv the audio is analyzed the way the light does it, as fast as the
+# CPU allows, and the band levels and color of every frame are written, no
+# light or audio hardware needed...
+#
+#   ./audiosend.py song.wav --csv song.csv
+#
+# With --bench it runs rgbfloodlight.py on the simulated I2C bus with the
+# audio input on, sends bursts of a bass tone and reports how long after the
+# first sample of each burst its color landed in the simulated PCA9685...
+#
+#   ./audiosend.py --bench --count 20 --set LED_Update_Rate=60
+
+import argparse
+import json
+import math
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import wave
+from time import monotonic, sleep
+
+from settings import loadsettings
+
+# bass tone of the --bench bursts in Hz, its level and the seconds of sound
+# and silence
+BENCHTONE = 100.0
+BENCHLEVEL = 0.5
+BENCHBURST = 0.25
+BENCHGAP = 1.0
+
+def readWav(filename):
+    """
+    Read the samples of a WAV file.
+
+    :param filename: The WAV file, 16 bit PCM.
+
+    :return: Returns (samples per second, channels, sample bytes). Raises
+             ValueError for a file that isn't 16 bit PCM.
+    """
+    try:
+        with wave.open(filename, 'rb') as infile:
+            if infile.getsampwidth() != 2:
+                raise ValueError("'%s' has %d bit samples, 16 bit are needed"
+                                 % (filename, infile.getsampwidth() * 8))
+            return (infile.getframerate(), infile.getnchannels(),
+                    infile.readframes(infile.getnframes()))
+    except wave.Error as e:
+        raise ValueError("'%s' is not a PCM WAV file: %s" % (filename, e))
+
+def openTarget(kind, path):
+    """
+    Open the FIFO or socket of the audio input.
+
+    :param kind: fifo or socket.
+    :param path: Path of the FIFO or socket.
+
+    :return: Returns (send function, close function).
+    """
+    if kind == 'socket':
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        return (lambda data: sock.sendto(data, path)), sock.close
+    fd = os.open(path, os.O_WRONLY)
+
+    def send(data):
+        view = memoryview(data)
+        while len(view) > 0:
+            view = view[os.write(fd, view):]
+
+    return send, lambda: os.close(fd)
+
+def sendAudio(send, data, rate, frameBytes, chunk):
+    """
+    Send audio in real time, each chunk when its last sample is due.
+
+    :param send: Function that sends bytes.
+    :param data: The sample bytes.
+    :param rate: Samples per second.
+    :param frameBytes: Bytes of a sample of all channels.
+    :param chunk: Samples sent at once.
+
+    :return: Returns the monotonic time of the first sample.
+    """
+    start = monotonic()
+    size = chunk * frameBytes
+    for offset in range(0, len(data), size):
+        part = data[offset:offset + size]
+        due = start + (offset + len(part)) / frameBytes / rate
+        wait = due - monotonic()
+        if wait > 0:
+            sleep(wait)
+        send(part)
+    return start
+
+def writeCsv(outfile, data, rate, channels, settings, fps):
+    """
+    Analyze audio the way the light does and write the color of every frame.
+
+    :param outfile: Text file to write to.
+    :param data: The sample bytes.
+    :param rate: Samples per second.
+    :param channels: Number of interleaved channels.
+    :param settings: The Settings with the audio values.
+    :param fps: Frames per second.
+    """
+    from audio import BANDS, AudioAnalyzer
+    analyzer = AudioAnalyzer(rate, channels, settings.audio_window,
+                             settings.audio_attack, settings.audio_decay)
+    size = max(int(rate / fps), 1) * 2 * channels
+    outfile.write(",".join(['time'] + [name for name, _low, _high in BANDS]
+                           + ['red', 'green', 'blue']) + "\n")
+    for offset in range(0, len(data) - size + 1, size):
+        analyzer.add(data[offset:offset + size])
+        color = analyzer.analyze()
+        outfile.write("%.4f,%s,%d,%d,%d\n" % (
+            (offset + size) / (2 * channels) / rate,
+            ",".join("%.4f" % level for level in analyzer.levels),
+            round(color.r), round(color.g), round(color.b)))
+
+def benchAudio(rate, count):
+    """
+    Make the --bench audio, a second of silence and bursts of a bass tone.
+
+    :param rate: Samples per second.
+    :param count: Number of bursts.
+
+    :return: Returns (sample bytes, index of the first sample of each burst).
+    """
+    burst = bytearray()
+    for i in range(int(BENCHBURST * rate)):
+        value = math.sin(2 * math.pi * BENCHTONE * i / rate) * BENCHLEVEL
+        burst += int(value * 32767).to_bytes(2, 'little', signed=True)
+    silence = bytes(int(BENCHGAP * rate) * 2)
+    data = bytearray(bytes(rate * 2))
+    onsets = []
+    for _i in range(count):
+        onsets.append(len(data) // 2)
+        data += burst + silence
+    return bytes(data), onsets
+
+def bench(args, parser):
+    """
+    Measure the sample to PWM latency of rgbfloodlight.py.
+
+    :param args: The parsed command line arguments.
+    :param parser: The argument parser, for errors.
+    """
+    from fakei2c import readframes
+    from jitterbench import (prepareWorkdir, startApplication,
+                             stopApplication)
+    from latencybench import report
+    from minibroker import MiniBroker
+    here = os.path.dirname(os.path.abspath(__file__))
+    script = os.path.join(here, 'rgbfloodlight.py')
+    broker = MiniBroker()
+    broker.start()
+    workdir = tempfile.mkdtemp(prefix='audiosend')
+    frameLog = os.path.join(workdir, 'frames.bin')
+    path = os.path.join(workdir, 'audio')
+    rate = 44100
+    # bursts are apart long enough for the effect to come back between them
+    overrides = {'Broker': '127.0.0.1', 'Port': str(broker.port),
+                 'I2C_Bus': 'fake', 'Audio_Input': args.input,
+                 'Audio_Path': path, 'Audio_Rate': str(rate),
+                 'Audio_Channels': '1', 'Audio_Timeout': '0.5'}
+    for item in args.set:
+        name, sep, value = item.partition('=')
+        if sep == '':
+            parser.error("--set needs NAME=VALUE, not '%s'" % item)
+        overrides[name.strip()] = value.strip()
+    try:
+        try:
+            settings = prepareWorkdir(args.cwd, workdir, overrides)
+        except ValueError as e:
+            sys.exit("Config file error: %s" % e)
+        # the light is off, so only the audio makes the PWM values not 0
+        with open(os.path.join(workdir, 'rgbfloodlightstate.json'),
+                  'w') as outfile:
+            json.dump({'brightness': 255, 'color': [255, 0, 255],
+                       'effect': 'Single Color', 'state': False,
+                       'transition': 120}, outfile)
+        data, onsets = benchAudio(rate, args.count)
+        env = dict(os.environ, RGBFLOODLIGHT_FAKE_I2C_LOG=frameLog)
+        proc, lines, reader, output = startApplication(script, workdir,
+                                                       args.timeout, env)
+        if proc is None:
+            sys.exit("No first frame within %.0f seconds:\n%s"
+                     % (args.timeout, "".join(output)))
+        try:
+            send, close = openTarget(args.input, path)
+            try:
+                start = sendAudio(send, data, rate, 2, args.chunk)
+            finally:
+                close()
+            sleep(0.5)
+        finally:
+            stopApplication(proc, reader, lines, output)
+        frames = readframes(frameLog) if os.path.isfile(frameLog) else []
+    finally:
+        broker.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = []
+    index = 0
+    for onset in onsets:
+        first = start + onset / rate
+        while index < len(frames) and (frames[index][0] < first
+                                       or not any(frames[index][1])):
+            index += 1
+        if (index < len(frames)
+                and frames[index][0] < first + BENCHBURST + BENCHGAP):
+            latencies.append(frames[index][0] - first)
+    print("%d bursts of %.0f Hz on the %s, %d fps, %d sample window, "
+          "%d sample chunks" % (args.count, BENCHTONE, args.input,
+                                settings.led_update_rate,
+                                settings.audio_window, args.chunk))
+    report("Sample to PWM", latencies, args.count)
+    for line in output:
+        if 'audio' in line or 'Audio' in line or 'Live color' in line:
+            print(line.rstrip())
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(
+        description="Send audio to the audio input of an RGB Floodlight.")
+    parser.add_argument('source', nargs='?',
+                        help="16 bit PCM WAV file, - for raw audio on stdin")
+    parser.add_argument('-C', '--cwd', default=here,
+                        help="directory with the config file")
+    parser.add_argument('-i', '--input', choices=['fifo', 'socket'],
+                        help="send to a FIFO or socket (default "
+                             "Audio_Input, socket with --bench)")
+    parser.add_argument('-p', '--path', help="path of the FIFO or socket "
+                                             "(default Audio_Path)")
+    parser.add_argument('--chunk', type=int, default=256,
+                        help="samples sent at once (default 256)")
+    parser.add_argument('--csv', metavar='FILE',
+                        help="analyze the audio and write the colors to "
+                             "this file, - for stdout")
+    parser.add_argument('-r', '--fps', type=float,
+                        help="frames per second for --csv (default "
+                             "LED_Update_Rate)")
+    parser.add_argument('--bench', action='store_true',
+                        help="run rgbfloodlight.py on the simulated I2C bus "
+                             "and measure the sample to PWM latency")
+    parser.add_argument('-n', '--count', type=int, default=20,
+                        help="number of tone bursts for --bench "
+                             "(default 20)")
+    parser.add_argument('-s', '--set', action='append', default=[],
+                        metavar='NAME=VALUE',
+                        help="change a setting for --bench, can be repeated")
+    parser.add_argument('-t', '--timeout', type=float, default=30.0,
+                        help="seconds to wait for the first frame with "
+                             "--bench")
+    args = parser.parse_args()
+    if args.chunk < 1:
+        parser.error("--chunk must be > 0")
+
+    if args.bench:
+        if args.input is None:
+            args.input = 'socket'
+        bench(args, parser)
+        return
+    if args.source is None:
+        parser.error("a WAV file or - is needed")
+    try:
+        settings = loadsettings(os.path.join(args.cwd, 'rgbfloodlight.conf'))
+    except ValueError as e:
+        sys.exit("Config file error: %s" % e)
+    kind = args.input or settings.audio_input
+    path = args.path or settings.audio_path
+    frameBytes = 2 * settings.audio_channels
+    if args.source == '-':
+        if args.csv:
+            data = sys.stdin.buffer.read()
+            rate, channels = settings.audio_rate, settings.audio_channels
+        else:
+            if kind == 'none':
+                parser.error("Audio_Input is none, use --input")
+            send, close = openTarget(kind, path)
+            try:
+                # the player keeps the time, chunks go on as they come
+                while True:
+                    part = sys.stdin.buffer.read(args.chunk * frameBytes)
+                    if not part:
+                        break
+                    send(part)
+            finally:
+                close()
+            return
+    else:
+        try:
+            rate, channels, data = readWav(args.source)
+        except (OSError, ValueError) as e:
+            sys.exit(str(e))
+    if args.csv:
+        fps = args.fps or settings.led_update_rate
+        if fps <= 0:
+            parser.error("--fps must be > 0")
+        if args.csv == '-':
+            writeCsv(sys.stdout, data, rate, channels, settings, fps)
+        else:
+            with open(args.csv, 'w') as outfile:
+                writeCsv(outfile, data, rate, channels, settings, fps)
+        return
+    if rate != settings.audio_rate or channels != settings.audio_channels:
+        sys.exit("'%s' has %d Hz and %d channels, Audio_Rate and "
+                 "Audio_Channels of the light are %d and %d"
+                 % (args.source, rate, channels, settings.audio_rate,
+                    settings.audio_channels))
+    if kind == 'none':
+        parser.error("Audio_Input is none, use --input")
+    send, close = openTarget(kind, path)
+    try:
+        sendAudio(send, data, rate, frameBytes, args.chunk)
+    finally:
+        close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Calibration tool for the RGB Floodlight application.
+#
+# Fits the response curve of each LED channel from light meter readings and
+# writes them to the calibration file named by Calibration_File in the
+# config file. The readings are a CSV file with a channel, pwm and light
+# column, one reading per line, for example...
+#
+#   channel,pwm,light
+#   red,0,0.0
+#   red,512,41.5
+#   red,4095,530.0
+#
+# The light values may be in any unit, each curve is normalized. A matrix
+# already in the calibration file is kept unless --matrix is given.
+
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+
+from calibration import ChannelNames, PWMMAX
+
+def readSamples(filename):
+    """
+    Read light meter readings from a CSV file.
+
+    :param filename: The CSV file with channel, pwm and light columns.
+
+    :return: Dictionary of channel name to a list of (pwm, light) tuples.
+    """
+    samples = {}
+    with open(filename, 'r', newline='') as infile:
+        for row in csv.DictReader(infile):
+            channel = row['channel'].strip().lower()
+            if channel not in ChannelNames:
+                raise ValueError("unknown channel '%s'" % row['channel'])
+            samples.setdefault(channel, []).append(
+                (float(row['pwm']), float(row['light'])))
+    return samples
+
+def fitCurve(samples, points):
+    """
+    Fit a normalized response curve to the readings of one channel.
+
+    Readings at the same pwm value are averaged, light that drops while the
+    pwm value goes up is measurement noise and is flattened, then the curve
+    is sampled at evenly spaced pwm values.
+
+    :param samples: List of (pwm, light) readings.
+    :param points: Number of points in the fitted curve.
+
+    :return: Returns a list of [pwm, light] points with light 0.0 - 1.0.
+    """
+    readings = {}
+    for pwm, light in samples:
+        readings.setdefault(pwm, []).append(light)
+    pwms = sorted(readings)
+    if len(pwms) < 2:
+        raise ValueError("needs readings at two or more pwm values")
+    lights = [sum(readings[pwm]) / len(readings[pwm]) for pwm in pwms]
+    for i in range(1, len(lights)):
+        lights[i] = max(lights[i], lights[i - 1])
+    low = lights[0]
+    high = lights[-1]
+    if high <= low:
+        raise ValueError("light does not change with pwm")
+    lights = [(light - low) / (high - low) for light in lights]
+    curve = []
+    j = 1
+    for i in range(points):
+        pwm = pwms[0] + (pwms[-1] - pwms[0]) * i / (points - 1)
+        while j < len(pwms) - 1 and pwms[j] < pwm:
+            j += 1
+        bias = (pwm - pwms[j - 1]) / (pwms[j] - pwms[j - 1])
+        bias = min(max(bias, 0.0), 1.0)
+        light = lights[j - 1] + (lights[j] - lights[j - 1]) * bias
+        curve.append([round(pwm), round(light, 5)])
+    return curve
+
+def fitExponent(curve):
+    """
+    Fit light = (pwm / PWMMAX) ** exponent to a curve.
+
+    :param curve: List of [pwm, light] points.
+
+    :return: Returns the exponent, 1.0 is a linear response.
+    """
+    x = []
+    y = []
+    for pwm, light in curve:
+        if pwm > 0 and light > 0:
+            x.append(math.log(pwm / PWMMAX))
+            y.append(math.log(light))
+    # least squares through the origin of the log-log plot
+    sxx = sum(v * v for v in x)
+    if sxx == 0:
+        return 1.0
+    return sum(a * b for a, b in zip(x, y)) / sxx
+
+def parseMatrix(text):
+    """
+    Parse a matrix written as rows separated by ';' of values separated by
+    ','.
+
+    :param text: The matrix text, for example '1,0,0;0,0.9,0;0,0,1'.
+
+    :return: Returns the matrix as a list of rows.
+    """
+    matrix = [[float(value) for value in row.split(',')]
+              for row in text.split(';')]
+    if (len(matrix) not in (3, 4)
+            or any(len(row) != len(matrix) for row in matrix)):
+        raise ValueError("matrix must be 3x3 or 4x4")
+    return matrix
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fit RGB Floodlight response curves from light meter "
+                    "readings.")
+    parser.add_argument('samples', help="CSV file with channel, pwm and "
+                                        "light columns")
+    parser.add_argument('-o', '--output', default='rgbfloodlightcal.json',
+                        help="calibration file to write "
+                             "(default rgbfloodlightcal.json)")
+    parser.add_argument('-p', '--points', type=int, default=17,
+                        help="points in each fitted curve (default 17)")
+    parser.add_argument('-m', '--matrix',
+                        help="color correction matrix, rows separated by "
+                             "';' and values by ','")
+    args = parser.parse_args()
+    if args.points < 2:
+        parser.error("--points must be 2 or more")
+
+    data = {}
+    if os.path.exists(args.output):
+        with open(args.output, 'r') as infile:
+            data = json.load(infile)
+    try:
+        if args.matrix is not None:
+            data['matrix'] = parseMatrix(args.matrix)
+        samples = readSamples(args.samples)
+        curves = data.get('curves', {})
+        for channel in ChannelNames:
+            if channel not in samples:
+                continue
+            try:
+                curves[channel] = fitCurve(samples[channel], args.points)
+            except ValueError as e:
+                raise ValueError("%s: %s" % (channel, e))
+            print("%-6s %3d readings, response exponent %.2f"
+                  % (channel, len(samples[channel]),
+                     fitExponent(curves[channel])))
+        data['curves'] = curves
+    except (KeyError, ValueError) as e:
+        print("calibrate: %s" % e, file=sys.stderr)
+        sys.exit(1)
+    with open(args.output, 'w') as outfile:
+        json.dump(data, outfile, indent=2)
+    print("Wrote %s" % args.output)
+
+if __name__ == '__main__':
+    main()
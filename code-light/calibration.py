@@ -0,0 +1,302 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# A calibration file is JSON and looks like this...
+#
+# {
+#   "matrix": [[1.0, 0.0, 0.0],
+#              [0.05, 0.9, 0.0],
+#              [0.0, 0.0, 1.0]],
+#   "curves": {
+#     "red": [[0, 0.0], [1024, 0.21], [2048, 0.47], [4095, 1.0]],
+#     "green": [[0, 0.0], [2048, 0.52], [4095, 1.0]]
+#   }
+# }
+#
+# The matrix mixes the gamma corrected (linear light) red, green and blue
+# into the output channels, one row per output channel. A 4x4 matrix drives
+# a fourth (white) channel and its fourth column mixes in the white part of
+# the color, the smallest of red, green and blue. The curves are the
+# measured light output of each channel for a pwm value, see calibrate.py.
+# Channels without a curve are assumed to be linear.
+#
+import bisect
+import json
+import logging
+import math
+
+# logger for this module
+logger = logging.getLogger(__name__)
+
+# full scale pwm value
+PWMMAX = 4095
+# full scale of the linear light values inside the tables
+LINEARMAX = 4095
+# extra fraction bits kept when mixing channels
+MIXBITS = 4
+# lookup table inputs, color values 0 - 255 are indexed in steps of 1/16
+INSTEPS = 4080
+INSCALE = INSTEPS / 255
+
+ChannelNames = ['red', 'green', 'blue', 'white']
+
+def isnumber(value):
+    """Check for a finite JSON number, true and false are not numbers."""
+    return (isinstance(value, (int, float)) and not isinstance(value, bool)
+            and math.isfinite(value))
+
+def loadcalibration(filename):
+    """
+    Load a calibration file.
+
+    :param filename: The JSON calibration file.
+
+    :return: Returns a (matrix, curves) tuple. Raises ValueError when the
+             file is not valid.
+    """
+    with open(filename, 'r') as infile:
+        data = json.load(infile)
+    if not isinstance(data, dict):
+        raise ValueError("the file must hold a JSON object")
+    matrix = data.get('matrix')
+    if matrix is not None:
+        if (not isinstance(matrix, list) or len(matrix) not in (3, 4)
+                or any(not isinstance(row, list) or len(row) != len(matrix)
+                       or not all(isnumber(value) for value in row)
+                       for row in matrix)):
+            raise ValueError("matrix must be 3x3 or 4x4 numbers")
+        matrix = [[float(value) for value in row] for row in matrix]
+    definitions = data.get('curves', {})
+    if not isinstance(definitions, dict):
+        raise ValueError("'curves' must be an object")
+    curves = {}
+    for name, points in definitions.items():
+        if name not in ChannelNames:
+            raise ValueError("curve '%s' is not one of %s"
+                             % (name, ", ".join(ChannelNames)))
+        if (not isinstance(points, list) or len(points) < 2
+                or any(not isinstance(p, list) or len(p) != 2
+                       or not isnumber(p[0]) or not isnumber(p[1])
+                       for p in points)):
+            raise ValueError("curve '%s' needs at least two [pwm, light] "
+                             "points" % name)
+        curve = sorted((float(p[0]), float(p[1])) for p in points)
+        if max(p[1] for p in curve) <= curve[0][1]:
+            raise ValueError("curve '%s' has no range" % name)
+        curves[name] = curve
+    return matrix, curves
+
+def inversecurve(points):
+    """
+    Make a table from linear light to pwm from a measured response curve.
+
+    :param points: Sorted list of (pwm, light) measurements.
+
+    :return: Returns a list of LINEARMAX + 1 pwm values.
+    """
+    pwms = [p[0] for p in points]
+    lights = [p[1] for p in points]
+    # light output must not decrease with pwm, measurement noise can do that
+    for i in range(1, len(lights)):
+        lights[i] = max(lights[i], lights[i - 1])
+    low = lights[0]
+    high = lights[-1]
+    if high <= low:
+        raise ValueError("curve has no range")
+    lights = [(light - low) / (high - low) for light in lights]
+    table = []
+    for i in range(LINEARMAX + 1):
+        target = i / LINEARMAX
+        # find the measurements around the target light output
+        j = bisect.bisect_left(lights, target)
+        if j == 0:
+            pwm = pwms[0]
+        elif j >= len(lights):
+            pwm = pwms[-1]
+        else:
+            span = lights[j] - lights[j - 1]
+            if span > 0:
+                bias = (target - lights[j - 1]) / span
+            else:
+                bias = 0.0
+            pwm = pwms[j - 1] + (pwms[j] - pwms[j - 1]) * bias
+        table.append(pwm / PWMMAX)
+    return table
+
+"""Color correction compiled into integer lookup tables."""
+class Calibration:
+    def __init__(self, gamma=1.0, scales=(1.0, 1.0, 1.0), matrix=None,
+                 curves=None):
+        """
+        Compile the color correction.
+
+        :param gamma: Gamma value used for gamma correction.
+                      A value of 1 means no correction.
+        :param scales: Scale factor for each output channel.
+        :param matrix: 3x3 or 4x4 color correction matrix, rows are output
+                       channels. None is the identity matrix.
+        :param curves: Dictionary of channel name to the measured response
+                       curve, a sorted list of (pwm, light) points.
+        """
+        if matrix is None:
+            matrix = [[1.0 if row == col else 0.0 for col in range(3)]
+                      for row in range(3)]
+        if curves is None:
+            curves = {}
+        self.channels = len(matrix)
+        scales = list(scales) + [1.0] * (self.channels - len(scales))
+        # input color value 0 - 255 to linear light
+        linear = [(i / INSTEPS) ** gamma for i in range(INSTEPS + 1)]
+        # linear light to pwm for each output channel
+        responses = []
+        for i in range(self.channels):
+            name = ChannelNames[i]
+            if name in curves:
+                inverse = inversecurve(curves[name])
+            else:
+                inverse = [j / LINEARMAX for j in range(LINEARMAX + 1)]
+            responses.append(inverse)
+        diagonal = all(matrix[row][col] == 0.0
+                       for row in range(len(matrix))
+                       for col in range(len(matrix)) if row != col)
+        self.diagonal = diagonal and self.channels == 3
+        if self.diagonal:
+            # one table per channel does everything
+            self._tables = []
+            for i in range(3):
+                gain = matrix[i][i] * scales[i]
+                response = responses[i]
+                self._tables.append([
+                    int(round(PWMMAX * min(response[
+                        int(round(min(value * gain, 1.0) * LINEARMAX))],
+                        1.0)))
+                    for value in linear])
+            # pad so rounding errors at full scale stay inside the table
+            for table in self._tables:
+                table.append(table[-1])
+        else:
+            # the mix tables include the gamma correction, the white input
+            # is already linear light
+            one = 1 << MIXBITS
+            self._mix = []
+            for row in range(self.channels):
+                tables = []
+                for col in range(3):
+                    gain = matrix[row][col]
+                    table = [int(round(value * gain * LINEARMAX * one))
+                             for value in linear]
+                    table.append(table[-1])
+                    tables.append(table)
+                if self.channels == 4:
+                    gain = matrix[row][3]
+                    tables.append([int(round(j * gain * one))
+                                   for j in range(LINEARMAX + 1)])
+                self._mix.append(tables)
+            self._linear = [int(round(value * LINEARMAX)) for value in linear]
+            self._linear.append(self._linear[-1])
+            self._responses = []
+            for i in range(self.channels):
+                response = responses[i]
+                self._responses.append([
+                    int(round(PWMMAX * min(response[j] * scales[i], 1.0)))
+                    for j in range(LINEARMAX + 1)])
+        # numpy copies of the tables for applyarray()
+        self._arrays = None
+
+    def apply(self, r, g, b):
+        """
+        Get the pwm values for a color.
+
+        :param r: Red value 0 - 255.
+        :param g: Green value 0 - 255.
+        :param b: Blue value 0 - 255.
+
+        :return: Returns a list of pwm values, one for each output channel.
+                 Values outside 0 - 255 are clamped.
+        """
+        ir = min(max(int(r * INSCALE + 0.5), 0), INSTEPS)
+        ig = min(max(int(g * INSCALE + 0.5), 0), INSTEPS)
+        ib = min(max(int(b * INSCALE + 0.5), 0), INSTEPS)
+        if self.diagonal:
+            tables = self._tables
+            return [tables[0][ir], tables[1][ig], tables[2][ib]]
+        if self.channels == 4:
+            linear = self._linear
+            white = min(linear[ir], linear[ig], linear[ib])
+        values = []
+        for i in range(self.channels):
+            mix = self._mix[i]
+            value = mix[0][ir] + mix[1][ig] + mix[2][ib]
+            if self.channels == 4:
+                value += mix[3][white]
+            value >>= MIXBITS
+            if value < 0:
+                value = 0
+            elif value > LINEARMAX:
+                value = LINEARMAX
+            values.append(self._responses[i][value])
+        return values
+
+    def applyarray(self, r, g, b):
+        """
+        Get the pwm values of many colors at once, the same values apply()
+        returns for each. Needs numpy.
+
+        :param r: numpy array of red values 0 - 255.
+        :param g: numpy array of green values 0 - 255.
+        :param b: numpy array of blue values 0 - 255.
+
+        :return: Returns a numpy array with a row of pwm values for each
+                 color. Values outside 0 - 255 are clamped.
+        """
+        import numpy
+        if self._arrays is None:
+            # the lookup tables as arrays, made on the first call
+            if self.diagonal:
+                self._arrays = [numpy.array(table) for table in self._tables]
+            else:
+                self._arrays = ([[numpy.array(table) for table in tables]
+                                 for tables in self._mix],
+                                numpy.array(self._linear),
+                                [numpy.array(response)
+                                 for response in self._responses])
+        ir = numpy.clip(r * INSCALE + 0.5, 0, INSTEPS).astype(numpy.intp)
+        ig = numpy.clip(g * INSCALE + 0.5, 0, INSTEPS).astype(numpy.intp)
+        ib = numpy.clip(b * INSCALE + 0.5, 0, INSTEPS).astype(numpy.intp)
+        if self.diagonal:
+            tables = self._arrays
+            return numpy.stack([tables[0][ir], tables[1][ig],
+                                tables[2][ib]], axis=1)
+        mixes, linear, responses = self._arrays
+        if self.channels == 4:
+            white = numpy.minimum(numpy.minimum(linear[ir], linear[ig]),
+                                  linear[ib])
+        values = numpy.empty((len(ir), self.channels), dtype=numpy.int64)
+        for i in range(self.channels):
+            mix = mixes[i]
+            value = mix[0][ir] + mix[1][ig] + mix[2][ib]
+            if self.channels == 4:
+                value += mix[3][white]
+            value >>= MIXBITS
+            numpy.clip(value, 0, LINEARMAX, out=value)
+            values[:, i] = responses[i][value]
+        return values
@@ -21,27 +21,132 @@
 # SOFTWARE.
 #
 from collections import namedtuple
+import colorsys
+
+# color spaces Color.blend() can blend in
+BlendModes = ['srgb', 'linear', 'hsv', 'oklab']
+
+def _decode(value):
+    """Convert a sRGB value 0.0 - 1.0 to linear light 0.0 - 1.0."""
+    if value <= 0.04045:
+        return value / 12.92
+    return ((value + 0.055) / 1.055) ** 2.4
+
+def _encode(value):
+    """Convert linear light 0.0 - 1.0 to a sRGB value 0.0 - 1.0."""
+    if value <= 0.0031308:
+        return value * 12.92
+    return 1.055 * (value ** (1 / 2.4)) - 0.055
+
+# sRGB to linear light for every 8-bit value
+SRGBTOLINEAR = [_decode(i / 255) for i in range(256)]
+# linear light to sRGB 0 - 255, indexed by linear light times LINEARSTEPS
+LINEARSTEPS = 4095
+LINEARTOSRGB = [_encode(i / LINEARSTEPS) * 255
+                for i in range(LINEARSTEPS + 1)]
+
+def tolinear(value):
+    """Convert a sRGB value 0 - 255 to linear light 0.0 - 1.0."""
+    return SRGBTOLINEAR[int(min(max(value, 0), 255) + 0.5)]
+
+def fromlinear(value):
+    """Convert linear light 0.0 - 1.0 to a sRGB value 0 - 255."""
+    return LINEARTOSRGB[int(min(max(value, 0.0), 1.0) * LINEARSTEPS + 0.5)]
+
+def tooklab(color):
+    """Convert a Color to an OKLab (L, a, b) tuple."""
+    r = tolinear(color.r)
+    g = tolinear(color.g)
+    b = tolinear(color.b)
+    l = (0.4122214708 * r + 0.5363325363 * g + 0.0514459929 * b) ** (1 / 3)
+    m = (0.2119034982 * r + 0.6806995451 * g + 0.1073969566 * b) ** (1 / 3)
+    s = (0.0883024619 * r + 0.2817188376 * g + 0.6299787005 * b) ** (1 / 3)
+    return (0.2104542553 * l + 0.7936177850 * m - 0.0040720468 * s,
+            1.9779984951 * l - 2.4285922050 * m + 0.4505937099 * s,
+            0.0259040371 * l + 0.7827717662 * m - 0.8086757660 * s)
+
+def fromoklab(lab):
+    """Convert an OKLab (L, a, b) tuple to a Color."""
+    l = (lab[0] + 0.3963377774 * lab[1] + 0.2158037573 * lab[2]) ** 3
+    m = (lab[0] - 0.1055613458 * lab[1] - 0.0638541728 * lab[2]) ** 3
+    s = (lab[0] - 0.0894841775 * lab[1] - 1.2914855480 * lab[2]) ** 3
+    return Color(
+        fromlinear(4.0767416621 * l - 3.3077115913 * m + 0.2309699292 * s),
+        fromlinear(-1.2684380046 * l + 2.6097574011 * m - 0.3413193965 * s),
+        fromlinear(-0.0041960863 * l - 0.7034186147 * m + 1.7076147010 * s))
+
+def levelcolor(levels, address, channels):
+    """
+    Get the color of the DMX levels of a fixture.
+
+    :param levels: The DMX levels of the universe.
+    :param address: DMX address 1 - 512 of the first channel.
+    :param channels: 3 for red, green and blue or 4 with white. White is
+                     added to all three, a 4 channel calibration puts it on
+                     the white LEDs.
+
+    :return: Returns the Color, levels missing from a short packet are 0.
+    """
+    values = list(levels[address - 1:address - 1 + channels])
+    values += [0] * (channels - len(values))
+    if channels == 4:
+        white = values[3]
+        return Color(min(values[0] + white, 255), min(values[1] + white, 255),
+                     min(values[2] + white, 255))
+    return Color(values[0], values[1], values[2])
 
 """RGB color tuple."""
 class Color(namedtuple('Color', 'r g b')):
 
-    def blend(self, other, bias):
+    def blend(self, other, bias, mode='srgb'):
         """
         Return a new color, interpolated between this color and other color by
         an amount specified by blend, which ranges from 0.0 (entirely
         this color) to 1.0 (entirely other color).
+
+        Only the default 'srgb' mode is fast enough to use every frame. The
+        other modes convert both colors on every call and are meant for
+        computing color tables ahead of time.
+
         :param other: The other color interpolate between.
         :param bias: The blend between colors range 0.0 - 1.0
+        :param mode: Color space to blend in, one of BlendModes.
         """
         if bias > 1.0:
             tobias = 1.0
         else:
             tobias = bias
         frombias = 1.0 - tobias
-        red = self.r * frombias + other.r * tobias
-        green = self.g * frombias + other.g * tobias
-        blue = self.b * frombias + other.b * tobias
-        return Color(red, green, blue)
+        if mode == 'srgb':
+            red = self.r * frombias + other.r * tobias
+            green = self.g * frombias + other.g * tobias
+            blue = self.b * frombias + other.b * tobias
+            return Color(red, green, blue)
+        if mode == 'linear':
+            return Color(*[fromlinear(tolinear(a) * frombias
+                                      + tolinear(b) * tobias)
+                           for a, b in zip(self, other)])
+        if mode == 'oklab':
+            a = tooklab(self)
+            b = tooklab(other)
+            return fromoklab([x * frombias + y * tobias
+                              for x, y in zip(a, b)])
+        if mode == 'hsv':
+            a = colorsys.rgb_to_hsv(*[c / 255 for c in self])
+            b = colorsys.rgb_to_hsv(*[c / 255 for c in other])
+            # a color without saturation takes the hue of the other color
+            ha = a[0] if a[1] > 0 else b[0]
+            hb = b[0] if b[1] > 0 else ha
+            # go around the hue circle the short way
+            if hb - ha > 0.5:
+                ha += 1.0
+            elif ha - hb > 0.5:
+                hb += 1.0
+            hsv = ((ha * frombias + hb * tobias) % 1.0,
+                   a[1] * frombias + b[1] * tobias,
+                   a[2] * frombias + b[2] * tobias)
+            return Color(*[c * 255 for c in colorsys.hsv_to_rgb(*hsv)])
+        raise ValueError("Blend mode must be one of %s" % ", ".join(BlendModes))
 
     def gamma(self, gamma=2.8, max=255):
         """
@@ -0,0 +1,213 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Binary live color stream for the RGB Floodlight application.
+#
+# Frames on the stream topic of the light or its group skip the JSON
+# command path. A frame is a STREAMHEADER, the number of channels (3 for
+# red, green and blue or 4 with white), the number of fixtures and a
+# timestamp in seconds of the sender's clock, followed by the levels 0 - 255
+# of every fixture...
+#
+#   struct.pack('<BBd', 3, 2, time()) + bytes([255, 0, 0, 0, 0, 255])
+#
+# A frame with one fixture is for every light that gets it, of a frame with
+# several fixtures each light takes the Stream_Fixture one. A timestamp of 0
+# turns the check for frames that arrive out of order off.
+#
+# The MQTT thread hands the frames to the renderer through a datagram
+# socket pair made before a render process is forked, so the renderer can
+# wait for them together with its other inputs.
+#
+import logging
+import socket
+import struct
+from time import monotonic
+
+from color import levelcolor
+
+# logger for this module
+logger = logging.getLogger(__name__)
+
+# channels, fixtures and the timestamp of a frame
+STREAMHEADER = struct.Struct('<BBd')
+# largest frame, 255 fixtures of 4 channels
+MAXFRAME = STREAMHEADER.size + 4 * 255
+# monotonic time the MQTT thread got the frame
+RECEIVED = struct.Struct('<d')
+# frames up to this many seconds older than the newest are out of order
+REORDERWINDOW = 1.0
+
+def streamframe(colors, timestamp=0.0, channels=3):
+    """
+    Build a stream frame.
+
+    :param colors: List of the level tuples of the fixtures, 3 or 4 values
+                   0 - 255 each.
+    :param timestamp: Time of the frame in seconds, 0 for none.
+    :param channels: 3 for red, green and blue or 4 with white.
+
+    :return: Returns the frame bytes.
+    """
+    levels = bytearray()
+    for color in colors:
+        levels += bytes(color[:channels])
+    return STREAMHEADER.pack(channels, len(colors), timestamp) + levels
+
+def readstream(frame, fixture):
+    """
+    Get the color of a fixture from a stream frame.
+
+    :param frame: The frame bytes.
+    :param fixture: Number 1 - 255 of the fixture.
+
+    :return: Returns the (timestamp, Color) tuple, None for a malformed
+             frame or one without the fixture.
+    """
+    if len(frame) < STREAMHEADER.size:
+        return None
+    channels, fixtures, timestamp = STREAMHEADER.unpack_from(frame)
+    if (channels not in (3, 4)
+            or len(frame) < STREAMHEADER.size + channels * fixtures):
+        return None
+    if fixtures == 1:
+        fixture = 1
+    elif not 1 <= fixture <= fixtures:
+        return None
+    address = (fixture - 1) * channels + 1
+    return timestamp, levelcolor(frame[STREAMHEADER.size:], address,
+                                 channels)
+
+"""Passes stream frames from the MQTT thread to the renderer."""
+class StreamInput:
+    name = 'Stream frame'
+
+    def __init__(self, fixture=1, timeout=2.5):
+        """
+        Make the socket pair.
+
+        :param fixture: Number of the fixture of the light.
+        :param timeout: Seconds without frames after which the stream has
+                        stopped.
+        """
+        self._reader, self._writer = socket.socketpair(socket.AF_UNIX,
+                                                       socket.SOCK_DGRAM)
+        self._reader.setblocking(False)
+        self._writer.setblocking(False)
+        self.fixture = fixture
+        self.timeout = timeout
+        self._timestamp = 0.0
+        self.color = None
+        self.received = 0.0
+        self.packets = 0
+        self.outoforder = 0
+        self.ignored = 0
+        # frames lost because the renderer fell behind, main process only
+        self.overflows = 0
+
+    def send(self, frame):
+        """
+        Hand a frame to the renderer, called from the MQTT thread. Frames
+        longer than MAXFRAME are dropped.
+
+        :param frame: The frame bytes.
+        """
+        if len(frame) > MAXFRAME:
+            self.ignored += 1
+            logger.warning("Dropped a %d byte stream frame, the most is %d "
+                           "bytes", len(frame), MAXFRAME)
+            return
+        try:
+            self._writer.send(RECEIVED.pack(monotonic()) + frame)
+        except BlockingIOError:
+            self.overflows += 1
+
+    def fileno(self):
+        """
+        Get the socket the renderer waits on.
+
+        :return: Returns the file descriptor.
+        """
+        return self._reader.fileno()
+
+    def close(self):
+        """Close the socket pair."""
+        self._reader.close()
+        self._writer.close()
+
+    def receive(self):
+        """
+        Read the waiting frames.
+
+        :return: Returns True when the color was changed, color is the
+                 latest color and received the monotonic time the MQTT
+                 thread got it.
+        """
+        changed = False
+        while True:
+            try:
+                # one byte more so a frame that is too long shows
+                data = self._reader.recv(RECEIVED.size + MAXFRAME + 1)
+            except (BlockingIOError, InterruptedError):
+                break
+            if len(data) < RECEIVED.size:
+                continue
+            if len(data) > RECEIVED.size + MAXFRAME:
+                self.ignored += 1
+                logger.warning("Ignored a stream frame of more than %d bytes",
+                               MAXFRAME)
+                continue
+            result = readstream(data[RECEIVED.size:], self.fixture)
+            if result is None:
+                self.ignored += 1
+                continue
+            timestamp, color = result
+            if (timestamp > 0
+                    and 0 < self._timestamp - timestamp < REORDERWINDOW):
+                self.outoforder += 1
+                continue
+            self._timestamp = timestamp
+            self.packets += 1
+            self.color = color
+            self.received = RECEIVED.unpack_from(data)[0]
+            changed = True
+        return changed
+
+    def expire(self, now):
+        """
+        Check whether the stream is still sending.
+
+        :param now: The monotonic time.
+
+        :return: Returns True while frames arrive.
+        """
+        return self.packets > 0 and now - self.received <= self.timeout
+
+    @property
+    def sources(self):
+        """
+        The sources property.
+
+        :return: The names of the sources sending.
+        """
+        return ['the stream topic']
@@ -22,49 +22,104 @@
 #
 from color import Color
 import color
+from bisect import bisect_right
+from collections import OrderedDict
 import math
 import logging
 
 # logger for this module
 logger = logging.getLogger(__name__)
 
-WheelList = ['Single Color', 'Single Color Bounce', 'Primary Bounce',
-             'Primary Blend', 'Rainbow Bounce', 'Rainbow Blend', 'Christmas',
-             'Halloween']
+# number of colors in a compiled color wheel table
+TABLESIZE = 2048
+# longest color wheel name in UTF-8 bytes, the render process passes the
+# name in a field of this size
+MAXNAMEBYTES = 128
+
+# registered color wheels by name, see registercolorwheel()
+Registry = {}
+# names of the registered color wheels in the order they were registered
+WheelList = []
+# most recently used color wheels by (name, color, mode)
+WheelCache = OrderedDict()
+WHEELCACHESIZE = 32
+
+def registercolorwheel(name, factory, usescolor=False, usesmode=False):
+    """
+    Registers a color wheel under a name.
+
+    This is also how plugins add color wheels. The factory is only called
+    when a wheel isn't already cached, so the wheels it returns must not
+    change after they are created.
+
+    :param name: Name of the color wheel, shown in the Home Assistant
+                 effect list.
+    :param factory: Function factory(color, mode) that returns a ColorWheel.
+    :param usescolor: True when the wheel depends on the commanded color.
+    :param usesmode: True when the wheel depends on the blend mode.
+    """
+    if name in Registry:
+        raise ValueError("ColorWheel '%s' already exists" % name)
+    if len(name.encode('utf-8')) > MAXNAMEBYTES:
+        raise ValueError("ColorWheel name '%s' is longer than %d bytes"
+                         % (name, MAXNAMEBYTES))
+    Registry[name] = (factory, usescolor, usesmode)
+    WheelList.append(name)
 
 def getcolorwheellist():
     """Gets a list of color wheel names."""
     return WheelList
 
-def getcolorwheelfromname(name, color):
-    """Gets an initialized ColorWheel from name and color."""
-    if name not in WheelList:
-        raise ValueError("Name is not a valid ColorWheel")
+def iscolorwheel(name):
+    """Returns True if name is a registered color wheel."""
+    return name in Registry
+
+def compilewheel(wheel, size=TABLESIZE):
+    """
+    Computes a color wheel into a TableWheel.
+
+    :param wheel: The ColorWheel to compute.
+    :param size: Number of colors in the table.
+
+    :return: Returns a TableWheel with the colors of wheel.
+    """
+    return TableWheel([wheel.getrgb(i * 360 / size) for i in range(size)])
+
+def getcolorwheelfromname(name, color, mode='srgb'):
+    """
+    Gets an initialized ColorWheel from name and color.
 
-    if name == WheelList[0]:
-        # Single Color
-        return ColorBlendWheel([color])
-    if name == WheelList[1]:
-        # Single Color Bounce
-        return ColorBounceWheel([color, color])
-    if name == WheelList[2]:
-        # Primary Bounce
-        return PrimaryBounceWheel()
-    if name == WheelList[3]:
-        # Primary Blend
-        return PrimaryBlendWheel()
-    if name == WheelList[4]:
-        # Rainbow Bounce
-        return RainbowBounceWheel()
-    if name == WheelList[5]:
-        # Rainbow Blend
-        return RainbowBlendWheel()
-    if name == WheelList[6]:
-        # Christmas
-        return ChristmasBounceWheel()
-    if name == WheelList[7]:
-        # Halloween
-        return HalloweenBounceWheel()
+    Wheels are cached by the name and only the color and blend mode the
+    wheel depends on, so switching back to a recent effect doesn't create
+    it again.
+
+    :param name: Name of the color wheel.
+    :param color: Color used by the single color wheels.
+    :param mode: Color space the blend wheels blend in, see BlendModes.
+    """
+    try:
+        factory, usescolor, usesmode = Registry[name]
+    except KeyError:
+        raise ValueError("Name is not a valid ColorWheel")
+    key = (name, color if usescolor else None, mode if usesmode else None)
+    wheel = WheelCache.get(key)
+    if wheel is None:
+        wheel = factory(color, mode)
+        WheelCache[key] = wheel
+        if len(WheelCache) > WHEELCACHESIZE:
+            WheelCache.popitem(last=False)
+    else:
+        WheelCache.move_to_end(key)
+    return wheel
+
+def _blendwheel(wheelclass):
+    """Make a factory for a blend wheel that is compiled unless 'srgb'."""
+    def factory(color, mode):
+        if mode != 'srgb':
+            # other color spaces are too slow to blend every frame
+            return compilewheel(wheelclass(mode))
+        return wheelclass()
+    return factory
 
 class ColorWheel:
     """Base class for Color Wheel. Cannot be used directly. """
@@ -79,6 +134,15 @@ class ColorWheel:
         """
         raise NotImplementedError
 
+    def cursor(self):
+        """
+        Get a wheel with the same colors for one caller to use frame after
+        frame. Wheels that keep no state between calls return themselves.
+
+        :return: Returns a ColorWheel.
+        """
+        return self
+
 
 class PrimarySineWheel(ColorWheel):
     def getrgb(self, angle):
@@ -120,10 +184,12 @@ class PrimarySineWheel(ColorWheel):
 
 class ColorBlendWheel(ColorWheel):
     """Color Wheel that will blend between colors in a list."""
-    def __init__(self, colors):
+    def __init__(self, colors, mode='srgb'):
         # Save list of colors. It is expected that the first and last
         # colors are the same
         self._colors = colors
+        # color space to blend in, only 'srgb' is fast enough for each frame
+        self._mode = mode
 
     def getrgb(self, angle):
         """
@@ -150,34 +216,180 @@ class ColorBlendWheel(ColorWheel):
         fromColor = self._colors[sectionCurrent]
         toColor = self._colors[sectionCurrent + 1]
         # get RGB color
-        color = fromColor.blend(toColor, sectionBias)
+        color = fromColor.blend(toColor, sectionBias, self._mode)
         #print("∠=%.2f S∠=%.2f S=%d Bias=%.2f C=(%s)" % (value, sectionValue,
         #      sectionCurrent, sectionBias, color))
         return(color)
 
 
+class KeyframeWheel(ColorWheel):
+    """Color Wheel that will blend between colors placed at any angle."""
+    def __init__(self, colors, positions=None, easing=None, mode='srgb'):
+        """
+        Initialize the wheel.
+
+        :param colors: List of colors.
+        :param positions: Increasing list of angles in the range 0 - 360, one
+                          for each color. Evenly spaced when not specified.
+                          The colors wrap around from the last to the first
+                          when the positions don't cover 0 - 360.
+        :param easing: Optional function that shapes the blend between two
+                       colors, it maps 0.0 - 1.0 to 0.0 - 1.0.
+        :param mode: Color space to blend in, see color.BlendModes. Only
+                     'srgb' is fast enough to use every frame, use
+                     compilewheel() for the others.
+        """
+        if positions is None:
+            positions = [i * 360 / (len(colors) - 1)
+                         for i in range(len(colors))]
+        if len(positions) != len(colors) or len(colors) < 2:
+            raise ValueError("Need at least two colors and one position for "
+                             "each color")
+        colors = list(colors)
+        positions = list(positions)
+        # wrap around so every angle 0 - 360 is inside a segment
+        if positions[0] > 0:
+            colors.insert(0, colors[-1])
+            positions.insert(0, positions[-1] - 360)
+        if positions[-1] < 360:
+            colors.append(colors[1] if positions[0] < 0 else colors[0])
+            positions.append((positions[1] if positions[0] < 0
+                              else positions[0]) + 360)
+        self._colors = colors
+        self._positions = positions
+        self._last = len(positions) - 2
+        # precompute the segment widths so getrgb() doesn't divide by them
+        self._scales = [1 / (positions[i + 1] - positions[i])
+                        for i in range(len(positions) - 1)]
+        self._easing = easing
+        self._mode = mode
+
+    def segment(self, value, hint=-1):
+        """
+        Find the segment of the keyframes an angle is in.
+
+        :param value: Angle range 0 - 360.
+        :param hint: Segment to try before searching, -1 for none.
+
+        :return: Returns the index of the first keyframe of the segment.
+        """
+        positions = self._positions
+        if 0 <= hint <= self._last and (positions[hint] <= value
+                                        < positions[hint + 1]):
+            return hint
+        segment = bisect_right(positions, value) - 1
+        if segment > self._last:
+            segment = self._last
+        elif segment < 0:
+            segment = 0
+        return segment
+
+    def blend(self, value, segment):
+        """
+        Blend the two keyframes of a segment.
+
+        :param value: Angle range 0 - 360.
+        :param segment: The segment the angle is in, see segment().
+
+        :return: Returns RGB color for specified angle.
+        """
+        bias = (value - self._positions[segment]) * self._scales[segment]
+        if self._easing is not None:
+            bias = self._easing(bias)
+        return self._colors[segment].blend(self._colors[segment + 1], bias,
+                                           self._mode)
+
+    def getrgb(self, angle):
+        """
+        Get a blend RGB color from the keyframes using an angle.
+
+        The segment is found by a binary search, the wheel itself keeps no
+        state between calls so it can be shared. Use cursor() to find the
+        segment of consecutive frames without a search.
+
+        :param angle: Angle range 0 - 360.
+
+        :return: Returns RGB color for specified angle.
+        """
+        value = angle % 360
+        return self.blend(value, self.segment(value))
+
+    def cursor(self):
+        """
+        Get a KeyframeCursor on the wheel for one caller.
+
+        :return: Returns a KeyframeCursor.
+        """
+        return KeyframeCursor(self)
+
+
+"""Remembers the KeyframeWheel segment of the previous call of one caller."""
+class KeyframeCursor(ColorWheel):
+    def __init__(self, wheel):
+        """
+        Initialize the cursor.
+
+        Consecutive frames nearly always land in the same segment so it is
+        tried first, otherwise the segment is found by a binary search.
+
+        :param wheel: The KeyframeWheel, it is not changed.
+        """
+        self._wheel = wheel
+        self._segment = -1
+
+    def getrgb(self, angle):
+        """
+        Get a blend RGB color from the keyframes using an angle.
+
+        :param angle: Angle range 0 - 360.
+
+        :return: Returns RGB color for specified angle.
+        """
+        value = angle % 360
+        self._segment = self._wheel.segment(value, self._segment)
+        return self._wheel.blend(value, self._segment)
+
+
 class PrimaryBlendWheel(ColorBlendWheel):
     """Color Wheel that will blend between primary colors."""
-    def __init__(self):
-        super().__init__(Color.Primary)
+    def __init__(self, mode='srgb'):
+        super().__init__(Color.Primary, mode)
 
 
 class RainbowBlendWheel(ColorBlendWheel):
     """Color Wheel that will blend between rainbow colors."""
-    def __init__(self):
-        super().__init__(Color.Rainbow)
+    def __init__(self, mode='srgb'):
+        super().__init__(Color.Rainbow, mode)
 
 
 class ChristmasBlendWheel(ColorBlendWheel):
     """Color Wheel that will blend between Christmas colors."""
-    def __init__(self):
-        super().__init__(Color.Christmas)
+    def __init__(self, mode='srgb'):
+        super().__init__(Color.Christmas, mode)
 
 
 class HalloweenBlendWheel(ColorBlendWheel):
     """Color Wheel that will blend between Halloween colors."""
-    def __init__(self):
-        super().__init__(Color.Halloween)
+    def __init__(self, mode='srgb'):
+        super().__init__(Color.Halloween, mode)
+
+
+class TableWheel(ColorWheel):
+    """Color Wheel that looks up colors in a precomputed table."""
+    def __init__(self, table):
+        # Save table of colors evenly spaced over 360 degrees
+        self._table = table
+        self._scale = len(table) / 360
+
+    def getrgb(self, angle):
+        """
+        Get a RGB color from the table using an angle.
+
+        :param angle: Angle range 0 - 360.
+
+        :return: Returns RGB color for specified angle.
+        """
+        return self._table[int((angle % 360) * self._scale) % len(self._table)]
 
 
 class ColorBounceWheel(ColorWheel):
@@ -240,3 +452,20 @@ class HalloweenBounceWheel(ColorBounceWheel):
     """Color Wheel that will beat intensity between Halloween colors."""
     def __init__(self):
         super().__init__(Color.Halloween)
+
+
+# built in color wheels
+registercolorwheel('Single Color',
+                   lambda color, mode: ColorBlendWheel([color]),
+                   usescolor=True)
+registercolorwheel('Single Color Bounce',
+                   lambda color, mode: ColorBounceWheel([color, color]),
+                   usescolor=True)
+registercolorwheel('Primary Bounce', lambda color, mode: PrimaryBounceWheel())
+registercolorwheel('Primary Blend', _blendwheel(PrimaryBlendWheel),
+                   usesmode=True)
+registercolorwheel('Rainbow Bounce', lambda color, mode: RainbowBounceWheel())
+registercolorwheel('Rainbow Blend', _blendwheel(RainbowBlendWheel),
+                   usesmode=True)
+registercolorwheel('Christmas', lambda color, mode: ChristmasBounceWheel())
+registercolorwheel('Halloween', lambda color, mode: HalloweenBounceWheel())
@@ -0,0 +1,74 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Checks the JSON light commands from MQTT and the schedule file, so a
+# command with a bad value is dropped before it changes the state.
+#
+import json
+
+# command keys in the order they are applied
+CommandKeys = ['state', 'brightness', 'color', 'effect', 'transition']
+
+class CommandError(ValueError):
+    """Raised when a light command has a bad value."""
+    pass
+
+def isnumber(value):
+    """Check for an int or float, bool is not a number here."""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def checkcommand(command):
+    """
+    Check the values of a light command.
+
+    Keys other than CommandKeys are left alone, Home Assistant may send
+    keys this light doesn't use.
+
+    :param command: Dictionary decoded from the JSON command.
+
+    :return: Returns the command. Raises CommandError for a command that
+             is not an object or has a bad value.
+    """
+    if not isinstance(command, dict):
+        raise CommandError("command must be a JSON object")
+    for key in CommandKeys:
+        if key not in command:
+            continue
+        value = command[key]
+        if key == 'state':
+            valid = isinstance(value, str) and value.upper() in ('ON', 'OFF')
+        elif key == 'brightness':
+            valid = (isinstance(value, int) and not isinstance(value, bool)
+                     and 0 <= value <= 255)
+        elif key == 'color':
+            valid = (isinstance(value, dict)
+                     and all(isnumber(value.get(c)) and 0 <= value[c] <= 255
+                             for c in 'rgb'))
+        elif key == 'effect':
+            valid = isinstance(value, str)
+        else:
+            valid = isnumber(value) and value >= 0
+        if not valid:
+            raise CommandError("%s %s is not valid" % (key,
+                                                        json.dumps(value)))
+    return command
@@ -0,0 +1,317 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# DMX streaming input for the RGB Floodlight application.
+#
+# A DmxReceiver listens for E1.31 (sACN) or Art-Net packets on a non-blocking
+# UDP socket and takes the red, green, blue and optionally white levels at
+# DMX_Address of DMX_Universe from them. The renderer waits on the socket
+# between frames, so a packet is written to the LED the moment it arrives
+# instead of going through MQTT and the effect engine, the same way as the
+# frames of the stream topic (colorstream.py).
+#
+# Packets that arrive out of order are dropped by their sequence number. Of
+# several consoles sending the same universe the one with the highest E1.31
+# priority is followed, Art-Net packets all have the default priority. A
+# console that sends nothing for DMX_Timeout seconds, or ends its E1.31
+# stream, is no longer followed.
+#
+import logging
+import socket
+import struct
+from collections import namedtuple
+from time import monotonic
+
+from color import levelcolor
+
+# logger for this module
+logger = logging.getLogger(__name__)
+
+# UDP ports of the protocols
+E131PORT = 5568
+ARTNETPORT = 6454
+# E1.31 root, framing and DMP layers up to the start code
+E131HEADER = struct.Struct('!HH12sHI16sHI64sBHBBHHBBHHHB')
+E131ID = b'ASC-E1.17\0\0\0'
+VECTOR_ROOT_E131_DATA = 0x00000004
+VECTOR_E131_DATA_PACKET = 0x00000002
+VECTOR_DMP_SET_PROPERTY = 0x02
+# E1.31 framing layer options
+OPTION_PREVIEW = 0x80
+OPTION_TERMINATED = 0x40
+# Art-Net ArtDmx header, the universe is little endian, the length is not
+ARTNETHEADER = struct.Struct('<8sHBBBBHBB')
+ARTNETID = b'Art-Net\0'
+OPDMX = 0x5000
+ARTNETVERSION = 14
+# priority of sources without one
+DEFAULTPRIORITY = 100
+# slots in a universe
+SLOTS = 512
+# packets this many sequence numbers behind the last one are out of order
+SEQUENCEWINDOW = 20
+
+"""A DMX packet, source identifies the console that sent it."""
+Packet = namedtuple('Packet', ['source', 'name', 'universe', 'priority',
+                               'sequence', 'terminated', 'data'])
+
+def parsee131(data, sender):
+    """
+    Parse an E1.31 data packet.
+
+    :param data: The UDP payload.
+    :param sender: The (host, port) the packet came from.
+
+    :return: Returns the Packet, None when it is not an E1.31 data packet
+             with DMX levels or is a preview.
+    """
+    if len(data) < E131HEADER.size:
+        return None
+    (_preamble, _postamble, ident, _flags, rootVector, cid, _flags2,
+     framingVector, name, priority, _sync, sequence, options, universe,
+     _flags3, dmpVector, _addressType, _first, _increment, count,
+     startCode) = E131HEADER.unpack_from(data)
+    if (ident != E131ID or rootVector != VECTOR_ROOT_E131_DATA
+            or framingVector != VECTOR_E131_DATA_PACKET
+            or dmpVector != VECTOR_DMP_SET_PROPERTY
+            or startCode != 0 or options & OPTION_PREVIEW):
+        return None
+    levels = data[E131HEADER.size:E131HEADER.size + count - 1]
+    name = name.split(b'\0', 1)[0].decode('utf-8', 'replace')
+    return Packet(cid, name or sender[0], universe, priority, sequence,
+                  bool(options & OPTION_TERMINATED), levels)
+
+def parseartnet(data, sender):
+    """
+    Parse an Art-Net ArtDmx packet.
+
+    :param data: The UDP payload.
+    :param sender: The (host, port) the packet came from.
+
+    :return: Returns the Packet, None when it is not an ArtDmx packet.
+    """
+    if len(data) < ARTNETHEADER.size:
+        return None
+    (ident, opcode, _versionHi, _versionLo, sequence, _physical, universe,
+     lengthHi, lengthLo) = ARTNETHEADER.unpack_from(data)
+    if ident != ARTNETID or opcode != OPDMX:
+        return None
+    length = lengthHi << 8 | lengthLo
+    levels = data[ARTNETHEADER.size:ARTNETHEADER.size + length]
+    # sequence number 0 means the source doesn't count its packets
+    return Packet(sender[0], sender[0], universe, DEFAULTPRIORITY,
+                  sequence or None, False, levels)
+
+def e131packet(universe, sequence, levels, priority=DEFAULTPRIORITY,
+               name='', cid=bytes(16), terminated=False):
+    """
+    Build an E1.31 data packet.
+
+    :param universe: The universe 1 - 63999.
+    :param sequence: The sequence number 0 - 255.
+    :param levels: The DMX levels, bytes of up to 512 slots.
+    :param priority: The priority 0 - 200.
+    :param name: The source name.
+    :param cid: The 16 byte component identifier of the source.
+    :param terminated: True for the last packet of the stream.
+
+    :return: Returns the packet bytes.
+    """
+    count = len(levels) + 1
+    return E131HEADER.pack(
+        0x0010, 0, E131ID, 0x7000 | (109 + count), VECTOR_ROOT_E131_DATA,
+        cid, 0x7000 | (87 + count), VECTOR_E131_DATA_PACKET,
+        name.encode('utf-8')[:63], priority, 0, sequence,
+        OPTION_TERMINATED if terminated else 0, universe,
+        0x7000 | (10 + count), VECTOR_DMP_SET_PROPERTY, 0xa1, 0, 1, count,
+        0) + bytes(levels)
+
+def artnetpacket(universe, sequence, levels):
+    """
+    Build an Art-Net ArtDmx packet.
+
+    :param universe: The universe 0 - 32767.
+    :param sequence: The sequence number 1 - 255, 0 turns the sequence
+                     check off.
+    :param levels: The DMX levels, bytes of up to 512 slots. Art-Net needs
+                   an even number of slots so one is added to an odd count.
+
+    :return: Returns the packet bytes.
+    """
+    levels = bytes(levels)
+    if len(levels) % 2:
+        levels += b'\0'
+    return ARTNETHEADER.pack(ARTNETID, OPDMX, 0, ARTNETVERSION, sequence, 0,
+                             universe, len(levels) >> 8,
+                             len(levels) & 0xff) + levels
+
+def inorder(last, sequence):
+    """
+    Check that a packet is not older than the last one of its source.
+
+    :param last: Sequence number of the last packet, None for none.
+    :param sequence: Sequence number of the packet.
+
+    :return: Returns False for a packet up to SEQUENCEWINDOW behind or a
+             repeat of the last one.
+    """
+    if last is None:
+        return True
+    difference = (sequence - last) & 0xff
+    if difference >= 128:
+        difference -= 256
+    return not -SEQUENCEWINDOW < difference <= 0
+
+"""Receives DMX levels for the light from E1.31 or Art-Net packets."""
+class DmxReceiver:
+    name = 'DMX packet'
+
+    def __init__(self, protocol, universe, address, channels=3, timeout=2.5,
+                 bind=''):
+        """
+        Open the non-blocking socket of the protocol.
+
+        :param protocol: 'e131' or 'artnet'.
+        :param universe: The universe of the light.
+        :param address: DMX address 1 - 512 of the red channel.
+        :param channels: 3 for red, green and blue or 4 with white.
+        :param timeout: Seconds without packets after which a source is lost.
+        :param bind: Address to listen on, '' for all.
+        """
+        if protocol == 'e131':
+            port = E131PORT
+            self._parse = parsee131
+        else:
+            port = ARTNETPORT
+            self._parse = parseartnet
+        self._universe = universe
+        self._address = address
+        self._channels = channels
+        self._timeout = timeout
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if protocol == 'artnet':
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self._socket.bind((bind, port))
+        if protocol == 'e131':
+            # consoles multicast each universe to its own group
+            group = socket.inet_aton('239.255.%d.%d' % (universe >> 8,
+                                                        universe & 0xff))
+            try:
+                self._socket.setsockopt(
+                    socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                    group + socket.inet_aton(bind or '0.0.0.0'))
+            except OSError as e:
+                # unicast still works
+                logger.warning("Can't join the E1.31 multicast group: %s", e)
+        self._socket.setblocking(False)
+        # source -> [name, priority, last sequence or None, last seen]
+        self._sources = {}
+        self.color = None
+        self.received = 0.0
+        self.packets = 0
+        self.outoforder = 0
+        self.ignored = 0
+
+    def close(self):
+        """Close the socket."""
+        self._socket.close()
+
+    def fileno(self):
+        """
+        Get the socket the renderer waits on.
+
+        :return: Returns the file descriptor.
+        """
+        return self._socket.fileno()
+
+    def receive(self):
+        """
+        Read the waiting packets.
+
+        :return: Returns True when the color was changed, color is the
+                 latest color and received its monotonic receive time.
+        """
+        changed = False
+        while True:
+            try:
+                data, sender = self._socket.recvfrom(1024)
+            except (BlockingIOError, InterruptedError):
+                break
+            now = monotonic()
+            packet = self._parse(data, sender)
+            if packet is None or packet.universe != self._universe:
+                continue
+            source = self._sources.get(packet.source)
+            if (source is not None and packet.sequence is not None
+                    and not inorder(source[2], packet.sequence)):
+                self.outoforder += 1
+                continue
+            if packet.terminated:
+                self._sources.pop(packet.source, None)
+                continue
+            if source is None:
+                source = self._sources[packet.source] = [packet.name, 0,
+                                                         None, now]
+            source[1:] = [packet.priority, packet.sequence, now]
+            if packet.priority < self.priority:
+                self.ignored += 1
+                continue
+            self.packets += 1
+            self.color = levelcolor(packet.data, self._address,
+                                    self._channels)
+            self.received = now
+            changed = True
+        return changed
+
+    def expire(self, now):
+        """
+        Forget the sources that sent nothing for the timeout.
+
+        :param now: The monotonic time.
+
+        :return: Returns True while a source is sending.
+        """
+        for key, source in list(self._sources.items()):
+            if now - source[3] > self._timeout:
+                del self._sources[key]
+        return len(self._sources) > 0
+
+    @property
+    def priority(self):
+        """
+        The priority property.
+
+        :return: The highest priority of the sources sending, -1 for none.
+        """
+        return max((source[1] for source in self._sources.values()),
+                   default=-1)
+
+    @property
+    def sources(self):
+        """
+        The sources property.
+
+        :return: The names of the sources sending.
+        """
+        return [source[0] for source in self._sources.values()]
@@ -0,0 +1,258 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# DMX sender for testing the DMX input of the RGB Floodlight application.
+#
+# Sends E1.31 or Art-Net packets like a lighting console would, a color
+# wheel by default or a single --color...
+#
+#   ./dmxsend.py --protocol e131 --host 192.168.1.20 --rate 44
+#
+# With --bench it runs rgbfloodlight.py on the simulated I2C bus with the
+# DMX input on and sends packets with colors no other packet uses, so the
+# moment the PWM values of each packet land in the simulated PCA9685 is
+# found in the frame log and the packet to PWM latency is reported...
+#
+#   ./dmxsend.py --bench --count 2000
+
+import argparse
+import colorsys
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+from time import monotonic, sleep
+
+from dmx import artnetpacket, e131packet
+
+def makePacket(args, sequence, color, terminated=False):
+    """
+    Build a packet with the color at the address.
+
+    :param args: The parsed command line arguments.
+    :param sequence: Number of packets sent before.
+    :param color: The (r, g, b) color.
+    :param terminated: True for the last E1.31 packet of the stream.
+
+    :return: Returns the packet bytes.
+    """
+    levels = bytearray(args.address - 1) + bytes(color)
+    if args.protocol == 'e131':
+        return e131packet(args.universe, sequence & 0xff, levels,
+                          priority=args.priority, name=args.name,
+                          cid=args.cid, terminated=terminated)
+    # Art-Net sequence numbers are 1 - 255, 0 turns the check off
+    return artnetpacket(args.universe, sequence % 255 + 1, levels)
+
+def stream(args, colors, sent=None):
+    """
+    Send a packet for each color at the rate of the arguments.
+
+    :param args: The parsed command line arguments.
+    :param colors: Iterable of (r, g, b) colors.
+    :param sent: List the monotonic send time of every packet is appended
+                 to, None to not keep them.
+    """
+    port = 5568 if args.protocol == 'e131' else 6454
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    start = monotonic()
+    count = 0
+    color = (0, 0, 0)
+    try:
+        for color in colors:
+            delay = start + count / args.rate - monotonic()
+            if delay > 0:
+                sleep(delay)
+            if sent is not None:
+                sent.append(monotonic())
+            sock.sendto(makePacket(args, count, color),
+                        (args.host, port))
+            count += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.protocol == 'e131':
+            # the light goes back to its effect right away
+            sock.sendto(makePacket(args, count, color, True),
+                        (args.host, port))
+        sock.close()
+
+def wheel(period, rate, count):
+    """
+    Generate the colors of a color wheel.
+
+    :param period: Seconds per turn of the wheel.
+    :param rate: Packets per second.
+    :param count: Number of colors, 0 for no end.
+
+    :return: Yields (r, g, b) colors.
+    """
+    index = 0
+    while count == 0 or index < count:
+        r, g, b = colorsys.hsv_to_rgb((index / rate / period) % 1.0, 1.0, 1.0)
+        yield (int(r * 255), int(g * 255), int(b * 255))
+        index += 1
+
+def bench(args, parser):
+    """
+    Measure the packet to PWM latency of rgbfloodlight.py.
+
+    :param args: The parsed command line arguments.
+    :param parser: The argument parser, for errors.
+    """
+    from fakei2c import readframes
+    from jitterbench import (prepareWorkdir, startApplication,
+                             stopApplication)
+    from latencybench import Command, expectedPwm, matchFrames, report
+    from minibroker import MiniBroker
+    here = os.path.dirname(os.path.abspath(__file__))
+    script = os.path.join(here, 'rgbfloodlight.py')
+    broker = MiniBroker()
+    broker.start()
+    workdir = tempfile.mkdtemp(prefix='dmxsend')
+    frameLog = os.path.join(workdir, 'frames.bin')
+    overrides = {'Broker': '127.0.0.1', 'Port': str(broker.port),
+                 'I2C_Bus': 'fake', 'DMX_Protocol': args.protocol,
+                 'DMX_Universe': str(args.universe),
+                 'DMX_Address': str(args.address), 'DMX_Channels': '3'}
+    for item in args.set:
+        name, sep, value = item.partition('=')
+        if sep == '':
+            parser.error("--set needs NAME=VALUE, not '%s'" % item)
+        overrides[name.strip()] = value.strip()
+    try:
+        try:
+            settings = prepareWorkdir(args.cwd, workdir, overrides)
+        except ValueError as e:
+            sys.exit("Config file error: %s" % e)
+        pwm = expectedPwm(settings)
+        commands = []
+        used = set()
+        while len(commands) < args.count:
+            # values under 64 are too close together after gamma correction
+            color = tuple(random.randint(64, 255) for _i in range(3))
+            values = pwm(color)
+            if values not in used:
+                used.add(values)
+                commands.append(Command(None, None, 1 / args.rate, color))
+        env = dict(os.environ, RGBFLOODLIGHT_FAKE_I2C_LOG=frameLog)
+        proc, lines, reader, output = startApplication(script, workdir,
+                                                       args.timeout, env)
+        if proc is None:
+            sys.exit("No first frame within %.0f seconds:\n%s"
+                     % (args.timeout, "".join(output)))
+        sent = []
+        try:
+            stream(args, [command.color for command in commands], sent)
+            # the stream ends when the light has seen the last packet
+            sleep(0.5)
+        finally:
+            stopApplication(proc, reader, lines, output)
+        frames = readframes(frameLog) if os.path.isfile(frameLog) else []
+    finally:
+        broker.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for command, stamp in zip(commands, sent):
+        command.sent = stamp
+    matchFrames(commands, frames, pwm)
+    print("%d %s packets at %.0f Hz, %d frames written"
+          % (len(commands), args.protocol, args.rate, len(frames)))
+    report("PWM written", [c.landed - c.sent for c in commands
+                           if c.landed is not None], len(commands))
+    for line in output:
+        if 'DMX' in line or 'Live color' in line:
+            print(line.rstrip())
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(
+        description="Send E1.31 or Art-Net packets to an RGB Floodlight.")
+    parser.add_argument('-p', '--protocol', choices=['e131', 'artnet'],
+                        default='e131', help="protocol (default e131)")
+    parser.add_argument('-H', '--host', default='127.0.0.1',
+                        help="light or broadcast address to send to "
+                             "(default 127.0.0.1)")
+    parser.add_argument('-u', '--universe', type=int, default=1,
+                        help="universe (default 1)")
+    parser.add_argument('-a', '--address', type=int, default=1,
+                        help="DMX address of the red channel (default 1)")
+    parser.add_argument('-r', '--rate', type=float, default=44.0,
+                        help="packets per second (default 44)")
+    parser.add_argument('-n', '--count', type=int, default=0,
+                        help="number of packets, 0 to send until Ctrl-C "
+                             "(default 0, 2000 with --bench)")
+    parser.add_argument('-c', '--color', metavar='R,G,B',
+                        help="send this color instead of a color wheel")
+    parser.add_argument('--period', type=float, default=5.0,
+                        help="seconds per turn of the color wheel "
+                             "(default 5)")
+    parser.add_argument('--priority', type=int, default=100,
+                        help="E1.31 priority 0 - 200 (default 100)")
+    parser.add_argument('--name', default='dmxsend',
+                        help="E1.31 source name (default dmxsend)")
+    parser.add_argument('--bench', action='store_true',
+                        help="run rgbfloodlight.py on the simulated I2C bus "
+                             "and measure the packet to PWM latency")
+    parser.add_argument('-C', '--cwd', default=here,
+                        help="directory with the config file for --bench")
+    parser.add_argument('-s', '--set', action='append', default=[],
+                        metavar='NAME=VALUE',
+                        help="change a setting for --bench, can be repeated")
+    parser.add_argument('-t', '--timeout', type=float, default=30.0,
+                        help="seconds to wait for the first frame with "
+                             "--bench")
+    args = parser.parse_args()
+    if not 1 <= args.address <= 510:
+        parser.error("--address must be 1 - 510")
+    if not 0 <= args.priority <= 200:
+        parser.error("--priority must be 0 - 200")
+    # every run of the sender is a new source
+    args.cid = os.urandom(16)
+
+    if args.bench:
+        if args.count == 0:
+            args.count = 2000
+        bench(args, parser)
+        return
+    if args.color:
+        try:
+            color = tuple(int(value) for value in args.color.split(','))
+        except ValueError:
+            color = ()
+        if len(color) != 3 or not all(0 <= value <= 255 for value in color):
+            parser.error("--color needs R,G,B values 0 - 255")
+        if args.count:
+            colors = [color] * args.count
+        else:
+            colors = iter(lambda: color, None)
+    else:
+        colors = wheel(args.period, args.rate, args.count)
+    stream(args, colors)
+
+if __name__ == '__main__':
+    main()
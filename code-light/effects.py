@@ -0,0 +1,243 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# User defined effects are read from a JSON file that looks like this...
+#
+# {
+#   "palettes": {
+#     "Sunset": [[255, 0, 0], [255, 127, 0], [127, 0, 255], [255, 0, 0]]
+#   },
+#   "effects": {
+#     "Sunset Blend": {"type": "blend", "colors": "Sunset",
+#                      "positions": [0, 60, 240, 360], "easing": "sine",
+#                      "blend_mode": "oklab"},
+#     "Police": {"type": "bounce",
+#                "colors": [[255, 0, 0], [0, 0, 255], [255, 0, 0]]}
+#   }
+# }
+#
+# "colors" is either the name of a palette or a list of [r, g, b] colors.
+# "positions" are optional and place each color on the 0 - 360 degree wheel,
+# the first must be 0 and the last 360. Without them the colors are spaced
+# evenly. A "blend" effect blends from one color to the next, a "bounce"
+# effect fades each color out and the next color in. "easing" shapes the
+# transition between two colors and is one of the names in Easings.
+# "blend_mode" is the color space blend effects blend in, one of
+# color.BlendModes, 'oklab' avoids the muddy midpoints of the default 'srgb'.
+#
+from color import Color, BlendModes
+import colorwheel
+from bisect import bisect_right
+import json
+import math
+import logging
+
+# logger for this module
+logger = logging.getLogger(__name__)
+
+# easing functions map 0.0 - 1.0 to 0.0 - 1.0
+Easings = {
+    'linear': lambda t: t,
+    'sine': lambda t: 0.5 - 0.5 * math.cos(math.pi * t),
+    'ease-in': lambda t: t * t,
+    'ease-out': lambda t: 1 - (1 - t) * (1 - t),
+    'ease-in-out': lambda t: t * t * (3 - 2 * t),
+    'step': lambda t: 0.0,
+}
+
+EffectTypes = ['blend', 'bounce']
+
+# loaded effects by name, see loadeffects()
+Loaded = {}
+
+class EffectError(ValueError):
+    """Raised when an effect definition is not valid."""
+    pass
+
+class Effect:
+    """A user defined effect that is compiled to a table before it is used."""
+    def __init__(self, name, kind, colors, positions, easing, mode='srgb'):
+        self.name = name
+        self.kind = kind
+        self.colors = colors
+        self.positions = positions
+        self.easing = easing
+        self.mode = mode
+        self._wheel = None
+        if kind == 'blend':
+            # the table is filled in order so a cursor skips the searches
+            self._keyframes = colorwheel.KeyframeWheel(
+                colors, positions, Easings[easing], mode).cursor()
+
+    def getwheel(self):
+        """
+        Get the compiled color wheel, compiling it the first time.
+
+        Compiling the same effect in two threads at once only wastes the
+        time of one of them, the tables are the same.
+
+        :return: Returns a TableWheel for the effect.
+        """
+        if self._wheel is None:
+            self._wheel = colorwheel.compilewheel(self)
+        return self._wheel
+
+    def factory(self, color, mode):
+        """Color wheel factory for colorwheel.registercolorwheel()."""
+        return self.getwheel()
+
+    def getrgb(self, angle):
+        """
+        Compute the color of the effect at an angle.
+
+        This is slow and only used to fill the table, which is also when
+        the colors are converted for the blend mode.
+
+        :param angle: Angle range 0 - 360.
+
+        :return: Returns RGB color for specified angle.
+        """
+        if self.kind == 'blend':
+            return self._keyframes.getrgb(angle)
+        # find the section the angle is in
+        section = min(bisect_right(self.positions, angle) - 1,
+                      len(self.positions) - 2)
+        start = self.positions[section]
+        end = self.positions[section + 1]
+        bias = Easings[self.easing]((angle - start) / (end - start))
+        # bounce fades out the current color and fades in the next
+        if bias < 0.5:
+            color = self.colors[section]
+        else:
+            color = self.colors[section + 1]
+        intensity = math.fabs(math.cos(math.pi * bias))
+        return Color(color.r * intensity, color.g * intensity,
+                     color.b * intensity)
+
+def parsecolors(value, palettes):
+    """Convert a palette name or list of [r, g, b] to a list of Colors."""
+    if isinstance(value, str):
+        if value not in palettes:
+            raise EffectError("palette '%s' does not exist" % value)
+        value = palettes[value]
+    if not isinstance(value, list) or len(value) < 2:
+        raise EffectError("needs a list of at least two colors")
+    colors = []
+    for rgb in value:
+        if (not isinstance(rgb, list) or len(rgb) != 3
+                or not all(isinstance(c, (int, float)) and 0 <= c <= 255
+                           for c in rgb)):
+            raise EffectError("color %s is not [r, g, b] in range 0 - 255"
+                              % json.dumps(rgb))
+        colors.append(Color(*rgb))
+    return colors
+
+def parseeffect(name, definition, palettes):
+    """
+    Convert an effect definition from the effects file to an Effect.
+
+    :param name: Name of the effect.
+    :param definition: Dictionary with the effect definition.
+    :param palettes: Dictionary of palette names to lists of [r, g, b].
+
+    :return: Returns the Effect. Raises EffectError if not valid.
+    """
+    if not isinstance(definition, dict):
+        raise EffectError("definition must be an object")
+    kind = definition.get('type', 'blend')
+    if kind not in EffectTypes:
+        raise EffectError("type must be one of %s" % ", ".join(EffectTypes))
+    colors = parsecolors(definition.get('colors'), palettes)
+    positions = definition.get('positions')
+    if positions is None:
+        positions = [i * 360 / (len(colors) - 1) for i in range(len(colors))]
+    if (not isinstance(positions, list) or len(positions) != len(colors)
+            or not all(isinstance(p, (int, float)) for p in positions)):
+        raise EffectError("needs one position for each color")
+    if positions[0] != 0 or positions[-1] != 360:
+        raise EffectError("positions must start at 0 and end at 360")
+    if any(positions[i] >= positions[i + 1]
+           for i in range(len(positions) - 1)):
+        raise EffectError("positions must be increasing")
+    easing = definition.get('easing', 'linear')
+    if easing not in Easings:
+        raise EffectError("easing must be one of %s"
+                          % ", ".join(sorted(Easings)))
+    mode = definition.get('blend_mode', 'srgb')
+    if mode not in BlendModes:
+        raise EffectError("blend_mode must be one of %s"
+                          % ", ".join(BlendModes))
+    return Effect(name, kind, colors, positions, easing, mode)
+
+def loadeffects(filename):
+    """
+    Load user defined effects and add them to the color wheels.
+
+    Effects that are not valid are skipped with an error message. The
+    tables are not compiled here so loading doesn't hold up the first
+    frame, see compileeffects().
+
+    :param filename: The JSON effects file.
+
+    :return: Returns a list of the names of the added effects. Raises
+             ValueError if the file is not valid JSON or not laid out as
+             shown above.
+    """
+    with open(filename, 'r') as infile:
+        data = json.load(infile)
+    if not isinstance(data, dict):
+        raise EffectError("the file must hold a JSON object")
+    palettes = data.get('palettes', {})
+    if not isinstance(palettes, dict):
+        raise EffectError("'palettes' must be an object")
+    definitions = data.get('effects', {})
+    if not isinstance(definitions, dict):
+        raise EffectError("'effects' must be an object")
+    added = []
+    for name, definition in definitions.items():
+        try:
+            effect = parseeffect(name, definition, palettes)
+            colorwheel.registercolorwheel(name, effect.factory)
+        except ValueError as e:
+            print("RGB Floodlight: Effect '%s' in '%s' is not valid: %s"
+                  % (name, filename, e))
+            continue
+        Loaded[name] = effect
+        added.append(name)
+    return added
+
+def compileeffects():
+    """
+    Compile the tables of the loaded effects that are not compiled yet.
+
+    Run it in a thread after the first frame so switching to an effect
+    doesn't stall the frame loop. An effect selected before this gets to
+    it is compiled when it is first used.
+
+    :return: Returns the number of effects compiled.
+    """
+    compiled = 0
+    for effect in list(Loaded.values()):
+        if effect._wheel is None:
+            effect.getwheel()
+            compiled += 1
+    return compiled
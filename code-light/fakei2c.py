@@ -0,0 +1,126 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Simulated I2C bus for running the application without a PCA9685.
+#
+# It has the get_i2c_device() function of Adafruit_GPIO.I2C so it can be
+# handed to the PCA9685 class, select it with I2C_Bus = fake in the config
+# file. Two environment variables are used by the benchmarks...
+#
+#   RGBFLOODLIGHT_FAKE_I2C_LOG    Every write of the pwm registers is
+#                                 appended to this frame file (framerec.py)
+#                                 with its time.monotonic() timestamp.
+#   RGBFLOODLIGHT_FAKE_I2C_SPEED  Bus clock in Hz, every transfer takes as
+#                                 long as it would on a real bus. The default
+#                                 0 makes transfers take no time.
+#
+import logging
+import os
+from time import monotonic, sleep
+
+# the frame log is a frame file, readframes() is here for the benchmarks
+from framerec import packframe, readframes
+
+# logger for this module
+logger = logging.getLogger(__name__)
+
+# first register of the pwm channels
+LED0_ON_L = 0x06
+# bits on the bus for each byte, 8 data bits and the acknowledge
+BITSPERBYTE = 9
+# bytes of an I2C transfer besides the data, address and register
+OVERHEAD = 2
+
+"""Simulated I2C device with 256 registers."""
+class FakeDevice:
+    def __init__(self, address, logfile=None, speed=0):
+        """
+        Initialize the device.
+
+        :param address: I2C address of the device.
+        :param logfile: File the pwm writes are appended to, None for none.
+        :param speed: Bus clock in Hz, 0 makes transfers take no time.
+        """
+        self.address = address
+        self.registers = [0] * 256
+        self.writes = 0
+        self._byteTime = BITSPERBYTE / speed if speed > 0 else 0.0
+        self._log = None
+        if logfile is not None:
+            # one write() per frame so several processes can append safely
+            self._log = os.open(logfile, os.O_WRONLY | os.O_APPEND
+                                | os.O_CREAT, 0o644)
+
+    def _transfer(self, count):
+        """
+        Take as long as a transfer of count data bytes on the bus.
+
+        :param count: Number of data bytes.
+        """
+        if self._byteTime > 0:
+            sleep((count + OVERHEAD) * self._byteTime)
+
+    def writeRaw8(self, value):
+        """Write a byte without a register."""
+        self._transfer(1)
+
+    def write8(self, register, value):
+        """Write a register."""
+        self._transfer(1)
+        self.registers[register] = value & 0xFF
+
+    def readU8(self, register):
+        """Read a register."""
+        self._transfer(1)
+        return self.registers[register]
+
+    def writeList(self, register, data):
+        """Write registers starting with register."""
+        self._transfer(len(data))
+        self.registers[register:register + len(data)] = data
+        self.writes += 1
+        if self._log is not None and register == LED0_ON_L:
+            # log the off values of the channels written, that's the duty
+            values = [data[i + 2] | (data[i + 3] << 8)
+                      for i in range(0, min(len(data), 16), 4)]
+            os.write(self._log, packframe(monotonic(), values))
+
+def busspeed():
+    """
+    Get the clock of the simulated bus.
+
+    :return: Returns the bus clock in Hz, 0 when transfers take no time.
+    """
+    return int(os.environ.get('RGBFLOODLIGHT_FAKE_I2C_SPEED', '0'))
+
+def get_i2c_device(address, busnum=None, **kwargs):
+    """
+    Get a simulated device.
+
+    :param address: I2C address of the device.
+    :param busnum: Ignored, there is only one simulated bus.
+
+    :return: Returns the FakeDevice.
+    """
+    return FakeDevice(address, os.environ.get('RGBFLOODLIGHT_FAKE_I2C_LOG'),
+                      busspeed())
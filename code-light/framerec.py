@@ -0,0 +1,162 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Recording and replay of the pwm frames written to the LED.
+#
+# A frame file is a series of FRAMERECORD records, a time.monotonic()
+# timestamp and the pwm off values of 4 channels, the same records as the
+# frame log of fakei2c.py. With Record_File set the renderer appends every
+# frame it writes, framereplay.py plays a file back at its original timing
+# and the offline renderer (render.py) writes them too. A FrameFile maps
+# the file into memory, so long recordings are not read into RAM.
+#
+import logging
+import mmap
+import os
+import struct
+from time import monotonic
+
+# logger for this module
+logger = logging.getLogger(__name__)
+
+# timestamp and the pwm off values of 4 channels
+FRAMERECORD = struct.Struct('<d4H')
+# channels in a record, unused ones are 0
+CHANNELS = 4
+
+def packframe(timestamp, values):
+    """
+    Pack a frame record.
+
+    :param timestamp: Time of the frame in seconds.
+    :param values: The pwm values of up to 4 channels.
+
+    :return: Returns the record bytes.
+    """
+    values = list(values[:CHANNELS])
+    values.extend([0] * (CHANNELS - len(values)))
+    return FRAMERECORD.pack(timestamp, *values)
+
+def readframes(filename):
+    """
+    Read a whole frame file.
+
+    :param filename: The frame file.
+
+    :return: Returns a list of (timestamp, pwm values) tuples.
+    """
+    with FrameFile(filename) as frames:
+        return list(frames)
+
+"""Appends the frames written to the LED to a frame file."""
+class FrameRecorder:
+    def __init__(self, filename):
+        """
+        Open the frame file, frames are added to the end.
+
+        :param filename: The frame file.
+        """
+        self.filename = filename
+        # one write() per frame so a crash loses at most the last frame
+        self._file = os.open(filename, os.O_WRONLY | os.O_APPEND
+                             | os.O_CREAT, 0o644)
+
+    def add(self, values, timestamp=None):
+        """
+        Add a frame.
+
+        :param values: The pwm values of up to 4 channels.
+        :param timestamp: Time of the frame, None for now.
+        """
+        if timestamp is None:
+            timestamp = monotonic()
+        os.write(self._file, packframe(timestamp, values))
+
+    def close(self):
+        """Close the frame file."""
+        if self._file is not None:
+            os.close(self._file)
+            self._file = None
+
+"""Memory mapped frame file, indexed and iterated like a list of
+(timestamp, pwm values) tuples."""
+class FrameFile:
+    def __init__(self, filename):
+        """
+        Map the frame file, a partly written record at the end is left out.
+
+        :param filename: The frame file.
+        """
+        self.filename = filename
+        self._map = None
+        with open(filename, 'rb') as infile:
+            size = os.fstat(infile.fileno()).st_size
+            self._count = size // FRAMERECORD.size
+            if self._count > 0:
+                self._map = mmap.mmap(infile.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Unmap the frame file."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("frame index out of range")
+        values = FRAMERECORD.unpack_from(self._map,
+                                         index * FRAMERECORD.size)
+        return values[0], values[1:]
+
+    def __iter__(self):
+        if self._count == 0:
+            return
+        view = memoryview(self._map)[:self._count * FRAMERECORD.size]
+        try:
+            for values in FRAMERECORD.iter_unpack(view):
+                yield values[0], values[1:]
+        finally:
+            view.release()
+
+    @property
+    def duration(self):
+        """
+        The duration property.
+
+        :return: Seconds from the first to the last frame.
+        """
+        if self._count < 2:
+            return 0.0
+        return self[-1][0] - self[0][0]
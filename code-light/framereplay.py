@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Plays a frame file (framerec.py) back to the PCA9685.
+#
+# Frames recorded with Record_File, rendered offline with render.py or
+# logged by the simulated I2C bus are written at their original timing,
+# the PCA9685 address, I2C bus and pwm frequency come from the config file.
+# Stop rgbfloodlight.py first, both would write the PCA9685...
+#
+#   ./framereplay.py show.bin --speed 1.0 --loop
+#
+# How late the frames were written is reported at the end. Run it with
+# I2C_Bus = fake to see what a frame stream does to the frame timing
+# without a PCA9685, or compare two files bit for bit without playing
+# them...
+#
+#   ./framereplay.py expected.bin --compare rendered.bin
+
+import argparse
+import os
+import sys
+from time import monotonic, sleep
+
+from framerec import FrameFile
+
+def compare(expected, actual):
+    """
+    Compare the pwm values of two frame files, the timestamps are ignored.
+
+    :param expected: The FrameFile with the expected frames.
+    :param actual: The FrameFile to check.
+
+    :return: Returns the index of the first frame that differs, None when
+             all frames are the same.
+    """
+    for index, ((_t1, values1), (_t2, values2)) in enumerate(
+            zip(expected, actual)):
+        if values1 != values2:
+            return index
+    if len(expected) != len(actual):
+        return min(len(expected), len(actual))
+    return None
+
+def replay(frames, device, channels, speed, stats):
+    """
+    Write the frames at their original timing.
+
+    :param frames: The FrameFile.
+    :param device: The PCA9685 to write to.
+    :param channels: Number of pwm channels written.
+    :param speed: Playback speed factor.
+    :param stats: FrameStats the lateness of the frames is added to.
+    """
+    start = monotonic()
+    first = frames[0][0]
+    last = first
+    for timestamp, values in frames:
+        due = start + (timestamp - first) / speed
+        wait = due - monotonic()
+        if wait > 0:
+            sleep(wait)
+        if timestamp > last:
+            period = (timestamp - last) / speed
+        else:
+            period = float('inf')
+        stats.add(max(monotonic() - due, 0.0), period)
+        device.set_multiple_pwm(values[:channels])
+        last = timestamp
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(
+        description="Play a frame file back to the PCA9685 of the RGB "
+                    "Floodlight.")
+    parser.add_argument('file', help="frame file to play")
+    parser.add_argument('-c', '--config',
+                        default=os.path.join(here, 'rgbfloodlight.conf'),
+                        help="config file with the PCA9685 settings")
+    parser.add_argument('-s', '--speed', type=float, default=1.0,
+                        help="playback speed factor (default 1.0)")
+    parser.add_argument('-l', '--loop', action='store_true',
+                        help="play the file over and over until Ctrl-C")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="compare the pwm values with this frame file "
+                             "instead of playing")
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed must be > 0")
+
+    try:
+        frames = FrameFile(args.file)
+    except OSError as e:
+        sys.exit("Can't open '%s': %s" % (args.file, e))
+    with frames:
+        print("%d frames, %.1f seconds" % (len(frames), frames.duration))
+        if args.compare:
+            try:
+                other = FrameFile(args.compare)
+            except OSError as e:
+                sys.exit("Can't open '%s': %s" % (args.compare, e))
+            with other:
+                index = compare(frames, other)
+                if index is None:
+                    print("'%s' has the same %d frames." % (args.compare,
+                                                           len(other)))
+                    return
+                if index >= min(len(frames), len(other)):
+                    sys.exit("'%s' has %d frames instead of %d."
+                             % (args.compare, len(other), len(frames)))
+                sys.exit("Frame %d differs: %s instead of %s."
+                         % (index, list(other[index][1]),
+                            list(frames[index][1])))
+        if len(frames) == 0:
+            return
+
+        from PCA9685 import PCA9685
+        from renderer import FrameStats, i2cbus, readcalibration
+        from settings import loadsettings
+        try:
+            settings = loadsettings(args.config)
+        except ValueError as e:
+            sys.exit("Config file error: %s" % e)
+        matrix, _curves = readcalibration(settings)
+        channels = len(matrix) if matrix is not None else 3
+        i2c, busnum = i2cbus(settings)
+        device = PCA9685(settings.pwm_address, i2c=i2c, busnum=busnum)
+        device.set_pwm_freq(settings.pwm_frequency)
+        stats = FrameStats()
+        try:
+            while True:
+                replay(frames, device, channels, args.speed, stats)
+                if not args.loop:
+                    break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            device.set_multiple_pwm([0] * channels)
+        jitter = stats.summary()
+        print("Frame lateness mean %.2f ms, p99 %.2f ms, max %.2f ms, %d of "
+              "%d frames late." % (jitter.mean * 1000, jitter.p99 * 1000,
+                                   jitter.max * 1000, jitter.late,
+                                   jitter.frames))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Group phase benchmark for the RGB Floodlight application.
+#
+# Starts several rgbfloodlight.py instances in one group on the simulated
+# I2C bus (fakei2c.py) with a stand-in MQTT broker (minibroker.py), first
+# with Group_Sync off and then on. The first instance is the group master,
+# the others get clocks that are off by up to --skew seconds through
+# RGBFLOODLIGHT_CLOCK_SKEW and state files where the effect started at a
+# random time, like lights that were restarted at different times. The
+# frame logs of the lights are compared to find how far each one is behind
+# or ahead of the master. Afterwards a slider drag, --drag brightness
+# commands to the group, shows how many messages the group publishes...
+#
+#   ./groupbench.py --nodes 4 --skew 0.5 --duration 10 --drag 50
+
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+from bisect import bisect_right
+from time import sleep
+
+from fakei2c import readframes
+from groupsync import wallclock
+from jitterbench import prepareWorkdir, startApplication, stopApplication
+from minibroker import MiniBroker
+
+OFFSET = re.compile(r"Group clock offset ([+-][\d.]+) ms")
+# lag steps of the coarse search over a whole transition
+COARSESTEPS = 200
+# lag step of the fine search in seconds
+FINESTEP = 0.0005
+
+def valueAt(times, values, when):
+    """
+    Get the pwm values of a frame log at a time, interpolated between the
+    frames around it.
+
+    :param times: Frame timestamps in order.
+    :param values: Pwm values of the frames.
+    :param when: The time.
+
+    :return: Returns the list of pwm values.
+    """
+    i = bisect_right(times, when)
+    if i == 0:
+        return values[0]
+    if i == len(times):
+        return values[-1]
+    fraction = (when - times[i - 1]) / (times[i] - times[i - 1])
+    return [a + (b - a) * fraction for a, b in zip(values[i - 1], values[i])]
+
+def phaseLag(reference, frames, transition, start, end):
+    """
+    Find how far a light is behind the reference light.
+
+    :param reference: Frame log of the reference light.
+    :param frames: Frame log of the light.
+    :param transition: The transition of the effect in seconds.
+    :param start: Start of the compared frames, monotonic time.
+    :param end: End of the compared frames, monotonic time.
+
+    :return: Returns the lag in seconds, positive when the light shows a
+             color later than the reference.
+    """
+    samples = [(stamp, values) for stamp, values in reference
+               if start <= stamp <= end]
+    times = [stamp for stamp, _values in frames]
+    values = [values for _stamp, values in frames]
+
+    def difference(lag):
+        total = 0
+        for stamp, expected in samples:
+            actual = valueAt(times, values, stamp + lag)
+            total += sum(abs(a - b) for a, b in zip(expected, actual))
+        return total
+
+    step = transition / COARSESTEPS
+    best = min((i * step for i in range(-COARSESTEPS // 2,
+                                        COARSESTEPS // 2)),
+               key=difference)
+    count = int(step / FINESTEP) * 2
+    return min((best + i * FINESTEP for i in range(-count, count + 1)),
+               key=difference)
+
+def dragSlider(port, topic, count, duration):
+    """
+    Send brightness commands like a slider dragged in Home Assistant.
+
+    :param port: Port of the broker.
+    :param topic: The group command topic.
+    :param count: Number of commands.
+    :param duration: Seconds the drag takes.
+    """
+    import paho.mqtt.client as mqtt
+    client = mqtt.Client()
+    client.connect('127.0.0.1', port)
+    client.loop_start()
+    for i in range(count):
+        client.publish(topic, '{"brightness": %d}' % (255 - i % 200),
+                       qos=1).wait_for_publish()
+        sleep(duration / count)
+    client.loop_stop()
+    client.disconnect()
+
+def runGroup(cwd, script, args, sync, skews):
+    """
+    Run the group once.
+
+    :param cwd: Directory with the config file to use.
+    :param script: Path of the application to start.
+    :param args: The parsed command line arguments.
+    :param sync: Group_Sync on or off.
+    :param skews: Clock skew of every light in seconds.
+
+    :return: Returns (frame logs, output lines, measure start, measure end,
+             publishes) with a frame log and the output of every light and
+             the messages the lights published during the slider drag.
+    """
+    broker = MiniBroker()
+    broker.start()
+    workdirs = []
+    running = []
+    try:
+        for node, skew in enumerate(skews):
+            workdir = tempfile.mkdtemp(prefix='groupbench')
+            workdirs.append(workdir)
+            overrides = dict(args.overrides)
+            overrides.update({
+                'Broker': '127.0.0.1', 'Port': str(broker.port),
+                'I2C_Bus': 'fake', 'Node_ID': 'groupbench%d' % node,
+                'Node_Name': 'Group Bench %d' % node,
+                'Group_Enabled': 'true',
+                'Group_Master': 'true' if node == 0 else 'false',
+                'Group_Sync': 'true' if sync else 'false',
+                'Group_Sync_Rate': str(args.sync_rate)})
+            settings = prepareWorkdir(cwd, workdir, overrides)
+            # the effect started at a different time on every light
+            state = {'brightness': 255, 'color': [255, 255, 255],
+                     'effect': args.effect, 'state': True,
+                     'transition': args.transition,
+                     'epoch': wallclock() + skew
+                              - random.uniform(0, args.transition)}
+            with open(os.path.join(workdir, 'rgbfloodlightstate.json'),
+                      'w') as outfile:
+                json.dump(state, outfile)
+            env = dict(os.environ,
+                       RGBFLOODLIGHT_FAKE_I2C_LOG=os.path.join(workdir,
+                                                               'frames.bin'),
+                       RGBFLOODLIGHT_CLOCK_SKEW=str(skew))
+            proc, lines, reader, output = startApplication(script, workdir,
+                                                           args.timeout, env)
+            if proc is None:
+                sys.exit("Light %d: no first frame within %.0f seconds:\n%s"
+                         % (node, args.timeout, "".join(output)))
+            running.append((proc, reader, lines, output))
+        # give the followers a few beacons
+        sleep(args.settle)
+        start = readframes(os.path.join(workdirs[0], 'frames.bin'))[-1][0]
+        sleep(args.duration)
+        end = start + args.duration
+        publishes = 0
+        if args.drag > 0:
+            topic = "/".join([settings.discovery_prefix, 'light',
+                              settings.group_id, 'rgblight', 'set'])
+            received = broker.received
+            dragSlider(broker.port, topic, args.drag, 2.0)
+            # the followers publish their last state a little later
+            sleep(settings.group_state_interval + 0.5)
+            publishes = broker.received - received - args.drag
+    finally:
+        for proc, reader, lines, output in running:
+            stopApplication(proc, reader, lines, output)
+        broker.stop()
+    logs = [readframes(os.path.join(workdir, 'frames.bin'))
+            for workdir in workdirs]
+    for workdir in workdirs:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return (logs, [output for _p, _r, _l, output in running], start, end,
+            publishes)
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(
+        description="Measure how well the effects of RGB Floodlight group "
+                    "members line up with and without Group_Sync.")
+    parser.add_argument('-C', '--cwd', default=here,
+                        help="directory with the config file")
+    parser.add_argument('-n', '--nodes', type=int, default=3,
+                        help="number of lights in the group (default 3)")
+    parser.add_argument('-k', '--skew', type=float, default=0.5,
+                        help="largest clock error of the followers in "
+                             "seconds (default 0.5)")
+    parser.add_argument('-d', '--duration', type=float, default=10.0,
+                        help="seconds of frames compared (default 10)")
+    parser.add_argument('--settle', type=float, default=3.0,
+                        help="seconds before the frames are compared "
+                             "(default 3)")
+    parser.add_argument('--sync-rate', type=float, default=1.0,
+                        help="Group_Sync_Rate of the master (default 1.0)")
+    parser.add_argument('-e', '--effect', default='Rainbow Blend',
+                        help="effect of the group (default Rainbow Blend)")
+    parser.add_argument('--transition', type=float, default=6.0,
+                        help="transition of the effect (default 6)")
+    parser.add_argument('--drag', type=int, default=50,
+                        help="brightness commands of the slider drag, 0 for "
+                             "none (default 50)")
+    parser.add_argument('-s', '--set', action='append', default=[],
+                        metavar='NAME=VALUE',
+                        help="change a setting of every light, can be "
+                             "repeated")
+    parser.add_argument('-t', '--timeout', type=float, default=30.0,
+                        help="seconds to wait for the first frame")
+    args = parser.parse_args()
+    if args.nodes < 2:
+        parser.error("--nodes needs at least 2 lights")
+    args.overrides = {}
+    for item in args.set:
+        name, sep, value = item.partition('=')
+        if sep == '':
+            parser.error("--set needs NAME=VALUE, not '%s'" % item)
+        args.overrides[name.strip()] = value.strip()
+    script = os.path.join(here, 'rgbfloodlight.py')
+
+    skews = [0.0] + [random.uniform(-args.skew, args.skew)
+                     for _i in range(args.nodes - 1)]
+    for sync in (False, True):
+        try:
+            logs, outputs, start, end, publishes = runGroup(
+                args.cwd, script, args, sync, skews)
+        except ValueError as e:
+            sys.exit("Config file error: %s" % e)
+        print("Group_Sync %s:" % ('on' if sync else 'off'))
+        worst = 0.0
+        for node in range(1, args.nodes):
+            lag = phaseLag(logs[0], logs[node], args.transition, start, end)
+            worst = max(worst, abs(lag))
+            text = ("  light %d  clock %+7.1f ms  behind the master %+8.1f "
+                    "ms" % (node, skews[node] * 1000, lag * 1000))
+            offsets = [float(match.group(1)) for match in
+                       map(OFFSET.search, outputs[node]) if match]
+            if offsets:
+                # the master clock is the follower clock minus its skew
+                text += ("  offset estimate error %+.1f ms"
+                         % (offsets[-1] + skews[node] * 1000))
+            print(text)
+        print("  largest phase error %.1f ms (%.2f degrees)"
+              % (worst * 1000, worst / args.transition * 360))
+        if args.drag > 0:
+            print("  slider drag of %d group commands: %d messages "
+                  "published by the lights, %.1f per command"
+                  % (args.drag, publishes, publishes / args.drag))
+        print("")
+
+if __name__ == '__main__':
+    main()
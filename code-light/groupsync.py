@@ -0,0 +1,136 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+#
+# Keeps the effect phase of the lights in a group together.
+#
+# The group master publishes beacons with its clock and the epoch of its
+# effect phase on the sync topic of the group. The other lights in the group
+# estimate how far their clock is from the master clock and use the epoch of
+# the master, so every light is at the same point of the effect. The offset
+# estimate uses the beacon that arrived the quickest of the last few, its
+# time was the least delayed on the way.
+#
+# RGBFLOODLIGHT_CLOCK_SKEW is added to the wall clock in seconds, so several
+# instances on one machine can have clocks that disagree for testing.
+#
+import json
+import logging
+import os
+from collections import deque
+from time import time
+
+# logger for this module
+logger = logging.getLogger(__name__)
+
+# beacons the clock offset is estimated from
+SYNCWINDOW = 8
+# the epoch of a follower is only moved by more than this in seconds
+SYNCTOLERANCE = 0.002
+
+# seconds added to the wall clock for testing
+ClockSkew = float(os.environ.get('RGBFLOODLIGHT_CLOCK_SKEW', '0'))
+
+def wallclock():
+    """
+    Get the wall clock time effect epochs are in.
+
+    :return: Returns the time in seconds since the epoch.
+    """
+    return time() + ClockSkew
+
+def beaconpayload(state):
+    """
+    Make the payload of a beacon.
+
+    :param state: The state of the master with the effect, transition and
+                  epoch.
+
+    :return: Returns the JSON payload.
+    """
+    return json.dumps({'time': wallclock(),
+                       'epoch': state['epoch'],
+                       'effect': state['effect'],
+                       'transition': state['transition']})
+
+def readbeacon(payload):
+    """
+    Read the payload of a beacon.
+
+    :param payload: The JSON payload.
+
+    :return: Returns the beacon dictionary. Raises ValueError when the
+             payload is not a beacon.
+    """
+    beacon = json.loads(payload)
+    if (not isinstance(beacon, dict)
+            or not isinstance(beacon.get('time'), (int, float))
+            or not isinstance(beacon.get('epoch'), (int, float))
+            or not isinstance(beacon.get('transition'), (int, float))
+            or 'effect' not in beacon):
+        raise ValueError("not a sync beacon")
+    return beacon
+
+"""Estimate of the offset of the master clock from this clock."""
+class ClockSync:
+    def __init__(self, window=SYNCWINDOW):
+        """
+        Initialize with no beacons.
+
+        :param window: Number of recent beacons the estimate uses.
+        """
+        self._samples = deque(maxlen=window)
+
+    def add(self, masterTime, localTime):
+        """
+        Add a beacon.
+
+        :param masterTime: The master clock when the beacon was sent.
+        :param localTime: This clock when the beacon arrived.
+        """
+        self._samples.append(masterTime - localTime)
+
+    @property
+    def offset(self):
+        """
+        The offset property.
+
+        A beacon is only ever late, so the largest difference of master and
+        local time belongs to the quickest beacon.
+
+        :return: The master clock minus this clock in seconds, None before
+                 the first beacon.
+        """
+        if len(self._samples) == 0:
+            return None
+        return max(self._samples)
+
+    def tolocal(self, masterTime):
+        """
+        Convert a time on the master clock to this clock.
+
+        :param masterTime: Time on the master clock.
+
+        :return: Returns the time on this clock.
+        """
+        return masterTime - self.offset
@@ -0,0 +1,350 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Frame jitter benchmark for the RGB Floodlight application.
+#
+# Starts rgbfloodlight.py with the render loop in the main process and then
+# with Render_Process on, floods the light command topic with MQTT messages
+# while it runs and reports the frame jitter of both. Each run uses a copy
+# of the config, state and effects files in a temporary directory so the
+# real state file is left alone. The light runs on the simulated I2C bus
+# (fakei2c.py) with a local MQTT broker (minibroker.py), so neither the
+# real light nor the real broker are touched. Other settings can be changed
+# for both runs with --set, for example to see what real-time scheduling
+# does on the real bus...
+#
+#   ./jitterbench.py --set I2C_Bus=auto --set RT_Policy=fifo --set RT_CPU=3
+
+import argparse
+import os
+import queue
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+from time import sleep, time
+
+from minibroker import MiniBroker
+from settings import Options, loadsettings
+from startupbench import readLines
+
+FIRSTFRAME = re.compile(r"First frame rendered (\d+) ms")
+JITTER = re.compile(r"Frame jitter mean ([\d.]+) ms, p99 ([\d.]+) ms, "
+                    r"max ([\d.]+) ms, (\d+) of (\d+) frames late")
+COPYFILES = ['rgbfloodlightstate.json', 'rgbfloodlighteffects.json']
+
+def writeConfig(source, dest, overrides):
+    """
+    Copy the config file with some settings changed.
+
+    :param source: The config file to copy.
+    :param dest: The config file to write.
+    :param overrides: Dictionary of setting name to value.
+    """
+    sections = {option: section for section, option, _f, _k, _d in Options}
+    with open(source, 'r') as infile:
+        text = infile.read()
+    for name, value in overrides.items():
+        text, count = re.subn(r'(?m)^%s\s*=.*$' % re.escape(name),
+                              '%s = %s' % (name, value), text)
+        if count == 0:
+            # add it at the start of its section
+            header = '[%s]' % sections.get(name, 'RGB Floodlight')
+            text, count = re.subn(r'(?m)^%s[ \t]*$' % re.escape(header),
+                                  '%s\n%s = %s' % (header, name, value),
+                                  text, count=1)
+            if count == 0:
+                text += '\n%s\n%s = %s\n' % (header, name, value)
+    with open(dest, 'w') as outfile:
+        outfile.write(text)
+
+def flood(settings, rate, stop, changing=True):
+    """
+    Publish light commands until stop is set.
+
+    :param settings: The Settings of the light.
+    :param rate: Messages per second.
+    :param stop: threading.Event that ends the flood.
+    :param changing: Every message changes the state when True, otherwise
+                     only the first one does.
+
+    :return: Returns the number of messages published.
+    """
+    import paho.mqtt.client as mqtt
+    client = mqtt.Client()
+    if settings.username != '':
+        client.username_pw_set(settings.username, settings.password)
+    client.connect(settings.broker, settings.port, settings.keepalive)
+    client.loop_start()
+    topic = "/".join([settings.discovery_prefix, 'light', settings.node_id,
+                      'rgblight', 'set'])
+    count = 0
+    start = time()
+    while not stop.is_set():
+        if changing:
+            # every message changes the state so all of it is processed
+            brightness = 254 + count % 2
+        else:
+            brightness = 255
+        client.publish(topic, '{"brightness": %d}' % brightness)
+        count += 1
+        delay = start + count / rate - time()
+        if delay > 0:
+            sleep(delay)
+    client.loop_stop()
+    client.disconnect()
+    return count
+
+def startFlood(settings, rate, stop, changing=True):
+    """
+    Run flood() on its own thread.
+
+    :param settings: The Settings of the light.
+    :param rate: Messages per second.
+    :param stop: threading.Event that ends the flood.
+    :param changing: Every message changes the state when True, otherwise
+                     only the first one does.
+
+    :return: Returns (thread, result). The result list gets the number of
+             messages published or the exception that ended the flood.
+    """
+    result = []
+    def run():
+        try:
+            result.append(flood(settings, rate, stop, changing))
+        except Exception as e:
+            result.append(e)
+    thread = threading.Thread(target=run, name="Flood", daemon=True)
+    thread.start()
+    return thread, result
+
+def floodMessages(thread, result, timeout=None):
+    """
+    Wait for a flood started by startFlood() to end.
+
+    :param thread: The flood thread.
+    :param result: The result list of the flood.
+    :param timeout: Seconds to wait, None to wait until it ends.
+
+    :return: Returns the number of messages published. Raises RuntimeError
+             when the flood failed or did not end.
+    """
+    thread.join(timeout)
+    if not result:
+        raise RuntimeError("MQTT flood did not end")
+    if isinstance(result[0], Exception):
+        raise RuntimeError("MQTT flood failed: %s" % result[0])
+    return result[0]
+
+def prepareWorkdir(cwd, workdir, overrides):
+    """
+    Copy the config, state and effects files to a working directory.
+
+    :param cwd: Directory with the files to copy.
+    :param workdir: The working directory.
+    :param overrides: Dictionary of setting name to value.
+
+    :return: Returns the Settings of the copied config file. Raises
+             ValueError for a config file error.
+    """
+    conffile = os.path.join(workdir, 'rgbfloodlight.conf')
+    writeConfig(os.path.join(cwd, 'rgbfloodlight.conf'), conffile, overrides)
+    for name in COPYFILES:
+        if os.path.isfile(os.path.join(cwd, name)):
+            shutil.copy(os.path.join(cwd, name), workdir)
+    return loadsettings(conffile)
+
+def startApplication(script, workdir, timeout, env=None):
+    """
+    Start the application and wait for the first frame.
+
+    :param script: Path of the application to start.
+    :param workdir: Working directory with the config file.
+    :param timeout: Seconds to wait for the first frame.
+    :param env: Environment of the application, None for this one.
+
+    :return: Returns (process, lines queue, reader thread, output lines).
+             The process is None when there was no first frame, it has been
+             stopped then.
+    """
+    proc = subprocess.Popen([sys.executable, '-u', script], cwd=workdir,
+                            env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT,
+                            universal_newlines=True)
+    lines = queue.Queue()
+    reader = threading.Thread(target=readLines, args=(proc.stdout, lines),
+                              daemon=True)
+    reader.start()
+    output = []
+    deadline = time() + timeout
+    while time() < deadline:
+        try:
+            line = lines.get(timeout=deadline - time())
+        except queue.Empty:
+            break
+        if line is None:
+            break
+        output.append(line)
+        if FIRSTFRAME.search(line):
+            return proc, lines, reader, output
+    proc.kill()
+    proc.wait()
+    return None, lines, reader, output
+
+def stopApplication(proc, reader, lines, output):
+    """
+    Stop the application and collect the rest of its output.
+
+    :param proc: The application process.
+    :param reader: The thread reading the output.
+    :param lines: Queue of output lines.
+    :param output: List the output lines are appended to.
+    """
+    if proc.poll() is None:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+    reader.join(5)
+    while not lines.empty():
+        line = lines.get()
+        if line is not None:
+            output.append(line)
+
+def runOnce(script, cwd, overrides, rate, duration, timeout):
+    """
+    Run the application once under an MQTT flood.
+
+    :param script: Path of the application to start.
+    :param cwd: Directory with the config file to use.
+    :param overrides: Dictionary of setting name to value.
+    :param rate: Messages per second, 0 for no flood.
+    :param duration: Seconds to run after the first frame.
+    :param timeout: Seconds to wait for the first frame.
+
+    :return: Tuple of (mean ms, p99 ms, max ms, late frames, frames,
+             messages) or None when the application did not report its
+             jitter. Raises RuntimeError when the flood failed.
+    """
+    workdir = tempfile.mkdtemp(prefix='jitterbench')
+    try:
+        settings = prepareWorkdir(cwd, workdir, overrides)
+        proc, lines, reader, output = startApplication(script, workdir,
+                                                       timeout)
+        if proc is None:
+            return None
+        messages = 0
+        stop = threading.Event()
+        if rate > 0:
+            flooder, result = startFlood(settings, rate, stop)
+        try:
+            sleep(duration)
+            stop.set()
+            if rate > 0:
+                messages = floodMessages(flooder, result)
+        finally:
+            stop.set()
+            stopApplication(proc, reader, lines, output)
+        # the last report is the one printed when the application stopped
+        last = None
+        for line in output:
+            match = JITTER.search(line)
+            if match:
+                last = match
+        if last is None:
+            return None
+        return (float(last.group(1)), float(last.group(2)),
+                float(last.group(3)), int(last.group(4)), int(last.group(5)),
+                messages)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(
+        description="Measure RGB Floodlight frame jitter with and without "
+                    "the render process under an MQTT flood.")
+    parser.add_argument('-C', '--cwd', default=here,
+                        help="directory with the config file")
+    parser.add_argument('-r', '--rate', type=float, default=200.0,
+                        help="MQTT messages per second, 0 for no flood "
+                             "(default 200)")
+    parser.add_argument('-d', '--duration', type=float, default=30.0,
+                        help="seconds to measure each mode (default 30)")
+    parser.add_argument('-t', '--timeout', type=float, default=30.0,
+                        help="seconds to wait for the first frame")
+    parser.add_argument('-s', '--set', action='append', default=[],
+                        metavar='NAME=VALUE',
+                        help="change an [RGB Floodlight] setting for both "
+                             "runs, can be repeated")
+    args = parser.parse_args()
+    broker = MiniBroker()
+    overrides = {'Broker': '127.0.0.1', 'Port': str(broker.port),
+                 'I2C_Bus': 'fake'}
+    for item in args.set:
+        name, sep, value = item.partition('=')
+        if sep == '':
+            parser.error("--set needs NAME=VALUE, not '%s'" % item)
+        overrides[name.strip()] = value.strip()
+    script = os.path.join(here, 'rgbfloodlight.py')
+
+    results = []
+    broker.start()
+    try:
+        for renderProcess in (False, True):
+            name = 'render process' if renderProcess else 'main process'
+            try:
+                overrides['Render_Process'] = ('true' if renderProcess
+                                               else 'false')
+                result = runOnce(script, args.cwd, overrides, args.rate,
+                                 args.duration, args.timeout)
+            except ValueError as e:
+                sys.exit("Config file error: %s" % e)
+            except RuntimeError as e:
+                sys.exit("%s: %s" % (name, e))
+            if result is None:
+                sys.exit("%s: the application did not report its frame "
+                         "jitter." % name)
+            results.append((name, result))
+            print("%-14s mean %6.2f ms  p99 %6.2f ms  max %6.2f ms  late %d "
+                  "of %d frames, %d messages" % ((name,) + result))
+    finally:
+        broker.stop()
+    (_, thread), (_, process) = results
+    if process[1] > 0 and thread[1] > 0:
+        print("")
+        if process[1] <= thread[1]:
+            print("p99 jitter with the render process is %.1fx lower."
+                  % (thread[1] / process[1]))
+        else:
+            print("p99 jitter with the render process is %.1fx higher."
+                  % (process[1] / thread[1]))
+
+if __name__ == '__main__':
+    main()
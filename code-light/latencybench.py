@@ -0,0 +1,420 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Command to light latency benchmark for the RGB Floodlight application.
+#
+# Runs rgbfloodlight.py on the simulated I2C bus (fakei2c.py) with a local
+# stand-in MQTT broker (minibroker.py) and sends timestamped light commands
+# to the light and group command topics. Each command sets a color no other
+# command uses, so the moment its PWM values land in the simulated PCA9685
+# is found in the frame log. The state the light publishes for each command
+# is timed too. The p50, p99 and max latencies and the dropped commands are
+# reported. A command followed by the next one before a frame was rendered
+# is superseded rather than dropped, keep the rate well under
+# LED_Update_Rate to time every command...
+#
+#   ./latencybench.py --count 5000 --rate 10 --group 0.25
+#
+# Recorded commands can be replayed with --replay. The file has either a
+# JSON object per line, {"time": 12.5, "topic": "...", "payload": "..."}
+# where time is optional, or lines of 'mosquitto_sub -v' output, a topic and
+# a payload separated by a space. Only topics ending in /set are replayed,
+# they go to the group command topic when they match it and to the light
+# command topic otherwise. Replayed commands don't have unique colors, so
+# only the time until the light publishes its state is measured for them.
+#
+# With --stream binary frames (colorstream.py) go to the stream topic of
+# the light instead, each with a unique color, and the number of states the
+# light published for them is counted...
+#
+#   ./latencybench.py --stream --count 2000 --rate 60
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+from time import monotonic, sleep
+
+from calibration import Calibration
+from colorstream import streamframe
+from fakei2c import readframes
+from jitterbench import prepareWorkdir, startApplication, stopApplication
+from minibroker import MiniBroker
+from powerlimit import PowerLimiter
+from renderer import readcalibration
+from soakbench import percentile
+
+"""A command sent to the light."""
+class Command:
+    def __init__(self, topic, payload, delay, color=None):
+        """
+        Initialize the command.
+
+        :param topic: The command topic.
+        :param payload: The payload string.
+        :param delay: Seconds to wait after the previous command.
+        :param color: The (r, g, b) color the command sets, None when the
+                      command is not timed to the PWM values.
+        """
+        self.topic = topic
+        self.payload = payload
+        self.delay = delay
+        self.color = color
+        self.sent = None
+        self.echoed = None
+        self.landed = None
+
+def commandTopics(settings):
+    """
+    Get the command topics of the light.
+
+    :param settings: The Settings of the light.
+
+    :return: Returns the (light, group) command topics.
+    """
+    light = "/".join([settings.discovery_prefix, 'light', settings.node_id,
+                      'rgblight', 'set'])
+    group = "/".join([settings.discovery_prefix, 'light', settings.group_id,
+                      'rgblight', 'set'])
+    return light, group
+
+def expectedPwm(settings):
+    """
+    Get a function that computes the PWM values of a color at full
+    brightness, the way the light does.
+
+    :param settings: The Settings of the light.
+
+    :return: Returns the function, it takes (r, g, b) and returns a tuple.
+    """
+    matrix, curves = readcalibration(settings)
+    calibration = Calibration(settings.gamma, (settings.scale_red,
+                                               settings.scale_green,
+                                               settings.scale_blue),
+                              matrix, curves)
+    limiter = PowerLimiter(settings.channel_watts, settings.power_budget)
+    return lambda color: tuple(limiter.limit(calibration.apply(*color)))
+
+def makeCommands(settings, count, rate, group, pwm):
+    """
+    Make commands with unique colors.
+
+    :param settings: The Settings of the light.
+    :param count: Number of commands.
+    :param rate: Commands per second.
+    :param group: Fraction of the commands sent to the group topic.
+    :param pwm: Function computing the PWM values of a color.
+
+    :return: Returns the list of Commands.
+    """
+    light, groupTopic = commandTopics(settings)
+    used = set()
+    commands = []
+    while len(commands) < count:
+        # values under 64 are too close together after gamma correction
+        color = tuple(random.randint(64, 255) for _i in range(3))
+        values = pwm(color)
+        if values in used:
+            continue
+        used.add(values)
+        topic = groupTopic if random.random() < group else light
+        payload = json.dumps({'color': {'r': color[0], 'g': color[1],
+                                        'b': color[2]}})
+        commands.append(Command(topic, payload, 1 / rate, color))
+    return commands
+
+def readReplay(filename, settings, rate, speed):
+    """
+    Read recorded commands.
+
+    :param filename: JSON lines or 'mosquitto_sub -v' output.
+    :param settings: The Settings of the light.
+    :param rate: Commands per second when the records have no time.
+    :param speed: Replay speed factor for records with a time.
+
+    :return: Returns the list of Commands.
+    """
+    light, group = commandTopics(settings)
+    commands = []
+    lastTime = None
+    with open(filename, 'r') as infile:
+        for line in infile:
+            line = line.strip()
+            if line == '':
+                continue
+            recordTime = None
+            if line.startswith('{'):
+                record = json.loads(line)
+                topic = record['topic']
+                payload = record['payload']
+                if not isinstance(payload, str):
+                    payload = json.dumps(payload)
+                recordTime = record.get('time')
+            else:
+                topic, _sep, payload = line.partition(' ')
+            if not topic.endswith('/set'):
+                continue
+            if recordTime is not None and lastTime is not None:
+                delay = max(recordTime - lastTime, 0.0) / speed
+            else:
+                delay = 1 / rate
+            if recordTime is not None:
+                lastTime = recordTime
+            commands.append(Command(group if topic == group else light,
+                                    payload, delay))
+    return commands
+
+def send(settings, port, commands, setup, wait):
+    """
+    Send the commands and time the state the light publishes.
+
+    :param settings: The Settings of the light.
+    :param port: Port of the broker.
+    :param commands: The Commands to send.
+    :param setup: Payloads sent to the light before the commands.
+    :param wait: Seconds to wait for the last state.
+
+    :return: Returns the number of states published after the setup.
+    """
+    import paho.mqtt.client as mqtt
+    light, _group = commandTopics(settings)
+    stateTopic = light[:-len('set')] + 'state'
+    lock = threading.Lock()
+    pending = []
+    ready = threading.Event()
+    states = []
+
+    def onMessage(client, userdata, msg):
+        now = monotonic()
+        states.append(now)
+        with lock:
+            # the state belongs to the latest command sent before it
+            if pending and pending[-1].echoed is None:
+                pending[-1].echoed = now
+        ready.set()
+
+    client = mqtt.Client()
+    client.on_message = onMessage
+    client.connect('127.0.0.1', port)
+    client.subscribe(stateTopic)
+    client.loop_start()
+    for payload in setup:
+        ready.clear()
+        client.publish(light, payload, qos=1)
+        ready.wait(2.0)
+    sleep(0.5)
+    start = len(states)
+    for command in commands:
+        sleep(command.delay)
+        with lock:
+            command.sent = monotonic()
+            pending.append(command)
+        client.publish(command.topic, command.payload)
+    sleep(wait)
+    client.loop_stop()
+    client.disconnect()
+    return len(states) - start
+
+def matchFrames(commands, frames, pwm):
+    """
+    Find when the PWM values of each color command landed.
+
+    :param commands: The Commands that were sent.
+    :param frames: The frame log, list of (timestamp, pwm values) tuples.
+    :param pwm: Function computing the PWM values of a color.
+    """
+    byValues = {}
+    for command in commands:
+        if command.color is not None:
+            byValues[pwm(command.color)] = command
+    for stamp, values in frames:
+        for length in (3, 4):
+            command = byValues.get(tuple(values[:length]))
+            if (command is not None and command.landed is None
+                    and stamp >= command.sent):
+                command.landed = stamp
+                break
+
+def superseded(commands, frames):
+    """
+    Count the commands that were followed by the next one before a frame
+    was written.
+
+    :param commands: The Commands that were sent.
+    :param frames: The frame log, list of (timestamp, pwm values) tuples.
+
+    :return: Returns a set of the superseded Commands.
+    """
+    stamps = [stamp for stamp, _values in frames]
+    result = set()
+    index = 0
+    for command, following in zip(commands, commands[1:]):
+        while index < len(stamps) and stamps[index] < command.sent:
+            index += 1
+        if index == len(stamps) or stamps[index] >= following.sent:
+            result.add(command)
+    return result
+
+def report(name, latencies, total, skipped=0):
+    """
+    Print the latency percentiles.
+
+    :param name: What was measured.
+    :param latencies: List of latencies in seconds.
+    :param total: Number of commands.
+    :param skipped: Number of superseded commands without a latency.
+    """
+    latencies = sorted(latencies)
+    dropped = total - skipped - len(latencies)
+    if len(latencies) == 0:
+        print("%-18s no commands measured of %d" % (name, total))
+        return
+    text = ("%-18s p50 %7.2f ms  p99 %7.2f ms  max %7.2f ms  dropped %d of %d"
+            % (name, percentile(latencies, 50) * 1000,
+               percentile(latencies, 99) * 1000, latencies[-1] * 1000,
+               dropped, total))
+    if skipped:
+        text += ", %d superseded" % skipped
+    print(text)
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(
+        description="Measure RGB Floodlight command to light latency.")
+    parser.add_argument('-C', '--cwd', default=here,
+                        help="directory with the config file")
+    parser.add_argument('-n', '--count', type=int, default=2000,
+                        help="number of commands (default 2000)")
+    parser.add_argument('-r', '--rate', type=float, default=10.0,
+                        help="commands per second (default 10)")
+    parser.add_argument('-g', '--group', type=float, default=0.25,
+                        help="fraction of commands sent to the group topic "
+                             "(default 0.25)")
+    parser.add_argument('--stream', action='store_true',
+                        help="send binary frames to the stream topic")
+    parser.add_argument('--replay', help="replay recorded commands from "
+                                         "this file")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="replay speed factor for recorded times "
+                             "(default 1.0)")
+    parser.add_argument('-s', '--set', action='append', default=[],
+                        metavar='NAME=VALUE',
+                        help="change an [RGB Floodlight] setting, can be "
+                             "repeated")
+    parser.add_argument('-t', '--timeout', type=float, default=30.0,
+                        help="seconds to wait for the first frame")
+    args = parser.parse_args()
+    script = os.path.join(here, 'rgbfloodlight.py')
+
+    broker = MiniBroker()
+    broker.start()
+    workdir = tempfile.mkdtemp(prefix='latencybench')
+    frameLog = os.path.join(workdir, 'frames.bin')
+    overrides = {'Broker': '127.0.0.1', 'Port': str(broker.port),
+                 'I2C_Bus': 'fake', 'Group_Enabled': 'true',
+                 'Group_Master': 'true'}
+    if args.stream:
+        overrides['Stream_Enabled'] = 'true'
+    for item in args.set:
+        name, sep, value = item.partition('=')
+        if sep == '':
+            parser.error("--set needs NAME=VALUE, not '%s'" % item)
+        overrides[name.strip()] = value.strip()
+    try:
+        try:
+            settings = prepareWorkdir(args.cwd, workdir, overrides)
+        except ValueError as e:
+            sys.exit("Config file error: %s" % e)
+        pwm = expectedPwm(settings)
+        if args.replay:
+            commands = readReplay(args.replay, settings, args.rate,
+                                  args.speed)
+        else:
+            commands = makeCommands(settings, args.count, args.rate,
+                                    args.group, pwm)
+        if args.stream:
+            light, _group = commandTopics(settings)
+            for command in commands:
+                command.topic = light[:-len('set')] + 'stream'
+                command.payload = streamframe([command.color])
+        env = dict(os.environ, RGBFLOODLIGHT_FAKE_I2C_LOG=frameLog)
+        proc, lines, reader, output = startApplication(script, workdir,
+                                                       args.timeout, env)
+        if proc is None:
+            sys.exit("No first frame within %.0f seconds:\n%s"
+                     % (args.timeout, "".join(output)))
+        # a steady single color at full brightness so the PWM values only
+        # change with the commands
+        setup = ['{"state": "ON"}', '{"effect": "Single Color"}',
+                 '{"brightness": 255}']
+        try:
+            states = send(settings, broker.port, commands, setup,
+                          wait=settings.stream_timeout + 1.0
+                          if args.stream else 1.0)
+        finally:
+            stopApplication(proc, reader, lines, output)
+        frames = readframes(frameLog) if os.path.isfile(frameLog) else []
+    finally:
+        broker.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    matchFrames(commands, frames, pwm)
+    skipped = superseded(commands, frames)
+    if args.stream:
+        print("%d stream frames, %d frames written, %d states published"
+              % (len(commands), len(frames), states))
+        print("")
+        report("PWM written", [c.landed - c.sent for c in commands
+                               if c.landed is not None], len(commands),
+               sum(1 for c in commands
+                   if c.landed is None and c in skipped))
+        return
+    light, group = commandTopics(settings)
+    print("%d commands, %d to the group topic, %d frames written"
+          % (len(commands), sum(1 for c in commands if c.topic == group),
+             len(frames)))
+    print("")
+    for name, topics in (("All commands", (light, group)),
+                         ("Light commands", (light,)),
+                         ("Group commands", (group,))):
+        selected = [c for c in commands if c.topic in topics]
+        if len(selected) == 0:
+            continue
+        print(name + ":")
+        report("  state published", [c.echoed - c.sent for c in selected
+                                     if c.echoed is not None],
+               len(selected))
+        timed = [c for c in selected if c.color is not None]
+        if timed:
+            report("  PWM written", [c.landed - c.sent for c in timed
+                                     if c.landed is not None], len(timed),
+                   sum(1 for c in timed
+                       if c.landed is None and c in skipped))
+
+if __name__ == '__main__':
+    main()
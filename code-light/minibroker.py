@@ -0,0 +1,390 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Minimal MQTT 3.1.1 broker for the benchmarks and tests.
+#
+# Enough of MQTT for the RGB Floodlight application and paho clients:
+# CONNECT with any user name and password, PUBLISH at QoS 0, 1 and 2,
+# SUBSCRIBE and UNSUBSCRIBE with + and # wildcards, retained messages, will
+# messages, PINGREQ and DISCONNECT. Messages are always delivered at QoS 0
+# and there are no persistent sessions. It can run in a thread of a
+# benchmark or on its own...
+#
+#   ./minibroker.py --port 1883
+
+import argparse
+import socket
+import socketserver
+import struct
+import threading
+from time import sleep
+
+# packet types
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+def topicmatches(topicFilter, topic):
+    """
+    Check if a topic matches a subscription topic filter.
+
+    :param topicFilter: The topic filter, may have + and # wildcards.
+    :param topic: The topic of a message.
+
+    :return: Returns True when the topic matches.
+    """
+    filterLevels = topicFilter.split('/')
+    topicLevels = topic.split('/')
+    for i, level in enumerate(filterLevels):
+        if level == '#':
+            return True
+        if i >= len(topicLevels):
+            return False
+        if level != '+' and level != topicLevels[i]:
+            return False
+    return len(filterLevels) == len(topicLevels)
+
+def encodelength(length):
+    """
+    Encode the remaining length of a packet.
+
+    :param length: The remaining length.
+
+    :return: Returns the encoded bytes.
+    """
+    data = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length > 0:
+            byte |= 0x80
+        data.append(byte)
+        if length == 0:
+            return bytes(data)
+
+def encodestring(text):
+    """
+    Encode a string with its length.
+
+    :param text: The string or bytes.
+
+    :return: Returns the encoded bytes.
+    """
+    if isinstance(text, str):
+        text = text.encode('utf-8')
+    return struct.pack('!H', len(text)) + text
+
+def packet(kind, flags, body):
+    """
+    Build a packet.
+
+    :param kind: The packet type.
+    :param flags: The flags of the fixed header.
+    :param body: The variable header and payload.
+
+    :return: Returns the packet bytes.
+    """
+    return bytes([(kind << 4) | flags]) + encodelength(len(body)) + body
+
+"""Connection of one client."""
+class ClientHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        """Initialize the connection."""
+        self.broker = self.server.broker
+        self.sendLock = threading.Lock()
+        self.subscriptions = {}
+        self.will = None
+        self.clientId = ''
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = self.request.makefile('rb')
+
+    def send(self, data):
+        """
+        Send a packet, errors are left for the reading side to notice.
+
+        :param data: The packet bytes.
+        """
+        with self.sendLock:
+            try:
+                self.request.sendall(data)
+            except OSError:
+                pass
+
+    def readpacket(self):
+        """
+        Read one packet.
+
+        :return: Returns (type, flags, body) or None when the connection is
+                 closed.
+        """
+        header = self.buffer.read(1)
+        if len(header) == 0:
+            return None
+        length = 0
+        multiplier = 1
+        while True:
+            byte = self.buffer.read(1)
+            if len(byte) == 0:
+                return None
+            length += (byte[0] & 0x7F) * multiplier
+            multiplier *= 128
+            if byte[0] & 0x80 == 0:
+                break
+        body = self.buffer.read(length)
+        if len(body) < length:
+            return None
+        return header[0] >> 4, header[0] & 0x0F, body
+
+    def handle(self):
+        """Handle packets until the client disconnects."""
+        clean = False
+        try:
+            while True:
+                result = self.readpacket()
+                if result is None:
+                    break
+                kind, flags, body = result
+                if kind == CONNECT:
+                    self.connect(body)
+                elif kind == PUBLISH:
+                    self.publish(flags, body)
+                elif kind == PUBREL:
+                    self.send(packet(PUBCOMP, 0, body[:2]))
+                elif kind == SUBSCRIBE:
+                    self.subscribe(body)
+                elif kind == UNSUBSCRIBE:
+                    self.unsubscribe(body)
+                elif kind == PINGREQ:
+                    self.send(packet(PINGRESP, 0, b''))
+                elif kind == DISCONNECT:
+                    clean = True
+                    break
+        except (OSError, ValueError, IndexError, struct.error):
+            pass
+        finally:
+            self.broker.remove(self)
+            if not clean and self.will is not None:
+                self.broker.deliver(*self.will)
+
+    def connect(self, body):
+        """
+        Handle CONNECT, every client is accepted.
+
+        :param body: The packet body.
+        """
+        pos = 2 + struct.unpack_from('!H', body, 0)[0]
+        connectFlags = body[pos + 1]
+        pos += 4
+        self.clientId, pos = self.readstring(body, pos)
+        if connectFlags & 0x04:
+            topic, pos = self.readstring(body, pos)
+            message, pos = self.readbytes(body, pos)
+            self.will = (topic, message, bool(connectFlags & 0x20))
+        self.send(packet(CONNACK, 0, b'\x00\x00'))
+        self.broker.add(self)
+
+    def publish(self, flags, body):
+        """
+        Handle PUBLISH.
+
+        :param flags: The flags of the fixed header.
+        :param body: The packet body.
+        """
+        qos = (flags >> 1) & 0x03
+        topic, pos = self.readstring(body, 0)
+        if qos > 0:
+            packetId = body[pos:pos + 2]
+            pos += 2
+        self.broker.deliver(topic, body[pos:], bool(flags & 0x01))
+        if qos == 1:
+            self.send(packet(PUBACK, 0, packetId))
+        elif qos == 2:
+            self.send(packet(PUBREC, 0, packetId))
+
+    def subscribe(self, body):
+        """
+        Handle SUBSCRIBE, every subscription is granted at QoS 0.
+
+        :param body: The packet body.
+        """
+        packetId = body[:2]
+        pos = 2
+        topics = []
+        while pos < len(body):
+            topicFilter, pos = self.readstring(body, pos)
+            pos += 1
+            topics.append(topicFilter)
+        with self.broker.lock:
+            for topicFilter in topics:
+                self.subscriptions[topicFilter] = True
+        self.send(packet(SUBACK, 0, packetId + bytes(len(topics))))
+        for topicFilter in topics:
+            for topic, message in self.broker.retained(topicFilter):
+                self.send(packet(PUBLISH, 0x01,
+                                 encodestring(topic) + message))
+
+    def unsubscribe(self, body):
+        """
+        Handle UNSUBSCRIBE.
+
+        :param body: The packet body.
+        """
+        packetId = body[:2]
+        pos = 2
+        with self.broker.lock:
+            while pos < len(body):
+                topicFilter, pos = self.readstring(body, pos)
+                self.subscriptions.pop(topicFilter, None)
+        self.send(packet(UNSUBACK, 0, packetId))
+
+    def readbytes(self, body, pos):
+        """Read bytes with a length, returns (bytes, next position)."""
+        length = struct.unpack_from('!H', body, pos)[0]
+        return body[pos + 2:pos + 2 + length], pos + 2 + length
+
+    def readstring(self, body, pos):
+        """Read a string with a length, returns (string, next position)."""
+        data, pos = self.readbytes(body, pos)
+        return data.decode('utf-8'), pos
+
+"""Threaded TCP server that knows its broker."""
+class BrokerServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+"""Minimal MQTT broker."""
+class MiniBroker:
+    def __init__(self, host='127.0.0.1', port=0):
+        """
+        Initialize the broker.
+
+        :param host: Address to listen on.
+        :param port: Port to listen on, 0 picks a free port.
+        """
+        self.lock = threading.Lock()
+        self._clients = []
+        self._retained = {}
+        self.received = 0
+        self.delivered = 0
+        self._server = BrokerServer((host, port), ClientHandler)
+        self._server.broker = self
+        self._thread = None
+
+    @property
+    def port(self):
+        """
+        The port property.
+
+        :return: The port the broker listens on.
+        """
+        return self._server.server_address[1]
+
+    def start(self):
+        """Start serving in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name="MiniBroker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving and close the listening socket."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def add(self, client):
+        """Add a connected client."""
+        with self.lock:
+            self._clients.append(client)
+
+    def remove(self, client):
+        """Remove a disconnected client."""
+        with self.lock:
+            if client in self._clients:
+                self._clients.remove(client)
+
+    def retained(self, topicFilter):
+        """
+        Get the retained messages for a new subscription.
+
+        :param topicFilter: The topic filter.
+
+        :return: Returns a list of (topic, message) tuples.
+        """
+        with self.lock:
+            return [(topic, message)
+                    for topic, message in self._retained.items()
+                    if topicmatches(topicFilter, topic)]
+
+    def deliver(self, topic, message, retain=False):
+        """
+        Deliver a message to every subscribed client.
+
+        :param topic: The topic.
+        :param message: The message bytes.
+        :param retain: Keep the message for new subscriptions, an empty
+                       message removes the retained message.
+        """
+        with self.lock:
+            self.received += 1
+            if retain:
+                if len(message) == 0:
+                    self._retained.pop(topic, None)
+                else:
+                    self._retained[topic] = message
+            targets = [client for client in self._clients
+                       if any(topicmatches(topicFilter, topic)
+                              for topicFilter in client.subscriptions)]
+            self.delivered += len(targets)
+        data = packet(PUBLISH, 0, encodestring(topic) + message)
+        for client in targets:
+            client.send(data)
+
+def main():
+    parser = argparse.ArgumentParser(description="Minimal MQTT broker.")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="address to listen on (default 127.0.0.1)")
+    parser.add_argument('-p', '--port', type=int, default=1883,
+                        help="port to listen on (default 1883)")
+    args = parser.parse_args()
+    broker = MiniBroker(args.host, args.port)
+    broker.start()
+    print("Listening on %s:%d" % (args.host, broker.port))
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        broker.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+from collections import OrderedDict
+import logging
+import random
+import threading
+
+# logger for this module
+logger = logging.getLogger(__name__)
+
+"""Keeps a paho MQTT client connected and queues publishes while offline."""
+class MqttManager:
+    def __init__(self, client, host, port=1883, keepalive=60,
+                 min_delay=1.0, max_delay=120.0, queue_size=100):
+        """
+        Initialize the connection manager.
+
+        The manager takes over the client's on_connect and on_disconnect
+        callbacks. Use the manager's on_connect, on_disconnect and
+        on_connect_fail attributes instead, they have the same signatures
+        as the paho callbacks.
+
+        :param client: The paho MQTT client.
+        :param host: The broker host name.
+        :param port: The broker port.
+        :param keepalive: The MQTT keep alive time in seconds.
+        :param min_delay: Delay before the first reconnect attempt in seconds.
+        :param max_delay: Upper limit of the reconnect delay in seconds.
+        :param queue_size: Maximum number of topics queued while offline.
+        """
+        self._client = client
+        self._host = host
+        self._port = port
+        self._keepalive = keepalive
+        self._minDelay = min_delay
+        self._maxDelay = max_delay
+        self._queueSize = queue_size
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._connected = False
+        self._attempt = 0
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_connect_fail = None
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        # an exception in a callback is logged by paho instead of ending the
+        # network loop
+        client.suppress_exceptions = True
+
+    @property
+    def connected(self):
+        """
+        The connected property.
+
+        :return: True when connected to the broker.
+        """
+        return self._connected
+
+    @property
+    def client(self):
+        """
+        The client property.
+
+        :return: The paho MQTT client.
+        """
+        return self._client
+
+    def start(self):
+        """Start connecting to the broker in the background."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="MqttManager",
+                                        daemon=True)
+        self._thread.start()
+
+    def reconfigure(self, host, port=1883, keepalive=60, min_delay=1.0,
+                    max_delay=120.0, queue_size=100):
+        """
+        Change the connection settings.
+
+        The new broker settings are used the next time a connection is made,
+        call reconnect() to use them right away.
+
+        :param host: The broker host name.
+        :param port: The broker port.
+        :param keepalive: The MQTT keep alive time in seconds.
+        :param min_delay: Delay before the first reconnect attempt in seconds.
+        :param max_delay: Upper limit of the reconnect delay in seconds.
+        :param queue_size: Maximum number of topics queued while offline.
+        """
+        with self._lock:
+            self._host = host
+            self._port = port
+            self._keepalive = keepalive
+            self._minDelay = min_delay
+            self._maxDelay = max_delay
+            self._queueSize = queue_size
+
+    def reconnect(self):
+        """Drop the connection and reconnect without waiting."""
+        with self._lock:
+            self._attempt = 0
+        self._wake.set()
+        self._client.disconnect()
+
+    def stop(self, timeout=5.0):
+        """
+        Disconnect from the broker and stop the background thread.
+
+        Messages published before stop() is called are sent before the
+        connection is closed.
+
+        :param timeout: Seconds to wait for the background thread.
+        """
+        self._stop.set()
+        self._wake.set()
+        self._client.disconnect()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        """
+        Publish a message or queue it when not connected.
+
+        Only the latest message for each topic is queued. When more than
+        queue_size topics are waiting the oldest is dropped. The queue is
+        flushed as soon as the connection is back.
+
+        :param topic: The topic to publish to.
+        :param payload: The message payload.
+        :param qos: The MQTT quality of service.
+        :param retain: True to have the broker retain the message.
+        """
+        with self._lock:
+            if self._connected:
+                info = self._client.publish(topic, payload=payload, qos=qos,
+                                            retain=retain)
+                if info.rc == 0:
+                    return
+            # offline or publish failed, keep only the latest per topic
+            self._pending.pop(topic, None)
+            self._pending[topic] = (payload, qos, retain)
+            while len(self._pending) > self._queueSize:
+                dropped, _ = self._pending.popitem(last=False)
+                logger.debug("Publish queue full, dropped '%s'" % dropped)
+
+    def _delay(self):
+        """
+        Get the next reconnect delay.
+
+        Exponential backoff with jitter so a fleet of lights does not
+        reconnect to a restarted broker all at once.
+        """
+        ceiling = min(self._maxDelay, self._minDelay * (2 ** self._attempt))
+        self._attempt = min(self._attempt + 1, 32)
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    def _run(self):
+        """Connect, run the network loop and reconnect until stopped."""
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self._client.connect(self._host, port=self._port,
+                                     keepalive=self._keepalive)
+            except (OSError, ValueError):
+                # socket error, name resolution failure or the like
+                if self.on_connect_fail is not None:
+                    self.on_connect_fail(self._client, None)
+            else:
+                # run the network loop until the connection is lost
+                while not self._stop.is_set():
+                    try:
+                        if self._client.loop(timeout=1.0) != 0:
+                            break
+                    except Exception:
+                        # keep the connection, the next message may well
+                        # work
+                        logger.exception("MQTT network loop failed")
+                if self._stop.is_set():
+                    # flush anything queued by the final publishes
+                    self._client.loop(timeout=1.0)
+                    break
+            if self._wake.is_set():
+                # reconnect() was called, don't wait
+                continue
+            delay = self._delay()
+            logger.info("Reconnecting to broker in %.1f seconds" % delay)
+            self._wake.wait(delay)
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            # send everything that was queued while offline in one batch,
+            # before the handler publishes newer values for the same topics
+            with self._lock:
+                self._connected = True
+                self._attempt = 0
+                pending = self._pending
+                self._pending = OrderedDict()
+                for topic, (payload, qos, retain) in pending.items():
+                    self._client.publish(topic, payload=payload, qos=qos,
+                                         retain=retain)
+            if len(pending) > 0:
+                logger.info("Flushed %d queued publishes" % len(pending))
+        if self.on_connect is not None:
+            self.on_connect(client, userdata, flags, rc)
+
+    def _on_disconnect(self, client, userdata, rc):
+        with self._lock:
+            self._connected = False
+        if self.on_disconnect is not None:
+            self.on_disconnect(client, userdata, rc)
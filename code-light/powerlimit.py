@@ -0,0 +1,182 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Power budget limiter for the LED channels.
+#
+# The power drawn by each channel is modeled as its power at 100% duty times
+# its pwm duty. When the sum of all channels is over the budget every
+# channel is scaled down by the same factor so the color stays the same.
+# The power and energy count the pwm values that were written, frames that
+# are computed ahead and then dropped don't count.
+#
+import logging
+import threading
+from time import monotonic
+
+# logger for this module
+logger = logging.getLogger(__name__)
+
+# full scale pwm value
+PWMMAX = 4095
+# resolution of the load, the full load of all channels is LOADSTEPS
+LOADSTEPS = 4096
+# fraction bits of the load weights and the reciprocal table
+WEIGHTBITS = 12
+RECIPBITS = 16
+
+"""Scale pwm values to keep the LED power within a budget."""
+class PowerLimiter:
+    def __init__(self, watts=(20.0, 20.0, 20.0), budget=60.0):
+        """
+        Initialize the limiter.
+
+        :param watts: Power of each channel at 100% duty in watts.
+        :param budget: Total power allowed for all channels in watts.
+        """
+        self._lock = threading.Lock()
+        self._joules = 0.0
+        self._power = 0.0
+        self._since = monotonic()
+        self._load = 0
+        self.configure(watts, budget)
+
+    def configure(self, watts, budget):
+        """
+        Change the power model, the accumulated energy is kept.
+
+        :param watts: Power of each channel at 100% duty in watts.
+        :param budget: Total power allowed for all channels in watts.
+        """
+        total = float(sum(watts))
+        if total <= 0:
+            total = 1.0
+        # weights turn the pwm values into a load of 0 - LOADSTEPS
+        weights = [int(round(w * (LOADSTEPS << WEIGHTBITS) / (total * PWMMAX)))
+                   for w in watts]
+        limit = min(int(budget / total * LOADSTEPS), LOADSTEPS)
+        # the scale factor for every load over the limit, entries up to the
+        # limit are never used
+        recip = [1 << RECIPBITS] * (limit + 1)
+        recip.extend((limit << RECIPBITS) // load
+                     for load in range(limit + 1, LOADSTEPS + 1))
+        # switch everything at once, the render thread may be using it
+        self._model = (weights, limit, recip, total / LOADSTEPS)
+        logger.debug("Power budget %.1f W of %.1f W full load"
+                     % (budget, total))
+
+    def limit(self, pwmValues):
+        """
+        Scale the pwm values down when they are over the budget. The power
+        is counted by account() when they are written.
+
+        :param pwmValues: List of pwm values, changed in place.
+
+        :return: Returns the pwm values.
+        """
+        weights, limit, recip, _wattsPerStep = self._model
+        load = self._loadof(pwmValues, weights)
+        if load > limit:
+            scale = recip[load]
+            for i in range(len(pwmValues)):
+                pwmValues[i] = (pwmValues[i] * scale) >> RECIPBITS
+        return pwmValues
+
+    def account(self, pwmValues):
+        """
+        Switch the power to that of pwm values that were just written.
+
+        :param pwmValues: The pwm values written, scaled by limit().
+        """
+        weights, _limit, _recip, wattsPerStep = self._model
+        load = self._loadof(pwmValues, weights)
+        if load != self._load:
+            self._account(load, load * wattsPerStep)
+
+    @staticmethod
+    def _loadof(pwmValues, weights):
+        """
+        Compute the load of pwm values.
+
+        :param pwmValues: List of pwm values.
+        :param weights: The load weights of the channels.
+
+        :return: Returns the load in the range 0 - LOADSTEPS.
+        """
+        load = 0
+        for value, weight in zip(pwmValues, weights):
+            load += value * weight
+        return load >> WEIGHTBITS
+
+    def limitarray(self, pwmValues):
+        """
+        Scale many rows of pwm values down like limit() does. Needs numpy.
+
+        :param pwmValues: numpy array with a row of pwm values for each
+                          frame, changed in place.
+
+        :return: Returns the pwm values.
+        """
+        import numpy
+        weights, limit, recip, _wattsPerStep = self._model
+        channels = min(pwmValues.shape[1], len(weights))
+        load = (pwmValues[:, :channels]
+                * numpy.array(weights[:channels])).sum(axis=1) >> WEIGHTBITS
+        over = load > limit
+        if over.any():
+            scale = numpy.array(recip)[load[over]]
+            pwmValues[over] = (pwmValues[over] * scale[:, None]) >> RECIPBITS
+        return pwmValues
+
+    def _account(self, load, power):
+        """
+        Add the energy used at the old power and switch to the new power.
+
+        :param load: The new load.
+        :param power: The new power in watts.
+        """
+        with self._lock:
+            now = monotonic()
+            self._joules += self._power * (now - self._since)
+            self._since = now
+            self._power = power
+            self._load = load
+
+    @property
+    def power(self):
+        """
+        The power property.
+
+        :return: The estimated LED power in watts.
+        """
+        return self._power
+
+    @property
+    def energy(self):
+        """
+        The energy property.
+
+        :return: The estimated LED energy used since start in watt hours.
+        """
+        with self._lock:
+            joules = self._joules + self._power * (monotonic() - self._since)
+        return joules / 3600
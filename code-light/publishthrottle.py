@@ -0,0 +1,108 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import logging
+import threading
+from time import monotonic
+
+# logger for this module
+logger = logging.getLogger(__name__)
+
+"""Leaves out repeated state publishes and limits how often a topic is
+published."""
+class PublishThrottle:
+    def __init__(self, publish):
+        """
+        Initialize the throttle.
+
+        :param publish: Function publish(topic, payload=, qos=, retain=) the
+                        messages are sent with, like MqttManager.publish.
+        """
+        self._publish = publish
+        self._lock = threading.Lock()
+        # last payload sent and when for every topic
+        self._last = {}
+        self._sent = {}
+        # payloads held back until their topic may be published again
+        self._pending = {}
+        self.published = 0
+        self.skipped = 0
+
+    def publish(self, topic, payload, qos=0, retain=False, interval=0.0):
+        """
+        Publish a message unless it is the same as the last one sent.
+
+        A message that comes less than interval seconds after the last one
+        on its topic is held back, when the interval is over the latest
+        held back message is sent.
+
+        :param topic: The topic to publish to.
+        :param payload: The message payload.
+        :param qos: The MQTT quality of service.
+        :param retain: True to have the broker retain the message.
+        :param interval: Shortest time between messages on the topic in
+                         seconds.
+        """
+        with self._lock:
+            if payload == self._last.get(topic):
+                # back to what was sent, anything held back is outdated
+                if self._pending.pop(topic, None) is None:
+                    self.skipped += 1
+                return
+            now = monotonic()
+            due = self._sent.get(topic, now - interval) + interval
+            if topic in self._pending:
+                self._pending[topic] = (payload, qos, retain)
+                self.skipped += 1
+            elif now >= due:
+                self._send(topic, payload, qos, retain, now)
+            else:
+                self._pending[topic] = (payload, qos, retain)
+                timer = threading.Timer(due - now, self._flush, args=(topic,))
+                timer.daemon = True
+                timer.start()
+
+    def forget(self):
+        """
+        Forget the payloads sent so the next message of every topic is
+        published, for instance after connecting to the broker again.
+        """
+        with self._lock:
+            self._last.clear()
+
+    def _send(self, topic, payload, qos, retain, now):
+        """Send a message, called with the lock held."""
+        self._last[topic] = payload
+        self._sent[topic] = now
+        self.published += 1
+        self._publish(topic, payload=payload, qos=qos, retain=retain)
+
+    def _flush(self, topic):
+        """
+        Send the message held back for a topic.
+
+        :param topic: The topic.
+        """
+        with self._lock:
+            message = self._pending.pop(topic, None)
+            if message is not None:
+                self._send(topic, *message, now=monotonic())
@@ -0,0 +1,286 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Offline effect renderer for the RGB Floodlight application.
+#
+# Renders an effect to a file as fast as the CPU allows, with the color
+# wheels and the pwm math of the light but without sleeping or touching a
+# PCA9685. The gamma, calibration, power budget, blend mode and effects come
+# from the config file. The output is one of...
+#
+#   csv     time, color and pwm values of every frame
+#   binary  frame file (framerec.py), plays back with framereplay.py and
+#           compares bit for bit with a recording of the light
+#   png     strip with a column of the effect color for every frame
+#
+#   ./render.py --effect "Rainbow Blend" --transition 180 --fps 200 -o rb.png
+#
+# numpy is used for the pwm math when it is installed.
+
+import argparse
+import importlib
+import os
+import struct
+import sys
+import zlib
+from itertools import chain
+from time import perf_counter
+
+import colorwheel
+import effects
+import fakei2c
+from color import Color
+from framerec import CHANNELS, packframe
+from powerlimit import PowerLimiter
+from renderer import readcalibration
+from rgbled import RgbLed
+from settings import loadsettings
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# output format for each file name extension
+FORMATS = {'.csv': 'csv', '.bin': 'binary', '.png': 'png'}
+
+def loadeffects(settings, confdir):
+    """
+    Register the effect plugins and user defined effects of the settings.
+
+    :param settings: The Settings naming the plugins and effects file.
+    :param confdir: Directory of the config file, the effects file is
+                    relative to it.
+    """
+    for plugin in settings.effect_plugins:
+        try:
+            importlib.import_module(plugin)
+        except Exception as e:
+            print("Failed to load effect plugin '%s': %s" % (plugin, e),
+                  file=sys.stderr)
+    filename = os.path.join(confdir, settings.effects_file)
+    if os.path.isfile(filename):
+        try:
+            effects.loadeffects(filename)
+        except ValueError as e:
+            print("Failed to load effects file '%s': %s" % (filename, e),
+                  file=sys.stderr)
+
+def rendercolors(wheel, transition, fps, count):
+    """
+    Compute the effect color of every frame the way the light does.
+
+    :param wheel: The ColorWheel of the effect.
+    :param transition: Seconds per cycle of the effect.
+    :param fps: Frames per second.
+    :param count: Number of frames.
+
+    :return: Returns the list of Colors.
+    """
+    getrgb = wheel.getrgb
+    if transition <= 0:
+        return [getrgb(0.0)] * count
+    return [getrgb(((i / fps) / transition) % 1.0 * 360)
+            for i in range(count)]
+
+def renderpwm(led, colors):
+    """
+    Compute the pwm values of the colors.
+
+    :param led: The RgbLed with the brightness and color correction.
+    :param colors: The list of Colors.
+
+    :return: Returns a numpy array or a list with the pwm values of every
+             color.
+    """
+    if numpy is not None:
+        rgb = numpy.fromiter(chain.from_iterable(colors), numpy.float64,
+                             len(colors) * 3).reshape(-1, 3)
+        return led.pwmarray(rgb[:, 0], rgb[:, 1], rgb[:, 2])
+    return [led.pwmvalues(color) for color in colors]
+
+def writecsv(outfile, fps, colors, pwm, brightness):
+    """
+    Write the frames as CSV.
+
+    :param outfile: Text file to write to.
+    :param fps: Frames per second.
+    :param colors: The Colors of the frames.
+    :param pwm: The pwm values of the frames.
+    :param brightness: Brightness 0 - 255 of the frames.
+    """
+    channels = len(pwm[0]) if len(pwm) else 3
+    names = ['pwm_red', 'pwm_green', 'pwm_blue', 'pwm_white'][:channels]
+    outfile.write(",".join(['time', 'red', 'green', 'blue', 'brightness']
+                           + names) + "\n")
+    rows = pwm.tolist() if numpy is not None else pwm
+    outfile.writelines(
+        "%s,%s,%s,%s,%d,%s\n" % (repr(i / fps), color.r, color.g, color.b,
+                                 brightness, ",".join(map(str, values)))
+        for i, (color, values) in enumerate(zip(colors, rows)))
+
+def writebinary(outfile, fps, pwm):
+    """
+    Write the frames as a frame file.
+
+    :param outfile: Binary file to write to.
+    :param fps: Frames per second.
+    :param pwm: The pwm values of the frames.
+    """
+    if numpy is not None:
+        records = numpy.zeros(len(pwm), dtype=[('time', '<f8'),
+                                               ('pwm', '<u2', CHANNELS)])
+        records['time'] = numpy.arange(len(pwm)) / fps
+        records['pwm'][:, :pwm.shape[1]] = pwm
+        outfile.write(records.tobytes())
+        return
+    outfile.write(b''.join(packframe(i / fps, values)
+                           for i, values in enumerate(pwm)))
+
+def writepng(outfile, colors, brightness, height, width):
+    """
+    Write a strip of the effect colors as a PNG image.
+
+    :param outfile: Binary file to write to.
+    :param colors: The Colors of the frames.
+    :param brightness: Brightness 0 - 255 the colors are scaled by.
+    :param height: Height of the image in pixels.
+    :param width: Width of the image, every frame is a column when 0.
+    """
+    if width <= 0 or width > len(colors):
+        width = len(colors)
+    scale = brightness / 255
+    row = bytearray([0])
+    for x in range(width):
+        color = colors[x * len(colors) // width]
+        row.extend(int(min(max(value * scale, 0), 255) + 0.5)
+                   for value in color)
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data)))
+
+    outfile.write(b'\x89PNG\r\n\x1a\n')
+    outfile.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2,
+                                            0, 0, 0)))
+    outfile.write(chunk(b'IDAT', zlib.compress(bytes(row) * height, 6)))
+    outfile.write(chunk(b'IEND', b''))
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(
+        description="Render an RGB Floodlight effect to a file without the "
+                    "light.")
+    parser.add_argument('-c', '--config',
+                        default=os.path.join(here, 'rgbfloodlight.conf'),
+                        help="config file with the color correction")
+    parser.add_argument('-e', '--effect', default='Primary Blend',
+                        help="effect name (default 'Primary Blend')")
+    parser.add_argument('--color', default='255,0,255', metavar='R,G,B',
+                        help="color of the single color effects "
+                             "(default 255,0,255)")
+    parser.add_argument('-b', '--brightness', type=int, default=255,
+                        help="brightness 0 - 255 (default 255)")
+    parser.add_argument('-t', '--transition', type=float, default=120.0,
+                        help="seconds per cycle of the effect (default 120)")
+    parser.add_argument('-r', '--fps', type=float,
+                        help="frames per second (default LED_Update_Rate)")
+    parser.add_argument('-d', '--duration', type=float,
+                        help="seconds to render (default one cycle)")
+    parser.add_argument('-f', '--format', choices=['csv', 'binary', 'png'],
+                        help="output format (default from the output file "
+                             "name, csv for stdout)")
+    parser.add_argument('-o', '--output', help="file to write, stdout for "
+                                               "csv when not given")
+    parser.add_argument('--height', type=int, default=32,
+                        help="height of the png strip (default 32)")
+    parser.add_argument('--width', type=int, default=0,
+                        help="width of the png strip, 0 for a column per "
+                             "frame (default 0)")
+    args = parser.parse_args()
+    try:
+        color = Color(*(int(value) for value in args.color.split(',')))
+    except (TypeError, ValueError):
+        parser.error("--color needs R,G,B values 0 - 255")
+    if not 0 <= args.brightness <= 255:
+        parser.error("--brightness must be 0 - 255")
+    outputFormat = args.format
+    if outputFormat is None:
+        extension = os.path.splitext(args.output or '')[1].lower()
+        outputFormat = FORMATS.get(extension, 'csv')
+    if outputFormat != 'csv' and args.output is None:
+        parser.error("--output is needed for %s" % outputFormat)
+
+    try:
+        settings = loadsettings(args.config)
+    except ValueError as e:
+        sys.exit("Config file error: %s" % e)
+    loadeffects(settings, os.path.dirname(os.path.abspath(args.config)))
+    if not colorwheel.iscolorwheel(args.effect):
+        sys.exit("Unknown effect '%s', the effects are: %s"
+                 % (args.effect, ", ".join(colorwheel.getcolorwheellist())))
+    fps = args.fps or settings.led_update_rate
+    if fps <= 0:
+        parser.error("--fps must be > 0")
+    duration = args.duration
+    if duration is None:
+        duration = args.transition if args.transition > 0 else 1.0
+    count = max(int(round(duration * fps)), 1)
+
+    # the pwm math of the light on the simulated bus, nothing is written
+    matrix, curves = readcalibration(settings)
+    led = RgbLed(freq=settings.pwm_frequency, gamma=settings.gamma,
+                 scaleR=settings.scale_red, scaleG=settings.scale_green,
+                 scaleB=settings.scale_blue, matrix=matrix, curves=curves,
+                 limiter=PowerLimiter(settings.channel_watts,
+                                      settings.power_budget),
+                 i2c=fakei2c)
+    led.set(is_on=True, brightness=args.brightness)
+    wheel = colorwheel.getcolorwheelfromname(args.effect, color,
+                                             settings.blend_mode).cursor()
+    start = perf_counter()
+    colors = rendercolors(wheel, args.transition, fps, count)
+    pwm = renderpwm(led, colors)
+    rendered = perf_counter() - start
+
+    if outputFormat == 'csv':
+        if args.output is None:
+            writecsv(sys.stdout, fps, colors, pwm, args.brightness)
+        else:
+            with open(args.output, 'w') as outfile:
+                writecsv(outfile, fps, colors, pwm, args.brightness)
+    else:
+        with open(args.output, 'wb') as outfile:
+            if outputFormat == 'binary':
+                writebinary(outfile, fps, pwm)
+            else:
+                writepng(outfile, colors, args.brightness, args.height,
+                         args.width)
+    print("Rendered %d frames of '%s' in %.3f s%s." % (
+              count, args.effect, rendered,
+              "" if numpy is not None else " without numpy"),
+          file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,725 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Renders the color wheel of the current state to the RGB LED.
+#
+# The Renderer runs the frame loop in the calling thread, the RenderProcess
+# (renderprocess.py) runs one in a process of its own.
+#
+# With Pipeline_Depth set the Renderer computes the pwm values of the next
+# frames ahead of time and a writer thread puts each on the I2C bus at its
+# frame time, so the effect math no longer delays the write.
+#
+# Frame writes are timed on the first frame and after every reload, the
+# frame rate is lowered from LED_Update_Rate when the frames would take more
+# than Max_Frame_Load of the time.
+#
+# With a DMX input (dmx.py), the stream topic (colorstream.py) or an audio
+# input (audio.py) the Renderer waits for packets between frames and writes
+# each one the moment it arrives, audio once a frame. While live color comes
+# in it replaces the effect, or with DMX_Merge = htp the brighter of the two
+# is shown for each channel.
+#
+# With Record_File set every frame written is added to a frame file
+# (framerec.py) that framereplay.py plays back.
+#
+import logging
+import queue
+import threading
+from collections import namedtuple
+from time import monotonic, sleep
+
+import colorwheel
+from calibration import loadcalibration
+from color import Color
+from groupsync import wallclock
+from powerlimit import PowerLimiter
+from rgbled import RgbLed
+
+# logger for this module
+logger = logging.getLogger(__name__)
+
+# lateness histogram bins of 0.1 ms up to 100 ms
+BINWIDTH = 0.0001
+BINS = 1000
+# frame writes timed to find the frame rate the bus keeps up with
+MEASUREFRAMES = 16
+# the I2C bus on the Raspberry Pi header
+DEFAULTBUS = 1
+# settings that open the DMX input again when they change
+DMXFIELDS = ('dmx_protocol', 'dmx_bind', 'dmx_universe', 'dmx_address',
+             'dmx_channels', 'dmx_timeout')
+# settings that open the audio input again when they change
+AUDIOFIELDS = ('audio_input', 'audio_path', 'audio_rate', 'audio_channels',
+               'audio_window')
+# names of the DMX protocols
+PROTOCOLNAMES = {'e131': 'E1.31', 'artnet': 'Art-Net'}
+
+"""Summary of the frame lateness."""
+Jitter = namedtuple('Jitter', ['frames', 'late', 'mean', 'p99', 'max'])
+
+def readcalibration(settings):
+    """
+    Read the calibration file named in the settings.
+
+    :param settings: The Settings naming the calibration file.
+
+    :return: Returns the (matrix, curves) tuple, (None, None) when there is
+             no calibration file or it is not valid.
+    """
+    if settings.calibration_file == '':
+        return None, None
+    try:
+        return loadcalibration(settings.calibration_file)
+    except (OSError, ValueError) as e:
+        print("RGB Floodlight: Failed to load calibration file '%s': %s"
+              % (settings.calibration_file, e))
+        return None, None
+
+def openrecorder(settings):
+    """
+    Open the frame file named in the settings.
+
+    :param settings: The Settings naming the frame file.
+
+    :return: Returns the FrameRecorder, None when frames are not recorded
+             or the file can't be opened.
+    """
+    if settings.record_file == '':
+        return None
+    from framerec import FrameRecorder
+    try:
+        return FrameRecorder(settings.record_file)
+    except OSError as e:
+        print("RGB Floodlight: Failed to open record file '%s': %s"
+              % (settings.record_file, e))
+        return None
+
+def i2cbus(settings):
+    """
+    Get the I2C bus of the LED controller from the settings.
+
+    :param settings: The Settings with the I2C bus.
+
+    :return: Returns the (i2c module, bus number) tuple for RgbLed.
+    """
+    if settings.i2c_bus == 'fake':
+        import fakei2c
+        return fakei2c, None
+    if settings.i2c_bus == 'auto':
+        return None, None
+    return None, int(settings.i2c_bus)
+
+def rescaleepoch(epoch, transition, newTransition, now):
+    """
+    Move the epoch of the effect phase so the phase stays where it is when
+    the transition changes.
+
+    :param epoch: Wall clock time the phase was 0.
+    :param transition: The transition the epoch is for in seconds.
+    :param newTransition: The new transition in seconds.
+    :param now: The wall clock time.
+
+    :return: Returns the epoch for the new transition.
+    """
+    if transition <= 0:
+        return now
+    fraction = ((now - epoch) / transition) % 1.0
+    return now - fraction * newTransition
+
+def i2cclock(settings):
+    """
+    Get the clock of the I2C bus of the LED controller.
+
+    :param settings: The Settings with the I2C bus.
+
+    :return: Returns the bus clock in Hz, None when it is not known.
+    """
+    if settings.i2c_bus == 'fake':
+        import fakei2c
+        return fakei2c.busspeed() or None
+    bus = DEFAULTBUS if settings.i2c_bus == 'auto' else int(settings.i2c_bus)
+    # set with dtparam=i2c_arm_baudrate on the Raspberry Pi
+    try:
+        with open('/sys/class/i2c-adapter/i2c-%d/of_node/clock-frequency'
+                  % bus, 'rb') as infile:
+            data = infile.read(4)
+    except OSError:
+        return None
+    if len(data) != 4:
+        return None
+    return int.from_bytes(data, 'big')
+
+"""How far frames were behind their scheduled time."""
+class FrameStats:
+    def __init__(self):
+        """Initialize with no frames."""
+        self.reset()
+
+    def reset(self):
+        """Forget all frames."""
+        self.frames = 0
+        self.late = 0
+        self.total = 0.0
+        self.max = 0.0
+        # the last bin counts everything over the range
+        self.histogram = [0] * (BINS + 1)
+
+    def add(self, lateness, period):
+        """
+        Add a frame.
+
+        :param lateness: Seconds the frame was behind its scheduled time.
+        :param period: Seconds between frames, a frame more than half a
+                       period behind counts as late.
+        """
+        self.frames += 1
+        self.total += lateness
+        if lateness > self.max:
+            self.max = lateness
+        if lateness > period / 2:
+            self.late += 1
+        self.histogram[min(max(int(lateness / BINWIDTH), 0), BINS)] += 1
+
+    @property
+    def mean(self):
+        """
+        The mean property.
+
+        :return: The mean lateness of the frames in seconds.
+        """
+        if self.frames == 0:
+            return 0.0
+        return self.total / self.frames
+
+    def percentile(self, percent):
+        """
+        Get a percentile of the lateness from the histogram.
+
+        :param percent: The percentile 0 - 100.
+
+        :return: Returns the upper edge of the histogram bin the percentile
+                 is in, in seconds.
+        """
+        if self.frames == 0:
+            return 0.0
+        target = self.frames * percent / 100
+        count = 0
+        for i, binCount in enumerate(self.histogram):
+            count += binCount
+            if count >= target:
+                return min((i + 1) * BINWIDTH, self.max)
+        return self.max
+
+    def summary(self):
+        """
+        Get a summary of the lateness.
+
+        :return: Returns the Jitter.
+        """
+        return Jitter(self.frames, self.late, self.mean,
+                      self.percentile(99), self.max)
+
+"""Frame loop that renders the color wheel to the RGB LED."""
+class Renderer:
+    def __init__(self, settings, stream=None):
+        """
+        Initialize the LED controller from the settings.
+
+        :param settings: The Settings with the LED controller values.
+        :param stream: StreamInput of the stream topic, None for none.
+        """
+        self._settings = settings
+        self._limiter = PowerLimiter(settings.channel_watts,
+                                     settings.power_budget)
+        matrix, curves = readcalibration(settings)
+        i2c, busnum = i2cbus(settings)
+        self._recorder = openrecorder(settings)
+        self._led = RgbLed(freq=settings.pwm_frequency,
+                           address=settings.pwm_address,
+                           gamma=settings.gamma, scaleR=settings.scale_red,
+                           scaleG=settings.scale_green,
+                           scaleB=settings.scale_blue,
+                           matrix=matrix, curves=curves,
+                           limiter=self._limiter, i2c=i2c, busnum=busnum,
+                           recorder=self._recorder)
+        self._state = None
+        self._wheel = None
+        self._angle = 0.0
+        self._epoch = 0.0
+        self._rate = settings.led_update_rate
+        self._delay = 1 / self._rate
+        self._measure = True
+        self._start = monotonic()
+        self._next = self._start
+        self.stats = FrameStats()
+        # the writer thread and the frame loop both use the I2C bus, frames
+        # computed before the last state or settings change are stale
+        self._bus = threading.Lock()
+        self._generation = 0
+        self._frames = None
+        self._writer = None
+        # live color inputs, the one last shown and the time from their
+        # packets to the pwm values
+        self._dmx = None
+        self._audio = None
+        self._stream = stream
+        self._inputs = []
+        self._live = None
+        self._liveactive = False
+        self._livestats = {}
+        self._openlive(None, settings)
+
+    def _openlive(self, old, settings):
+        """
+        Open the live color inputs of the settings.
+
+        :param old: The previous Settings, None for none.
+        :param settings: The Settings with the inputs.
+        """
+        if old is None or ([getattr(old, field) for field in DMXFIELDS]
+                           != [getattr(settings, field)
+                               for field in DMXFIELDS]):
+            if self._dmx is not None:
+                self._dmx.close()
+                self._dmx = None
+            if settings.dmx_protocol != 'none':
+                name = PROTOCOLNAMES[settings.dmx_protocol]
+                from dmx import DmxReceiver
+                try:
+                    self._dmx = DmxReceiver(settings.dmx_protocol,
+                                            settings.dmx_universe,
+                                            settings.dmx_address,
+                                            settings.dmx_channels,
+                                            settings.dmx_timeout,
+                                            settings.dmx_bind)
+                    print("RGB Floodlight: Listening for %s universe %d, DMX "
+                          "address %d." % (name, settings.dmx_universe,
+                                           settings.dmx_address))
+                except OSError as e:
+                    print("RGB Floodlight: Failed to open the %s input: %s"
+                          % (name, e))
+        if old is None or ([getattr(old, field) for field in AUDIOFIELDS]
+                           != [getattr(settings, field)
+                               for field in AUDIOFIELDS]):
+            if self._audio is not None:
+                self._audio.close()
+                self._audio = None
+            if settings.audio_input != 'none':
+                try:
+                    # numpy is only needed with audio
+                    from audio import AudioInput
+                    self._audio = AudioInput(settings.audio_input,
+                                             settings.audio_path,
+                                             settings.audio_rate,
+                                             settings.audio_channels,
+                                             settings.audio_window)
+                    print("RGB Floodlight: Listening for audio on the %s "
+                          "'%s'." % (settings.audio_input,
+                                     settings.audio_path))
+                except ImportError as e:
+                    print("RGB Floodlight: The audio input needs numpy: %s"
+                          % e)
+                except OSError as e:
+                    print("RGB Floodlight: Failed to open the audio input: "
+                          "%s" % e)
+        inputs = []
+        if self._dmx is not None:
+            inputs.append(self._dmx)
+        if self._audio is not None:
+            self._audio.attack = settings.audio_attack
+            self._audio.decay = settings.audio_decay
+            self._audio.timeout = settings.audio_timeout
+            self._audio.framerate = self._rate
+            inputs.append(self._audio)
+        if self._stream is not None and settings.stream_enabled:
+            self._stream.fixture = settings.stream_fixture
+            self._stream.timeout = settings.stream_timeout
+            inputs.append(self._stream)
+        self._inputs = inputs
+        self._livestats = {live: self._livestats.get(live, FrameStats())
+                           for live in inputs}
+        if self._live not in inputs:
+            self._live = None
+            self._liveactive = False
+        if inputs:
+            # packets are written between frames, not from the writer thread
+            self._stopwriter()
+
+    def _livereport(self):
+        """Print the live packets and their latency since the last report."""
+        for live in self._inputs:
+            stats = self._livestats[live]
+            if live.packets == 0:
+                continue
+            print("RGB Floodlight: %s to PWM latency mean %.2f ms, p99 %.2f "
+                  "ms, max %.2f ms, %d packets, %d out of order, %d ignored."
+                  % (live.name, stats.mean * 1000,
+                     stats.percentile(99) * 1000, stats.max * 1000,
+                     live.packets, live.outoforder, live.ignored))
+            stats.reset()
+            live.packets = live.outoforder = live.ignored = 0
+
+    def _showlive(self):
+        """
+        Write the live color, with DMX_Merge = htp the brighter of it and
+        the effect for each channel.
+        """
+        color = self._live.color
+        if self._settings.dmx_merge == 'htp':
+            effect = self._colorat(monotonic())
+            if self._state['state']:
+                scale = self._state['brightness'] / 255
+            else:
+                scale = 0.0
+            color = Color(max(effect.r * scale, color.r),
+                          max(effect.g * scale, color.g),
+                          max(effect.b * scale, color.b))
+        with self._bus:
+            self._led.setpwm(self._led.pwmvalues(color, direct=True))
+
+    def _liveframe(self, delay):
+        """
+        Write live packets as they arrive until the frame time, then render
+        the frame.
+
+        :param delay: Seconds between frames.
+        """
+        import select
+        inputs = self._inputs
+        now = monotonic()
+        due = now + delay - ((now - self._start) % delay)
+        while True:
+            readable, _w, _x = select.select(inputs, [], [],
+                                             max(due - now, 0.0))
+            for live in readable:
+                if live.receive():
+                    self._live = live
+                    self._showlive()
+                    self._livestats[live].add(monotonic() - live.received,
+                                              delay)
+            now = monotonic()
+            if not readable or now >= due:
+                break
+        self.stats.add(max(now - due, 0.0), delay)
+        active = [live for live in inputs if live.expire(now)]
+        if bool(active) != self._liveactive:
+            self._liveactive = bool(active)
+            if active:
+                print("RGB Floodlight: Live color from %s."
+                      % ", ".join(name for live in active
+                                  for name in live.sources))
+            else:
+                print("RGB Floodlight: Live color stopped, back to the "
+                      "effect.")
+                self._livereport()
+                with self._bus:
+                    self._led.set(is_on=self._state['state'],
+                                  brightness=self._state['brightness'],
+                                  color=self._colorat(due))
+                return
+        if active:
+            if self._live not in active:
+                # the input shown stopped, go on with the other one
+                self._live = active[0]
+            if self._settings.dmx_merge == 'htp':
+                self._showlive()
+            return
+        color = self._colorat(due)
+        with self._bus:
+            self._led.color = color
+
+    def _startwriter(self, depth):
+        """
+        Start the writer thread.
+
+        It is started from the frame loop so it gets the real-time
+        scheduling and CPU of the frame loop.
+
+        :param depth: Number of frames computed ahead.
+        """
+        self._frames = queue.Queue(depth)
+        self._writer = threading.Thread(target=self._writeframes,
+                                        args=(self._frames,),
+                                        name="FrameWriter", daemon=True)
+        self._writer.start()
+
+    def _stopwriter(self):
+        """Stop the writer thread, the frames waiting are dropped."""
+        if self._writer is not None:
+            self._generation += 1
+            self._frames.put(None)
+            self._writer.join()
+            self._frames = None
+            self._writer = None
+
+    def _writeframes(self, frames):
+        """
+        Writer thread, puts each frame on the bus at its frame time.
+
+        :param frames: Queue of (frame time, generation, pwm values) tuples,
+                       None ends the thread.
+        """
+        while True:
+            item = frames.get()
+            if item is None:
+                break
+            due, generation, pwmValues = item
+            if generation != self._generation:
+                continue
+            wait = due - monotonic()
+            if wait > 0:
+                sleep(wait)
+            with self._bus:
+                # the state may have changed while waiting
+                if generation == self._generation:
+                    self.stats.add(max(monotonic() - due, 0.0), self._delay)
+                    self._led.setpwm(pwmValues)
+
+    def _caprate(self):
+        """
+        Time frame writes and lower the frame rate when LED_Update_Rate
+        frames would take more than Max_Frame_Load of the time.
+        """
+        self._measure = False
+        settings = self._settings
+        color = self._wheel.getrgb(self._angle)
+        times = []
+        with self._bus:
+            # the current frame again so nothing changes on the LED
+            for _i in range(MEASUREFRAMES):
+                start = monotonic()
+                self._led.setpwm(self._led.pwmvalues(color))
+                times.append(monotonic() - start)
+        frameTime = sorted(times)[MEASUREFRAMES // 2]
+        rate = settings.led_update_rate
+        if settings.max_frame_load > 0 and frameTime > 0:
+            rate = min(rate, max(int(settings.max_frame_load / frameTime), 1))
+        clock = i2cclock(settings)
+        if clock is None:
+            bus = ""
+        else:
+            bus = " on the %d kHz I2C bus" % (clock // 1000)
+        if rate < settings.led_update_rate:
+            print("RGB Floodlight: Frame rate capped to %d fps, a frame takes "
+                  "%.2f ms%s." % (rate, frameTime * 1000, bus))
+            if clock is not None and clock < 400000:
+                print("RGB Floodlight: A faster I2C bus allows higher frame "
+                      "rates, see 'I2C Bus Speed' in README.md.")
+        else:
+            print("RGB Floodlight: Frame rate %d fps, a frame takes %.2f ms%s."
+                  % (rate, frameTime * 1000, bus))
+        if rate != self._rate:
+            self._rate = rate
+            self._delay = 1 / rate
+        if self._audio is not None:
+            # the audio is analyzed once a frame
+            self._audio.framerate = rate
+
+    def configure(self, settings):
+        """
+        Apply changed settings to the LED controller.
+
+        :param settings: The new Settings.
+        """
+        old = self._settings
+        self._settings = settings
+        # the frame rate is found again with the next frame
+        self._measure = True
+        if old.pipeline_depth != settings.pipeline_depth:
+            # the next frame starts it again with the new depth
+            self._stopwriter()
+        self._openlive(old, settings)
+        # the calibration file is read again, it may have been measured again
+        matrix, curves = readcalibration(settings)
+        with self._bus:
+            self._generation += 1
+            if (old.pwm_address != settings.pwm_address
+                    or old.i2c_bus != settings.i2c_bus):
+                # different PCA9685 so start over with a new controller
+                self._led.off()
+                i2c, busnum = i2cbus(settings)
+                self._led = RgbLed(freq=settings.pwm_frequency,
+                                   address=settings.pwm_address,
+                                   limiter=self._limiter, i2c=i2c,
+                                   busnum=busnum, recorder=self._recorder)
+            elif old.pwm_frequency != settings.pwm_frequency:
+                self._led.setfrequency(settings.pwm_frequency)
+            if old.record_file != settings.record_file:
+                if self._recorder is not None:
+                    self._recorder.close()
+                self._recorder = openrecorder(settings)
+                self._led.recorder = self._recorder
+            self._limiter.configure(settings.channel_watts,
+                                    settings.power_budget)
+            self._led.setcorrection(gamma=settings.gamma,
+                                    scaleR=settings.scale_red,
+                                    scaleG=settings.scale_green,
+                                    scaleB=settings.scale_blue,
+                                    matrix=matrix, curves=curves)
+        if self._state is not None and (
+                old.pwm_address != settings.pwm_address
+                or old.i2c_bus != settings.i2c_bus
+                or old.blend_mode != settings.blend_mode):
+            # select the color wheel again and restore the state
+            self.setstate(self._state)
+
+    def setstate(self, state):
+        """
+        Start rendering a new state with its first frame.
+
+        :param state: Dictionary with the state, brightness, color, effect,
+                      transition and the epoch, the wall clock time the
+                      effect phase was 0.
+        """
+        self._state = dict(state)
+        # select the correct color wheel from effect and color, the cached
+        # wheel is shared so the renderer keeps its own cursor on it
+        self._wheel = colorwheel.getcolorwheelfromname(
+            state['effect'], state['color'],
+            self._settings.blend_mode).cursor()
+        # used to align frames to the transition time
+        self._start = monotonic()
+        self._next = self._start + self._delay
+        # the phase goes on from the epoch, frames use the monotonic clock
+        # so clock changes don't make it jump
+        now = wallclock()
+        self._epoch = self._start - (now - state.get('epoch', now))
+        with self._bus:
+            # frames computed for the previous state are dropped
+            self._generation += 1
+            if not self._liveactive:
+                self._led.set(is_on=state['state'],
+                              brightness=state['brightness'],
+                              color=self._colorat(self._start))
+        if self._liveactive:
+            # the live color has the LED, the state shows when it stops
+            self._showlive()
+
+    def _colorat(self, when):
+        """
+        Get the color of the effect at a time.
+
+        :param when: The monotonic time of the frame.
+
+        :return: Returns the color of the frame.
+        """
+        transition = self._state['transition']
+        if transition > 0:
+            self._angle = ((when - self._epoch) / transition) % 1.0 * 360
+        else:
+            self._angle = 0.0
+        return self._wheel.getrgb(self._angle)
+
+    def frame(self):
+        """
+        Render the next frame.
+
+        Without the writer thread this waits for the frame time and writes
+        the frame. Otherwise the frame is computed and queued for the writer
+        thread, this waits while the queue is full. Compiled wheels are only
+        a table lookup away from their colors so they are always rendered
+        when the frame is due, and so are the frames with live color inputs.
+        """
+        if self._measure:
+            self._caprate()
+        delay = self._delay
+        if self._inputs:
+            self._liveframe(delay)
+            return
+        if (self._settings.pipeline_depth > 0
+                and not isinstance(self._wheel, colorwheel.TableWheel)):
+            if self._writer is None:
+                self._startwriter(self._settings.pipeline_depth)
+            now = monotonic()
+            if self._next < now:
+                # fell behind, carry on with the next frame time
+                self._next = now + delay - ((now - self._start) % delay)
+            pwmValues = self._led.pwmvalues(self._colorat(self._next))
+            self._frames.put((self._next, self._generation, pwmValues))
+            self._next += delay
+            return
+        # sleep the correct amount of time to meet the specified period
+        now = monotonic()
+        wait = delay - ((now - self._start) % delay)
+        sleep(wait)
+        self.stats.add(monotonic() - now - wait, delay)
+        color = self._colorat(now + wait)
+        with self._bus:
+            self._led.color = color
+
+    def off(self):
+        """Stop the writer thread and the live inputs and turn the LED off."""
+        self._stopwriter()
+        if self._liveactive:
+            self._livereport()
+        if self._dmx is not None:
+            self._dmx.close()
+            self._dmx = None
+        if self._audio is not None:
+            self._audio.close()
+            self._audio = None
+        self._inputs = []
+        self._live = None
+        self._liveactive = False
+        with self._bus:
+            self._led.off()
+            if self._recorder is not None:
+                self._recorder.close()
+                self._recorder = None
+                self._led.recorder = None
+
+    def jitter(self):
+        """
+        Get the frame lateness since the start.
+
+        :return: Returns the Jitter.
+        """
+        return self.stats.summary()
+
+    @property
+    def rate(self):
+        """
+        The rate property.
+
+        :return: The frame rate in frames per second.
+        """
+        return self._rate
+
+    @property
+    def power(self):
+        """
+        The power property.
+
+        :return: The estimated LED power in watts.
+        """
+        return self._limiter.power
+
+    @property
+    def energy(self):
+        """
+        The energy property.
+
+        :return: The estimated LED energy used since start in watt hours.
+        """
+        return self._limiter.energy
@@ -0,0 +1,322 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Runs the frame loop of a Renderer in its own process, so nothing the main
+# process does (MQTT traffic, JSON parsing, sensor reads) can hold up a
+# frame. The two processes only share lock free SeqBlocks, the state and
+# settings go to the render process and the frame metrics come back.
+#
+# Only imported with Render_Process on, multiprocessing is not needed
+# otherwise.
+#
+import multiprocessing
+import os
+import pickle
+import signal
+import threading
+from time import monotonic, sleep, time
+
+import colorwheel
+import effects
+from color import Color
+from groupsync import wallclock
+from renderer import Jitter, Renderer
+from rtsched import setrealtime
+from sharedstate import SeqBlock
+
+# state block: is on, brightness, color, effect name, transition, epoch
+STATEFORMAT = '?B3d%dsdd' % colorwheel.MAXNAMEBYTES
+# settings block: length of the pickled settings and the pickled settings
+SETTINGSFORMAT = 'I4092s'
+# metrics block: first frame time, frames, late frames, mean, 99th
+# percentile and max lateness, power, energy and frame rate
+METRICSFORMAT = 'dQQdddddI'
+
+def packstate(state):
+    """
+    Pack a state for the state block.
+
+    :param state: Dictionary with the state, brightness, color, effect,
+                  transition and epoch.
+
+    :return: Returns the values for the state block.
+    """
+    color = state['color']
+    return (bool(state['state']), int(state['brightness']),
+            float(color.r), float(color.g), float(color.b),
+            state['effect'].encode('utf-8'), float(state['transition']),
+            float(state.get('epoch', wallclock())))
+
+def unpackstate(values):
+    """
+    Unpack a state from the state block.
+
+    An effect that isn't registered in this process falls back to Single
+    Color instead of stopping the frame loop.
+
+    :param values: The values of the state block.
+
+    :return: Returns the state dictionary.
+    """
+    isOn, brightness, r, g, b, effect, transition, epoch = values
+    effect = effect.rstrip(b'\0').decode('utf-8', errors='ignore')
+    if not colorwheel.iscolorwheel(effect):
+        effect = 'Single Color'
+    return {'state': isOn,
+            'brightness': brightness,
+            'color': Color(r, g, b),
+            'effect': effect,
+            'transition': transition,
+            'epoch': epoch}
+
+def readsettings(block):
+    """
+    Read the settings from the settings block.
+
+    :param block: The settings SeqBlock.
+
+    :return: Returns the (sequence, Settings) tuple or None when the
+             settings were being written every time.
+    """
+    result = block.read()
+    if result is None:
+        return None
+    seq, (length, data) = result
+    return seq, pickle.loads(data[:length])
+
+def writemetrics(block, firstFrame, renderer):
+    """
+    Write the frame metrics to the metrics block.
+
+    :param block: The metrics SeqBlock.
+    :param firstFrame: Time of the first frame.
+    :param renderer: The Renderer.
+    """
+    stats = renderer.stats
+    block.write(firstFrame, stats.frames, stats.late, stats.mean,
+                stats.percentile(99), stats.max, renderer.power,
+                renderer.energy, renderer.rate)
+
+def rendermain(stateBlock, settingsBlock, metricsBlock, stream=None):
+    """
+    Frame loop of the render process.
+
+    :param stateBlock: SeqBlock the state is read from.
+    :param settingsBlock: SeqBlock the settings are read from.
+    :param metricsBlock: SeqBlock the frame metrics are written to.
+    :param stream: StreamInput of the stream topic, None for none.
+    """
+    stopping = []
+    # the main process handles Ctrl-C and reloads, SIGTERM stops rendering
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(1))
+    parent = os.getppid()
+
+    settingsSeq, settings = readsettings(settingsBlock)
+    renderer = Renderer(settings, stream)
+    stateSeq, values = stateBlock.read()
+    renderer.setstate(unpackstate(values))
+    firstFrame = time()
+    metricsBlock.write(firstFrame, 0, 0, 0.0, 0.0, 0.0, 0.0, 0.0,
+                       renderer.rate)
+    # the effect tables are only needed in this process, they are compiled
+    # in the background from here on
+    threading.Thread(target=effects.compileeffects, name="EffectCompile",
+                     daemon=True).start()
+    print("RGB Floodlight: Frame loop running in the render process with "
+          "%s." % setrealtime(settings.rt_policy, settings.rt_priority,
+                              settings.rt_cpu, settings.lock_memory))
+    frames = 0
+    try:
+        while len(stopping) == 0:
+            renderer.frame()
+            # only the sequence numbers are checked every frame
+            if settingsBlock.sequence() != settingsSeq:
+                result = readsettings(settingsBlock)
+                if result is not None:
+                    settingsSeq, settings = result
+                    renderer.configure(settings)
+            if stateBlock.sequence() != stateSeq:
+                result = stateBlock.read()
+                if result is not None:
+                    stateSeq, values = result
+                    renderer.setstate(unpackstate(values))
+            frames += 1
+            if frames % renderer.rate == 0:
+                # report back about once a second
+                writemetrics(metricsBlock, firstFrame, renderer)
+                if os.getppid() != parent:
+                    # the main process is gone
+                    break
+    finally:
+        # the frames since the last report are counted too
+        writemetrics(metricsBlock, firstFrame, renderer)
+        renderer.off()
+
+"""Renderer that runs the frame loop in its own process."""
+class RenderProcess:
+    def __init__(self, settings, state, stream=None):
+        """
+        Start the render process and render the first frame.
+
+        The process is forked so it has the same effects registered as the
+        main process. Start it before any other thread is started.
+
+        :param settings: The Settings with the LED controller values.
+        :param state: Dictionary with the state, brightness, color, effect,
+                      transition and epoch.
+        :param stream: StreamInput of the stream topic, None for none. The
+                       main process sends to it and the render process
+                       reads it.
+        """
+        self._settings = settings
+        # the last metrics, kept when the process is stopped
+        self._final = None
+        self._stateBlock = SeqBlock(STATEFORMAT)
+        self._settingsBlock = SeqBlock(SETTINGSFORMAT)
+        self._metricsBlock = SeqBlock(METRICSFORMAT)
+        self._writesettings(settings)
+        self._stateBlock.write(*packstate(state))
+        context = multiprocessing.get_context('fork')
+        self._process = context.Process(
+            target=rendermain, name="Render",
+            args=(self._stateBlock, self._settingsBlock, self._metricsBlock,
+                  stream))
+        self._process.start()
+
+    def _writesettings(self, settings):
+        """
+        Write the settings to the settings block.
+
+        :param settings: The Settings.
+        """
+        data = pickle.dumps(settings)
+        if len(data) > 4092:
+            raise ValueError("settings are too large for the settings block")
+        self._settingsBlock.write(len(data), data)
+
+    def _metrics(self):
+        """
+        Read the latest metrics of the render process.
+
+        :return: Returns the metrics values, all zero before the first frame.
+        """
+        if self._final is not None:
+            return self._final
+        result = self._metricsBlock.read()
+        if result is None:
+            return (0.0, 0, 0, 0.0, 0.0, 0.0, 0.0, 0.0,
+                    self._settings.led_update_rate)
+        return result[1]
+
+    def firstframe(self, timeout=10.0):
+        """
+        Wait for the render process to render the first frame.
+
+        :param timeout: Seconds to wait.
+
+        :return: Returns the time of the first frame, None on a timeout.
+        """
+        deadline = monotonic() + timeout
+        while monotonic() < deadline and self._process.is_alive():
+            firstFrame = self._metrics()[0]
+            if firstFrame > 0:
+                return firstFrame
+            sleep(0.001)
+        return None
+
+    def configure(self, settings):
+        """
+        Apply changed settings in the render process.
+
+        :param settings: The new Settings.
+        """
+        self._settings = settings
+        self._writesettings(settings)
+
+    def setstate(self, state):
+        """
+        Send a new state to the render process.
+
+        :param state: Dictionary with the state, brightness, color, effect,
+                      transition and epoch.
+        """
+        self._stateBlock.write(*packstate(state))
+
+    def frame(self):
+        """Wait one frame period, the render process renders the frames."""
+        sleep(1 / self._settings.led_update_rate)
+
+    def off(self, timeout=5.0):
+        """
+        Stop the render process, it turns the LED off. The metrics it
+        reported last stay available.
+
+        :param timeout: Seconds to wait for the process to stop.
+        """
+        if self._final is not None:
+            return
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join(timeout)
+        self._final = self._metrics()
+        self._stateBlock.close()
+        self._settingsBlock.close()
+        self._metricsBlock.close()
+
+    def jitter(self):
+        """
+        Get the frame lateness since the start, as last reported by the
+        render process.
+
+        :return: Returns the Jitter.
+        """
+        return Jitter(*self._metrics()[1:6])
+
+    @property
+    def power(self):
+        """
+        The power property.
+
+        :return: The estimated LED power in watts.
+        """
+        return self._metrics()[6]
+
+    @property
+    def energy(self):
+        """
+        The energy property.
+
+        :return: The estimated LED energy used since start in watt hours.
+        """
+        return self._metrics()[7]
+
+    @property
+    def rate(self):
+        """
+        The rate property.
+
+        :return: The frame rate of the render process in frames per second.
+        """
+        return self._metrics()[8]
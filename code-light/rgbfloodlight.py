@@ -26,20 +26,30 @@ import logging
 import os
 import sys
 import signal
-import configparser
 import json
+import importlib
 from time import sleep
 from time import time
-from subprocess import PIPE, Popen
-
-from w1thermsensor import W1ThermSensor
-from w1thermsensor import NoSensorFoundError
-import paho.mqtt.client as mqtt
+from time import localtime, strftime
 
+# Only the modules needed to render the first frame are imported here. The
+# MQTT client and sensor modules are imported in the background and the
+# render process, DMX, audio and frame recorder modules only when they are
+# turned on, so they are not on the critical path at boot.
 from timer import InfiniteTimer
-from rgbled import RgbLed
+from mqttmanager import MqttManager
+from publishthrottle import PublishThrottle
+from settings import loadsettings, changedsections
+from renderer import Renderer, rescaleepoch
+from colorstream import StreamInput, readstream
+from groupsync import ClockSync, SYNCTOLERANCE, beaconpayload, readbeacon
+from groupsync import wallclock
+from scheduler import Scheduler, loadschedule
+from commands import CommandError, CommandKeys, checkcommand
+from rtsched import setrealtime
 from color import Color
 import colorwheel
+import effects
 
 logging.basicConfig(level=os.environ.get("LOGLEVEL", "WARNING"))
 
@@ -48,14 +58,52 @@ ENABLE_AVAILABILITY_TOPIC = False   # enable availability topic
 FIRMWARE = "0.2.1"
 CONFFILE = "rgbfloodlight.conf"
 STATEFILE = "rgbfloodlightstate.json"
-LEDUPDATERATE = 30                  # how often LED is updated (times per second)
-SAVEFILEFREQ = 60                   # how long to delay writing to state file
 QOS = 1                             # MQTT Quality of Service
 
 # globals
+Settings = None
+mqtt = None
 Mqttc = None
+MqttConn = None
+StateThrottle = None
+MqttConnected = False
 SaveStateTimer = None
-led = None
+renderer = None
+hatSensor = None
+tempHatMax = None
+tempTimer = None
+frameRate = None
+syncTimer = None
+groupClock = ClockSync()
+Stream = None
+StreamFrame = None
+StreamTime = 0.0
+StreamPublished = 0.0
+Streaming = False
+scheduler = None
+# MQTT commands, beacons and scheduled commands change NextState from their
+# own threads
+StateLock = threading.Lock()
+
+# import the MQTT client module, run in the background after the first frame
+def importMqtt():
+    global mqtt
+    import paho.mqtt.client as mqtt
+
+# get the time this process was started (includes interpreter startup)
+def getProcessStartTime():
+    try:
+        with open('/proc/self/stat', 'r') as f:
+            # start time is field 22 and is in clock ticks since boot
+            startTicks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime', 'r') as f:
+            uptime = float(f.readline().split()[0])
+        return time() - uptime + startTicks / os.sysconf('SC_CLK_TCK')
+    except:
+        # fall back to the time this module started running
+        return ModuleStartTime
+
+ModuleStartTime = time()
 
 # get the Raspberry Pi CPU Serial Number
 def getCpuSerial():
@@ -89,16 +137,21 @@ def getWLANMac():
     return None
   return mac.strip()
 
-# class to handle SIGTERM signal
+# class to handle SIGTERM and SIGHUP signals
 class GracefulKiller:
     kill_now = False
+    reload_now = False
     def __init__(self):
         signal.signal(signal.SIGINT, self.exit_gracefully)
         signal.signal(signal.SIGTERM, self.exit_gracefully)
+        signal.signal(signal.SIGHUP, self.reload_settings)
 
     def exit_gracefully(self,signum, frame):
         self.kill_now = True
 
+    def reload_settings(self, signum, frame):
+        self.reload_now = True
+
 # save state to file
 def saveStateFile():
     global SaveState
@@ -118,18 +171,43 @@ def queueSaveStateFile(state):
     # keep track of state to save to file
     SaveState = state
     # delay executing save to state file function
-    SaveStateTimer = threading.Timer(SAVEFILEFREQ, saveStateFile)
+    SaveStateTimer = threading.Timer(Settings.save_file_delay, saveStateFile)
     SaveStateTimer.start()
 
 # publish Hat temperature
 def publishTemp():
-    Mqttc.publish(ConfigHatTemp['stat_t'],
-                  payload='{:0.1f}'.format(tempHatMax), qos=QOS, retain=True)
+    if tempHatMax is None:
+        # nothing has been measured yet
+        return
+    MqttConn.publish(ConfigHatTemp['stat_t'],
+                     payload='{:0.1f}'.format(tempHatMax), qos=QOS,
+                     retain=True)
+
+# publish the estimated LED power and energy
+def publishPower():
+    MqttConn.publish(ConfigPower['stat_t'],
+                     payload='{:0.1f}'.format(renderer.power), qos=QOS,
+                     retain=True)
+    MqttConn.publish(ConfigEnergy['stat_t'],
+                     payload='{:0.2f}'.format(renderer.energy), qos=QOS,
+                     retain=True)
+
+# publish the frame rate
+def publishFrameRate():
+    global frameRate
+    frameRate = renderer.rate
+    MqttConn.publish(ConfigFrameRate['stat_t'], payload=str(frameRate),
+                     qos=QOS, retain=True)
 
 # publish WiFi RSSI
 def publishRSSI():
+    from subprocess import PIPE, Popen
     # get RSSI from iwconfig
-    process = Popen(['iwconfig', 'wlan0'], stdout=PIPE)
+    try:
+        process = Popen(['iwconfig', 'wlan0'], stdout=PIPE)
+    except OSError:
+        # no wireless tools, so no RSSI to publish
+        return
     output, _error = process.communicate()
     rssi = -1000
     for line in output.decode("utf-8").split("\n"):
@@ -137,7 +215,8 @@ def publishRSSI():
             rssi = int(line.split("Signal level=")[1].split(" ")[0])
     if (rssi > -1000):
         # RSSI was measured
-        Mqttc.publish(ConfigRSSI['stat_t'], str(rssi), qos=QOS, retain=True)
+        MqttConn.publish(ConfigRSSI['stat_t'], str(rssi), qos=QOS,
+                         retain=True)
 
 # Measure the Hat temperature and WiFi RSSI
 def measureSensors():
@@ -149,44 +228,49 @@ def measureSensors():
         tempMeasCount
     except NameError:
         tempMeasCount = 0
-        tempHatMax = 0.0
         tempAlarm = True        # cause immediate alarm publish
 
     # get the HAT temperature
-    tempHat = hatSensor.get_temperature()
-    tempMeasCount += Config.getint('RGB Floodlight', 'Temp_Measurement_Time')
+    if hatSensor is None:
+        tempHat = None
+    else:
+        tempHat = hatSensor.get_temperature()
+    tempMeasCount += Settings.temp_measurement_time
     # keep track of maximum temperature
-    if tempHat > tempHatMax:
+    if tempHat is not None and (tempHatMax is None or tempHat > tempHatMax):
         tempHatMax = tempHat
     # is it time to publish?
-    if tempMeasCount >= Config.getint('RGB Floodlight', 'Temp_Publish_Rate'):
-        # time to publish sensors
-        if MqttConnected:
-            # We are connected to MQTT broker
-            publishTemp()       # publish the temperature
-            publishRSSI()       # publish the RSSI
-            tempHatMax = -55.0  # max temp is low so we will catch next high
-            tempMeasCount = 0   # start next interval
+    if tempMeasCount >= Settings.temp_publish_rate:
+        # time to publish sensors, queued if not connected to MQTT broker
+        publishTemp()       # publish the temperature
+        publishRSSI()       # publish the RSSI
+        publishPower()      # publish the LED power and energy
+        tempHatMax = None   # forget max temp so we will catch next high
+        tempMeasCount = 0   # start next interval
+    # the frame rate changes after a reload
+    if renderer.rate != frameRate:
+        publishFrameRate()
 
     # handle over temp alarms
-    if tempAlarm:
+    if tempHat is None:
+        # no sensor so no alarms
+        pass
+    elif tempAlarm:
         # we currently have an over temp situation (add a bit of hysteresis)
-        if tempHat < (Config.getfloat('RGB Floodlight', 'Temp_Alarm') - 5.0):
-            if MqttConnected:
-                # we are connected so publish over temp alarm is now over
-                Mqttc.publish(ConfigOverTemp['stat_t'],
-                              payload=ConfigOverTemp['pl_off'],
-                              qos=QOS, retain=True)
-                tempAlarm = False
+        if tempHat < (Settings.temp_alarm - 5.0):
+            # publish over temp alarm is now over
+            MqttConn.publish(ConfigOverTemp['stat_t'],
+                             payload=ConfigOverTemp['pl_off'],
+                             qos=QOS, retain=True)
+            tempAlarm = False
     else:
         # we currently are in a normal temperature range
-        if tempHat >= Config.getfloat('RGB Floodlight', 'Temp_Alarm'):
-            if MqttConnected:
-                # we are connected so publish over temp alarm
-                Mqttc.publish(ConfigOverTemp['stat_t'],
-                              payload=ConfigOverTemp['pl_on'],
-                              qos=QOS, retain=True)
-                tempAlarm = True
+        if tempHat >= Settings.temp_alarm:
+            # publish over temp alarm
+            MqttConn.publish(ConfigOverTemp['stat_t'],
+                             payload=ConfigOverTemp['pl_on'],
+                             qos=QOS, retain=True)
+            tempAlarm = True
 
 # publish the given state
 def publishState(state, group=False):
@@ -206,20 +290,196 @@ def publishState(state, group=False):
                  }
     # convert to JSON
     payload = json.dumps(jsonState)
-    # publish the state
-    Mqttc.publish(ConfigLight['stat_t'], payload=payload, qos=QOS,
-                  retain=True)
-    if (Config.getboolean('Home Assistant', 'Group_Enabled')
-        and Config.getboolean('Home Assistant', 'Group_Master')
+    if group and not Settings.group_master:
+        # every light gets a group command, the master answers for the
+        # group right away and the other lights only now and then
+        interval = Settings.group_state_interval
+    else:
+        interval = 0.0
+    # publish the state unless it is the same as the last one, queued if
+    # not connected to MQTT broker
+    StateThrottle.publish(ConfigLight['stat_t'], payload, qos=QOS,
+                          retain=True, interval=interval)
+    if (Settings.group_enabled
+        and Settings.group_master
         and group):
-        # group is enabled so publish the state there too
-        Mqttc.publish(ConfigGroup['stat_t'], payload=payload, qos=QOS,
-                      retain=True)
+        # group is enabled so publish the state there too, the master's
+        # state stands for the group, the states of the other lights are
+        # not collected
+        StateThrottle.publish(ConfigGroup['stat_t'], payload, qos=QOS,
+                              retain=True)
+
+# publish the color of the stream now and then and the state again when the
+# stream stops, the frames are not saved or echoed one by one
+def publishStreamState():
+    global StreamFrame, StreamPublished, Streaming
+    now = time()
+    if StreamFrame is not None:
+        if now - StreamPublished < Settings.stream_state_interval:
+            return
+        frame = StreamFrame
+        StreamFrame = None
+        StreamPublished = now
+        result = readstream(frame, Settings.stream_fixture)
+        if result is not None:
+            Streaming = True
+            publishState(dict(CurState, state=True, brightness=255,
+                              color=result[1]))
+    elif Streaming and now - StreamTime > Settings.stream_timeout:
+        Streaming = False
+        publishState(CurState)
+
+# publish the clock and effect timing of the group master
+def publishBeacon():
+    if (Settings.group_enabled and Settings.group_master
+        and Settings.group_sync):
+        MqttConn.publish(TopicSync, payload=beaconpayload(CurState), qos=0)
+
+# follow the effect timing of the group master
+def followBeacon(payload):
+    global NextState, Changed
+    try:
+        beacon = readbeacon(payload)
+    except ValueError:
+        print("RGB Floodlight: Invalid group sync beacon '%s'." % payload)
+        return
+    groupClock.add(beacon['time'], wallclock())
+    if (beacon['effect'] != NextState['effect']
+        or beacon['transition'] != NextState['transition']):
+        # the group command has not arrived here yet
+        return
+    epoch = groupClock.tolocal(beacon['epoch'])
+    # the same point of the effect one transition later is as good
+    transition = NextState['transition']
+    move = epoch - NextState['epoch']
+    if transition > 0:
+        move = (move + transition / 2) % transition - transition / 2
+    if abs(move) > SYNCTOLERANCE:
+        print("RGB Floodlight: Group clock offset %+.1f ms, effect moved "
+              "%+.1f ms to follow the group master."
+              % (groupClock.offset * 1000, move * 1000))
+        NextState['epoch'] += move
+        Changed = True
+        queueSaveStateFile(NextState)
+
+# print the frame lateness since the start
+def printJitter():
+    jitter = renderer.jitter()
+    print("RGB Floodlight: Frame jitter mean %.2f ms, p99 %.2f ms, max %.2f "
+          "ms, %d of %d frames late." % (jitter.mean * 1000,
+                                         jitter.p99 * 1000,
+                                         jitter.max * 1000, jitter.late,
+                                         jitter.frames))
+
+# apply a light command, the same from MQTT and the schedule
+def applyCommand(command):
+    global NextState, Changed
+    try:
+        checkcommand(command)
+    except CommandError as e:
+        print("RGB Floodlight: Dropped command %s: %s"
+              % (json.dumps(command), e))
+        return
+    cmdStateChanged = False
+    if 'brightness' in command:
+        newBrightness = command['brightness']
+        if CurState['brightness'] != newBrightness:
+            NextState['brightness'] = newBrightness
+            cmdStateChanged = True
+            #print("RGB Floodlight: Brightness was changed to %d."
+            #      % newBrightness)
+    elif 'color' in command:
+        newColor = Color(command['color']['r'], command['color']['g'],
+                         command['color']['b'])
+        if CurState['color'] != newColor:
+            NextState['color'] = newColor
+            cmdStateChanged = True
+            #print("RGB Floodlight: Color was changed to Color(%s)."
+            #      % str(newColor))
+    elif 'effect' in command:
+        newEffect = command['effect']
+        if not colorwheel.iscolorwheel(newEffect):
+            print("RGB Floodlight: Commanded effect '%s' is not a "
+                  "valid effect." % newEffect)
+        else:
+            if CurState['effect'] != newEffect:
+                NextState['effect'] = newEffect
+                # a new effect starts at its beginning
+                NextState['epoch'] = wallclock()
+                cmdStateChanged = True
+                #print("RGB Floodlight: Effect was changed to '%s'."
+                #      % newEffect)
+    elif 'state' in command:
+        newState = command['state'].lower() == 'on'
+        if CurState['state'] != newState:
+            NextState['state'] = newState
+            cmdStateChanged = True
+            #if newState:
+            #    print("RGB Floodlight: Light was turned ON.")
+            #else:
+            #    print("RGB Floodlight: Light was turned OFF.")
+    elif 'transition' in command:
+        newTransition = command['transition']
+        if CurState['transition'] != newTransition:
+            # the effect goes on from where it is at the new speed
+            NextState['epoch'] = rescaleepoch(NextState['epoch'],
+                                              NextState['transition'],
+                                              newTransition, wallclock())
+            NextState['transition'] = newTransition
+            cmdStateChanged = True
+            #print("RGB Floodlight: Transition was changed to %d."
+            #      % newTransition)
+
+    # indicate when parameters have been changed to rest of program
+    if cmdStateChanged:
+        Changed = True
+        queueSaveStateFile(NextState)
+
+# run a scheduled command like a command from MQTT, with several keys applied
+# one after the other and a single state published
+def runScheduledEvent(entry):
+    print("RGB Floodlight: Running scheduled event '%s' (%s)."
+          % (entry.name, entry.when))
+    with StateLock:
+        for key in CommandKeys:
+            if key in entry.command:
+                applyCommand({key: entry.command[key]})
+        publishState(NextState)
+
+# load the schedule file, it is read again on every reload
+def loadSchedule():
+    entries = []
+    if os.path.isfile(Settings.schedule_file):
+        try:
+            entries = loadschedule(Settings.schedule_file, Settings.latitude,
+                                   Settings.longitude)
+        except (OSError, ValueError) as e:
+            print("RGB Floodlight: Failed to load schedule file '%s': %s"
+                  % (Settings.schedule_file, e))
+    scheduler.setentries(entries)
+    upcoming = scheduler.upcoming()
+    if len(upcoming) > 0:
+        when, entry = upcoming[0]
+        print("RGB Floodlight: Loaded %d scheduled events, the next is '%s' "
+              "at %s." % (len(entries), entry.name,
+                          strftime("%Y-%m-%d %H:%M", localtime(when))))
+
+# handle binary frames of the stream topics, they go to the renderer as they
+# are
+def mqtt_on_stream(mqttc, obj, msg):
+    global StreamFrame, StreamTime
+    Stream.send(msg.payload)
+    StreamFrame = msg.payload
+    StreamTime = time()
 
 # handle MQTT message events
 def mqtt_on_message(mqttc, obj, msg):
-    global NextState, Changed
-    if (Config.getboolean('Home Assistant', 'Group_Enabled') and
+    if (Settings.group_enabled and Settings.group_sync
+        and not Settings.group_master and msg.topic == TopicSync):
+        # clock and effect timing of the group master
+        with StateLock:
+            followBeacon(msg.payload.decode("utf-8"))
+    elif (Settings.group_enabled and
         msg.topic == ConfigGroup['cmd_t'] or
         msg.topic == ConfigLight['cmd_t']):
         # received a light command
@@ -234,56 +494,10 @@ def mqtt_on_message(mqttc, obj, msg):
             print("RGB Floodlight: JSON failed to decode command '%s'."
                   % payload)
             return
-        cmdStateChanged = False
-        if 'brightness' in command:
-            newBrightness = command['brightness']
-            if CurState['brightness'] != newBrightness:
-                NextState['brightness'] = newBrightness
-                cmdStateChanged = True
-                #print("RGB Floodlight: Brightness was changed to %d."
-                #      % newBrightness)
-        elif 'color' in command:
-            newColor = Color(command['color']['r'], command['color']['g'],
-                             command['color']['b'])
-            if CurState['color'] != newColor:
-                NextState['color'] = newColor
-                cmdStateChanged = True
-                #print("RGB Floodlight: Color was changed to Color(%s)."
-                #      % str(newColor))
-        elif 'effect' in command:
-            newEffect = command['effect']
-            if newEffect not in colorwheel.getcolorwheellist():
-                print("RGB Floodlight: Commanded effect '%s' is not a "
-                      "valid effect." % newEffect)
-            else:
-                if CurState['effect'] != newEffect:
-                    NextState['effect'] = newEffect
-                    cmdStateChanged = True
-                    #print("RGB Floodlight: Effect was changed to '%s'."
-                    #      % newEffect)
-        elif 'state' in command:
-            newState = command['state'].lower() == 'on'
-            if CurState['state'] != newState:
-                NextState['state'] = newState
-                cmdStateChanged = True
-                #if newState:
-                #    print("RGB Floodlight: Light was turned ON.")
-                #else:
-                #    print("RGB Floodlight: Light was turned OFF.")
-        elif 'transition' in command:
-            newTransition = command['transition']
-            if CurState['transition'] != newTransition:
-                NextState['transition'] = newTransition
-                cmdStateChanged = True
-                #print("RGB Floodlight: Transition was changed to %d."
-                #      % newTransition)
-
-        # publish the current state new or not
-        publishState(NextState, msg.topic == ConfigGroup['cmd_t'])
-        # indicate when parameters have been changed to rest of program
-        if cmdStateChanged:
-            Changed = True
-            queueSaveStateFile(NextState)
+        with StateLock:
+            applyCommand(command)
+            # publish the current state new or not
+            publishState(NextState, msg.topic == ConfigGroup['cmd_t'])
         #print("RGB Floodlight: New state '%s'." % payload)
     else:
         print("RGB Floodlight: Received unknown command topic '%s', with "
@@ -297,8 +511,10 @@ def mqtt_on_connect(mqttc, userdata, flags, rc):
         MqttConnected = True
         print("RGB Floodlight: Connected to MQTT broker: mqtt://%s:%d"
               % (mqttc._host, mqttc._port))
+        # the broker may have lost the retained states
+        StateThrottle.forget()
         # publish node configs is discovery is on
-        if Config.getboolean('Home Assistant', 'Discovery_Enabled'):
+        if Settings.discovery_enabled:
             # discovery is enabled so publish config data
             mqttc.publish(str("/".join([TopicLight, 'config'])),
                           payload=json.dumps(ConfigLight), qos=QOS,
@@ -312,6 +528,15 @@ def mqtt_on_connect(mqttc, userdata, flags, rc):
             mqttc.publish(str("/".join([TopicOverTemp, 'config'])),
                           payload=json.dumps(ConfigOverTemp), qos=QOS,
                           retain=True)
+            mqttc.publish(str("/".join([TopicPower, 'config'])),
+                          payload=json.dumps(ConfigPower), qos=QOS,
+                          retain=True)
+            mqttc.publish(str("/".join([TopicEnergy, 'config'])),
+                          payload=json.dumps(ConfigEnergy), qos=QOS,
+                          retain=True)
+            mqttc.publish(str("/".join([TopicFrameRate, 'config'])),
+                          payload=json.dumps(ConfigFrameRate), qos=QOS,
+                          retain=True)
         else:
             # discovery is disabled so publish blank config
             mqttc.publish(str("/".join([TopicLight, 'config'])),
@@ -322,10 +547,16 @@ def mqtt_on_connect(mqttc, userdata, flags, rc):
                           payload="", qos=QOS, retain=True)
             mqttc.publish(str("/".join([TopicOverTemp, 'config'])),
                           payload="", qos=QOS, retain=True)
+            mqttc.publish(str("/".join([TopicPower, 'config'])),
+                          payload="", qos=QOS, retain=True)
+            mqttc.publish(str("/".join([TopicEnergy, 'config'])),
+                          payload="", qos=QOS, retain=True)
+            mqttc.publish(str("/".join([TopicFrameRate, 'config'])),
+                          payload="", qos=QOS, retain=True)
         # publish group configs
-        if (Config.getboolean('Home Assistant', 'Discovery_Enabled')
-            and Config.getboolean('Home Assistant', 'Group_Enabled')
-            and Config.getboolean('Home Assistant', 'Group_Master')):
+        if (Settings.discovery_enabled
+            and Settings.group_enabled
+            and Settings.group_master):
             # discovery and groups are enabled so publish group config data
             mqttc.publish(str("/".join([TopicGroup, 'config'])),
                           payload=json.dumps(ConfigGroup), qos=QOS,
@@ -341,9 +572,25 @@ def mqtt_on_connect(mqttc, userdata, flags, rc):
         # subscribe to json light command topic
         mqttc.subscribe(ConfigLight['cmd_t'])
         # subscribe to group json light command topic
-        if Config.getboolean('Home Assistant', 'Group_Enabled'):
+        if Settings.group_enabled:
             # group is enabled so listen for commands on group command topic
             mqttc.subscribe(ConfigGroup['cmd_t'])
+            if Settings.group_sync and not Settings.group_master:
+                # follow the effect timing of the group master
+                mqttc.subscribe(TopicSync)
+        if Settings.stream_enabled:
+            # stream frames skip mqtt_on_message and its JSON parsing
+            mqttc.message_callback_add(TopicLightStream, mqtt_on_stream)
+            mqttc.subscribe(TopicLightStream, qos=0)
+            if Settings.group_enabled:
+                mqttc.message_callback_add(TopicGroupStream, mqtt_on_stream)
+                mqttc.subscribe(TopicGroupStream, qos=0)
+        # publish the sensors now, the temperature may not be measured yet
+        publishTemp()
+        publishRSSI()
+        publishPower()
+        publishFrameRate()
+        publishBeacon()
     else:
         # connection failed
         if rc == 5:
@@ -354,6 +601,11 @@ def mqtt_on_connect(mqttc, userdata, flags, rc):
             print("RGB Floodlight: MQTT_ERR={}: Failed to connect to broker: ".format(rc) +
                 "mqtt://{}:{}".format(mqttc._host, mqttc._port))
 
+# handle MQTT connection failures (socket errors and the like)
+def mqtt_on_connect_fail(mqttc, userdata):
+    print("RGB Floodlight: Failed to connect to broker: mqtt://%s:%d"
+          % (mqttc._host, mqttc._port))
+
 # handle MQTT disconnect events
 def mqtt_on_disconnect(client, userdata, rc):
     global MqttConnected
@@ -362,52 +614,44 @@ def mqtt_on_disconnect(client, userdata, rc):
 def mqtt_subscribe():
     pass
 
-try:
-    # load config file
-    if not os.path.isfile(CONFFILE):
-        sys.exit("RGB Floodlight: '%s' config file is missing." % CONFFILE)
-    Config = configparser.ConfigParser(
-        defaults = {
-            'Broker': '127.0.0.1',
-            'Port': '1883',
-            'KeepAlive': '60',
-            'UserName': '',
-            'Password': '',
-            'Discovery_Enabled': 'false',
-            'Discovery_Prefix': 'homeassistant',
-            'Node_ID': 'default_node_id',
-            'Node_Name': 'Default Node Name',
-            'Group_Enabled': 'false',
-            'Group_Master': 'false',
-            'Group_ID': 'default_group_id',
-            'Group_Name': 'Default Group Name',
-            'Temp_Measurement_Time': '10',
-            'Temp_Publish_Rate': '300',
-            'Temp_Alarm': '85.0',
-        })
-    Config.read(CONFFILE)
-
-    # load current state file
+# find the HAT temperature sensor and start measuring it periodically
+def startSensors():
+    global hatSensor, tempTimer
     try:
-        with open(STATEFILE, 'r') as infile:
-            CurState = json.load(infile)
-        CurState['color'] = Color(CurState['color'][0],
-                                  CurState['color'][1],
-                                  CurState['color'][2])
-        print("RGB Floodlight: Loaded state file '%s'." % STATEFILE)
-    except:
-        # load defaults if there is an exception in loading the state file
-        print("RGB Floodlight: Failed to load state file '%s'." % STATEFILE)
-        CurState = {
-            'brightness': 255,
-            'color': Color(255,0,255),
-            'effect': 'Primary Blend',
-            'state': True,
-            'transition': 120,
-        }
-        queueSaveStateFile(CurState)
-    NextState = CurState
-    Changed = True
+        from w1thermsensor import W1ThermSensor
+        from w1thermsensor import NoSensorFoundError
+    except ImportError:
+        W1ThermSensor = None
+        print("RGB Floodlight: w1thermsensor is not installed, HAT "
+              "temperature will not be measured!")
+    if W1ThermSensor is not None:
+        try:
+            for curSensor in W1ThermSensor.get_available_sensors(
+                    [W1ThermSensor.THERM_SENSOR_DS18B20]):
+                hatSensor = curSensor
+        except NoSensorFoundError:
+            hatSensor = None
+            print("RGB Floodlight: HAT 1-Wire temperature sensor not found!")
+
+    # measure and publish temps now, queued if not connected
+    measureSensors()
+    publishTemp()
+
+    # start the background measure temperature timer
+    tempTimer = InfiniteTimer(
+        Settings.temp_measurement_time,
+        measureSensors, name="TempTimer")
+    tempTimer.start()
+
+# create the MQTT topics and Home Assistant discovery configs from settings
+def setupTopics():
+    global TopicAvailability, PayloadAvailable, PayloadNotAvailable
+    global TopicLight, ConfigLight, TopicGroup, ConfigGroup
+    global TopicRSSI, ConfigRSSI, TopicHatTemp, ConfigHatTemp
+    global TopicOverTemp, ConfigOverTemp
+    global TopicPower, ConfigPower, TopicEnergy, ConfigEnergy
+    global TopicFrameRate, ConfigFrameRate, TopicSync
+    global TopicLightStream, TopicGroupStream
 
     # get unique identifiers
     UniqueId = getCpuSerial()
@@ -418,7 +662,7 @@ try:
     HA_device = {
         'identifiers': 'RPi' + UniqueId,
         'connections': [],
-        'name': Config.get('Home Assistant', 'Node_Name'),
+        'name': Settings.node_name,
         'model': 'RGB Roof Light',
         'manufacturer': 'Mike Lawrence',
         'sw_version': FIRMWARE
@@ -429,16 +673,16 @@ try:
         HA_device['connections'].append(['WLAN0_MAC', Wlan0Mac])
 
     # create RGB Floodlight Device Home Assistant Availability Config
-    TopicAvailability = "/".join([Config.get('Home Assistant', 'Discovery_Prefix'),
-        'light', Config.get('Home Assistant', 'Node_ID'), 'rgblight', 'status'])
+    TopicAvailability = "/".join([Settings.discovery_prefix,
+        'light', Settings.node_id, 'rgblight', 'status'])
     PayloadAvailable = 'online'
     PayloadNotAvailable = 'offline'
 
     # create RGB Floodlight Device Home Assistant Discovery Config
-    TopicLight = "/".join([Config.get('Home Assistant', 'Discovery_Prefix'), 
-        'light', Config.get('Home Assistant', 'Node_ID'), 'rgblight'])
+    TopicLight = "/".join([Settings.discovery_prefix, 
+        'light', Settings.node_id, 'rgblight'])
     ConfigLight = {
-        'name': Config.get('Home Assistant', 'Node_Name'),
+        'name': Settings.node_name,
         'schema': 'json',
         'brightness': True,
         'rgb': True,
@@ -452,6 +696,8 @@ try:
         'uniq_id': UniqueId+'00',
         'dev': HA_device,
     }
+    # binary live color frames for this light
+    TopicLightStream = "/".join([TopicLight, 'stream'])
     # add availability topic if configured
     if ENABLE_AVAILABILITY_TOPIC == True:
         ConfigLight['avty_t'] = TopicAvailability
@@ -459,10 +705,10 @@ try:
         # ConfigLight['pl_not_avail'] = PayloadNotAvailable
 
     # create RGB Floodlight Group Device Home Assistant Discovery Config
-    TopicGroup = "/".join([Config.get('Home Assistant', 'Discovery_Prefix'),
-        'light', Config.get('Home Assistant', 'Group_ID'), 'rgblight'])
+    TopicGroup = "/".join([Settings.discovery_prefix,
+        'light', Settings.group_id, 'rgblight'])
     ConfigGroup = {
-        'name': Config.get('Home Assistant', 'Group_Name'),
+        'name': Settings.group_name,
         'schema': 'json',
         'brightness': True,
         'rgb': True,
@@ -476,6 +722,10 @@ try:
         'uniq_id': UniqueId+'01',
         'dev': HA_device,
     }
+    # the group master publishes its clock and effect timing here
+    TopicSync = "/".join([TopicGroup, 'sync'])
+    # binary live color frames for the lights of the group
+    TopicGroupStream = "/".join([TopicGroup, 'stream'])
     # add availability topic if configured
     if ENABLE_AVAILABILITY_TOPIC == True:
         ConfigGroup['avty_t'] = TopicAvailability
@@ -483,10 +733,10 @@ try:
         # ConfigGroup['pl_not_avail'] = PayloadNotAvailable
 
     # create RSSI Device Home Assistant Discovery Config
-    TopicRSSI = "/".join([Config.get('Home Assistant', 'Discovery_Prefix'),
-        'sensor', Config.get('Home Assistant', 'Node_ID'), 'rssi'])
+    TopicRSSI = "/".join([Settings.discovery_prefix,
+        'sensor', Settings.node_id, 'rssi'])
     ConfigRSSI = {
-        'name': Config.get('Home Assistant', 'Node_Name') + " RSSI",
+        'name': Settings.node_name + " RSSI",
         'stat_t': "/".join([TopicRSSI, 'state']),
         'unit_of_meas': 'dBm',
         'uniq_id': UniqueId+'02',
@@ -499,10 +749,10 @@ try:
         # ConfigRSSI['pl_not_avail'] = PayloadNotAvailable
 
     # create HAT Temperature Device Home Assistant Discovery Config
-    TopicHatTemp = "/".join([Config.get('Home Assistant', 'Discovery_Prefix'),
-        'sensor', Config.get('Home Assistant', 'Node_ID'), 'temperature'])
+    TopicHatTemp = "/".join([Settings.discovery_prefix,
+        'sensor', Settings.node_id, 'temperature'])
     ConfigHatTemp = {
-        'name': Config.get('Home Assistant', 'Node_Name') + " Temperature",
+        'name': Settings.node_name + " Temperature",
         'stat_t': "/".join([TopicHatTemp, 'state']),
         'unit_of_meas': '°C',
         'uniq_id': UniqueId+'03',
@@ -515,11 +765,11 @@ try:
         # ConfigHatTemp['pl_not_avail'] = PayloadNotAvailable
 
     # create Over Temp Alarm Device Home Assistant Discovery Config
-    TopicOverTemp = "/".join([Config.get('Home Assistant', 'Discovery_Prefix'),
-        'binary_sensor', Config.get('Home Assistant', 'Node_ID'),
+    TopicOverTemp = "/".join([Settings.discovery_prefix,
+        'binary_sensor', Settings.node_id,
         'over_temperature'])
     ConfigOverTemp = {
-        'name': Config.get('Home Assistant', 'Node_Name')
+        'name': Settings.node_name
                 + " Over Temperature Alarm",
         'stat_t': "/".join([TopicOverTemp, 'state']),
         'dev_cla': 'heat',
@@ -534,69 +784,258 @@ try:
         # ConfigOverTemp['pl_avail'] = PayloadAvailable
         # ConfigOverTemp['pl_not_avail'] = PayloadNotAvailable
 
+    # create LED Power Device Home Assistant Discovery Config
+    TopicPower = "/".join([Settings.discovery_prefix,
+        'sensor', Settings.node_id, 'power'])
+    ConfigPower = {
+        'name': Settings.node_name + " Power",
+        'stat_t': "/".join([TopicPower, 'state']),
+        'unit_of_meas': 'W',
+        'dev_cla': 'power',
+        'uniq_id': UniqueId+'05',
+        'dev': HA_device,
+    }
+    # add availability topic if configured
+    if ENABLE_AVAILABILITY_TOPIC == True:
+        ConfigPower['avty_t'] = TopicAvailability
+
+    # create LED Energy Device Home Assistant Discovery Config
+    TopicEnergy = "/".join([Settings.discovery_prefix,
+        'sensor', Settings.node_id, 'energy'])
+    ConfigEnergy = {
+        'name': Settings.node_name + " Energy",
+        'stat_t': "/".join([TopicEnergy, 'state']),
+        'unit_of_meas': 'Wh',
+        'dev_cla': 'energy',
+        # the energy starts over at zero when the application restarts
+        'stat_cla': 'total_increasing',
+        'uniq_id': UniqueId+'06',
+        'dev': HA_device,
+    }
+    # add availability topic if configured
+    if ENABLE_AVAILABILITY_TOPIC == True:
+        ConfigEnergy['avty_t'] = TopicAvailability
+
+    # create Frame Rate Device Home Assistant Discovery Config
+    TopicFrameRate = "/".join([Settings.discovery_prefix,
+        'sensor', Settings.node_id, 'frame_rate'])
+    ConfigFrameRate = {
+        'name': Settings.node_name + " Frame Rate",
+        'stat_t': "/".join([TopicFrameRate, 'state']),
+        'unit_of_meas': 'fps',
+        'uniq_id': UniqueId+'07',
+        'dev': HA_device,
+    }
+    # add availability topic if configured
+    if ENABLE_AVAILABILITY_TOPIC == True:
+        ConfigFrameRate['avty_t'] = TopicAvailability
+
+# reload the config file and apply the settings that changed
+def reloadSettings():
+    global Settings
+    try:
+        newSettings = loadsettings(CONFFILE)
+    except ValueError as e:
+        print("RGB Floodlight: Config file '%s' error, keeping current "
+              "settings: %s" % (CONFFILE, e))
+        return
+    oldSettings = Settings
+    changed = changedsections(oldSettings, newSettings)
+    if len(changed) == 0:
+        # the calibration file may have been measured again and the schedule
+        # file edited
+        renderer.configure(newSettings)
+        loadSchedule()
+        print("RGB Floodlight: Reloaded config file '%s', nothing changed."
+              % CONFFILE)
+        return
+    # all settings are switched at once with a single assignment
+    Settings = newSettings
+
+    # apply LED controller settings, the color wheel is selected again
+    # for a new blend mode
+    renderer.configure(newSettings)
+    if (oldSettings.render_process != newSettings.render_process
+        or oldSettings.rt_policy != newSettings.rt_policy
+        or oldSettings.rt_priority != newSettings.rt_priority
+        or oldSettings.rt_cpu != newSettings.rt_cpu
+        or oldSettings.lock_memory != newSettings.lock_memory):
+        print("RGB Floodlight: Render_Process and real-time scheduling "
+              "changes take effect after a restart.")
+    # apply sensor settings
+    if tempTimer is not None:
+        tempTimer.t = newSettings.temp_measurement_time
+    if syncTimer is not None:
+        syncTimer.t = newSettings.group_sync_rate
+    loadSchedule()
+
+    # apply MQTT and Home Assistant settings
+    if 'MQTT' in changed or 'Home Assistant' in changed:
+        if 'Home Assistant' in changed and oldSettings.discovery_enabled:
+            # remove discovery configs that might not be valid anymore
+            for topic in [TopicLight, TopicRSSI, TopicHatTemp,
+                          TopicOverTemp, TopicPower, TopicEnergy,
+                          TopicFrameRate, TopicGroup]:
+                MqttConn.publish(str("/".join([topic, 'config'])),
+                                 payload="", qos=QOS, retain=True)
+        setupTopics()
+        if newSettings.username != "":
+            Mqttc.username_pw_set(username=newSettings.username,
+                                  password=newSettings.password)
+        else:
+            Mqttc.username_pw_set(None)
+        if ENABLE_AVAILABILITY_TOPIC == True:
+            Mqttc.will_set(TopicAvailability, payload=PayloadNotAvailable,
+                           retain=False)
+        MqttConn.reconfigure(newSettings.broker, port=newSettings.port,
+                             keepalive=newSettings.keepalive,
+                             min_delay=newSettings.reconnect_min_delay,
+                             max_delay=newSettings.reconnect_max_delay,
+                             queue_size=newSettings.publish_queue_size)
+        # reconnect to subscribe and publish discovery configs again
+        MqttConn.reconnect()
+    print("RGB Floodlight: Reloaded config file '%s', changed %s."
+          % (CONFFILE, ", ".join(sorted(changed))))
+
+try:
+    # load config file, every setting is parsed once here
+    if not os.path.isfile(CONFFILE):
+        sys.exit("RGB Floodlight: '%s' config file is missing." % CONFFILE)
+    try:
+        Settings = loadsettings(CONFFILE)
+    except ValueError as e:
+        sys.exit("RGB Floodlight: Config file '%s' error: %s" % (CONFFILE, e))
+    # loads the MQTT client module once the first frame is out, so its
+    # imports don't delay the light coming on
+    mqttImporter = threading.Thread(target=importMqtt, name="MqttImport",
+                                    daemon=True)
+
+    # load current state file
+    try:
+        with open(STATEFILE, 'r') as infile:
+            CurState = json.load(infile)
+        CurState['color'] = Color(CurState['color'][0],
+                                  CurState['color'][1],
+                                  CurState['color'][2])
+        # older state files have no epoch, the effect starts over
+        CurState.setdefault('epoch', wallclock())
+        print("RGB Floodlight: Loaded state file '%s'." % STATEFILE)
+    except:
+        # load defaults if there is an exception in loading the state file
+        print("RGB Floodlight: Failed to load state file '%s'." % STATEFILE)
+        CurState = {
+            'brightness': 255,
+            'color': Color(255,0,255),
+            'effect': 'Primary Blend',
+            'state': True,
+            'transition': 120,
+            'epoch': wallclock(),
+        }
+        queueSaveStateFile(CurState)
+    # add effects from plugin modules, they register their color wheels
+    # with colorwheel.registercolorwheel() when imported
+    for plugin in Settings.effect_plugins:
+        try:
+            importlib.import_module(plugin)
+        except Exception as e:
+            print("RGB Floodlight: Failed to load effect plugin '%s': %s"
+                  % (plugin, e))
+    # add the user defined effects
+    if os.path.isfile(Settings.effects_file):
+        try:
+            effects.loadeffects(Settings.effects_file)
+        except ValueError as e:
+            print("RGB Floodlight: Failed to load effects file '%s': %s"
+                  % (Settings.effects_file, e))
+    if not colorwheel.iscolorwheel(CurState['effect']):
+        print("RGB Floodlight: Saved effect '%s' does not exist anymore."
+              % CurState['effect'])
+        CurState['effect'] = 'Single Color'
+    NextState = CurState
+    Changed = True
+
+    # stream frames go from the MQTT thread to the renderer through this,
+    # made before the render process is forked so a reload can turn it on
+    Stream = StreamInput()
+
+    # RGB LED controller, initialized before anything else so the light comes
+    # up from the saved state even when the network is not available
+    if Settings.render_process:
+        # frames are rendered in their own process so nothing the MQTT and
+        # sensor threads do can hold them up
+        from renderprocess import RenderProcess
+        renderer = RenderProcess(Settings, CurState, Stream)
+        firstFrame = renderer.firstframe()
+        if firstFrame is None:
+            sys.exit("RGB Floodlight: Render process failed to start.")
+    else:
+        # render the first frame from the saved state
+        renderer = Renderer(Settings, Stream)
+        renderer.setstate(CurState)
+        firstFrame = time()
+        # the effect tables are compiled in the background from here on
+        threading.Thread(target=effects.compileeffects, name="EffectCompile",
+                         daemon=True).start()
+    mqttImporter.start()
+    print("RGB Floodlight: First frame rendered %.0f ms after process start."
+          % ((firstFrame - getProcessStartTime()) * 1000))
+
+    # create MQTT topics and discovery configs
+    setupTopics()
+
     # setup MQTT
+    mqttImporter.join()
     Mqttc = mqtt.Client()
     # add username and password if defined
-    if Config['MQTT']['UserName'] != "":
+    if Settings.username != "":
         print("RGB Floodlight: MQTT authentication will be used")
-        Mqttc.username_pw_set(username=Config['MQTT']['UserName'],
-            password=Config['MQTT']['Password'])
+        Mqttc.username_pw_set(username=Settings.username,
+            password=Settings.password)
     Mqttc.on_message = mqtt_on_message
-    Mqttc.on_connect = mqtt_on_connect
-    Mqttc.on_disconnect = mqtt_on_disconnect
     if ENABLE_AVAILABILITY_TOPIC == True:
         Mqttc.will_set(TopicAvailability, payload=PayloadNotAvailable,
             retain=False)
 
-    # connect to broker
-    status = False
-    while (status == False):
-        try:
-            if (Mqttc.connect(Config.get('MQTT', 'Broker'),
-                    port=Config.getint('MQTT', 'Port'),
-                    keepalive=Config.getint('MQTT', 'KeepAlive')) == 0):
-                status = True       # indicate success
-        except:
-            # connection failed due to a socket error or other bad thing
-            status = False          # indicate failure
-        # wait a bit before retrying
-        if (status == False):
-            print("RGB Floodlight: Failed to connect to broker: mqtt://%s:%d"
-                  % (Config.get('MQTT', 'Broker'),
-                  Config.getint('MQTT', 'Port')))
-            sleep(10)               # sleep for 10 seconds before retrying
-
-    Mqttc.loop_start()
-
-    # RGB LED controller
-    led = RgbLed(freq=200, address=0x40, gamma=1.8,
-                 scaleR=1.0, scaleG=0.75, scaleB=1.0)
-
-    # Setup DS18B20 temperature sensor on PCB
-    try:
-        for curSensor in W1ThermSensor.get_available_sensors(
-                [W1ThermSensor.THERM_SENSOR_DS18B20]):
-            hatSensor = curSensor
-    except NoSensorFoundError:
-        hatSensor = None
-        print("RGB Floodlight: HAT 1-Wire temperature sensor not found!")
-
-    # publish temps now
-    measureSensors()
-    publishTemp()
-    publishRSSI()
+    # connect to broker in the background, reconnects with jittered backoff
+    # and queues publishes while the broker can't be reached
+    MqttConn = MqttManager(Mqttc, Settings.broker,
+                           port=Settings.port,
+                           keepalive=Settings.keepalive,
+                           min_delay=Settings.reconnect_min_delay,
+                           max_delay=Settings.reconnect_max_delay,
+                           queue_size=Settings.publish_queue_size)
+    MqttConn.on_connect = mqtt_on_connect
+    MqttConn.on_disconnect = mqtt_on_disconnect
+    MqttConn.on_connect_fail = mqtt_on_connect_fail
+    StateThrottle = PublishThrottle(MqttConn.publish)
+    MqttConn.start()
 
-    # start the background measure temperature timer
-    tempTimer = InfiniteTimer(
-        Config.getint('RGB Floodlight', 'Temp_Measurement_Time'),
-        measureSensors, name="TempTimer")
-    tempTimer.start()
+    # Setup DS18B20 temperature sensor on PCB in the background
+    sensorThread = threading.Thread(target=startSensors, name="SensorInit",
+                                    daemon=True)
+    sensorThread.start()
+
+    # the group master publishes its clock and effect timing, the timer
+    # always runs so a reload can turn group sync on
+    syncTimer = InfiniteTimer(Settings.group_sync_rate, publishBeacon,
+                              name="SyncTimer")
+    syncTimer.start()
+
+    # scheduled commands run on the light itself, also without the network
+    scheduler = Scheduler(runScheduledEvent)
+    scheduler.start()
+    loadSchedule()
 
     # grab SIGTERM to shutdown gracefully
     killer = GracefulKiller()
 
-    # cycle through rainbow colors
-    led.on()
+    if not Settings.render_process:
+        # after the other threads are started so they don't get real-time
+        # scheduling too
+        print("RGB Floodlight: Frame loop running in the main process with "
+              "%s." % setrealtime(Settings.rt_policy, Settings.rt_priority,
+                                  Settings.rt_cpu, Settings.lock_memory))
+    jitterReportTime = time()
 
     # setup color based on last state
     while True:
@@ -617,6 +1056,10 @@ try:
                 changes.append('Effect="%s"' % NextState['effect'])
             if (CurState['transition'] != NextState['transition']):
                 changes.append("Transition=%d" % NextState['transition'])
+            # the group only needs a beacon when the effect timing changed
+            beacon = (CurState['effect'] != NextState['effect']
+                      or CurState['transition'] != NextState['transition']
+                      or CurState['epoch'] != NextState['epoch'])
             if len(changes) > 0:
                 # something Changed
                 print("RGB Floodlight: State changed to %s."
@@ -625,42 +1068,37 @@ try:
             CurState = dict(NextState)
             # no longer changed
             Changed = False
-            # restart angle
-            angle = 0.0
-            # select the correct color wheel from effect and color
-            wheel = colorwheel.getcolorwheelfromname(CurState['effect'],
-                                                     CurState['color'])
-            # LED update rate in seconds
-            ledDelayTime = 1 / LEDUPDATERATE
-            # used to align transition time
-            startTime = time()
-            # adjust the LED brightness
-            led.brightness = CurState['brightness']
-            # adjust the LED ON state
-            led.set(is_on=CurState['state'])
-        # get next the color
-        led.color = wheel.getrgb(angle)
-        # sleep the correct amount of time to meet the specified period
-        sleep(ledDelayTime - ((time() - startTime) % ledDelayTime))
-        # increment the angle by the step amount
-        angle += 360 / (CurState['transition'] * LEDUPDATERATE)
-        # prevent angle from exceeding 360 (not really necessary)
-        if angle > 360:
-            angle -= 360
-        #print("RGB Floodlight: Angle = %.2f, Color=(%s)." %
-        #    (angle, led.color))
+            # start rendering the new state
+            renderer.setstate(CurState)
+            if beacon:
+                # the group follows the new effect timing right away
+                publishBeacon()
+        # wait for and render the next frame
+        renderer.frame()
+        if Settings.stream_enabled:
+            publishStreamState()
+        # time to report the frame jitter?
+        if (Settings.jitter_report_rate > 0
+            and time() - jitterReportTime >= Settings.jitter_report_rate):
+            printJitter()
+            jitterReportTime = time()
+        # did we receive a signal to reload the config file?
+        if killer.reload_now:
+            killer.reload_now = False
+            reloadSettings()
         # did we receive a signal to exit?
         if killer.kill_now:
             break
 finally:
+    if scheduler is not None:
+        scheduler.stop()
     # shutdown MQTT gracefully
-    if Mqttc is not None:
+    if MqttConn is not None:
         # set will for offline status
         if ENABLE_AVAILABILITY_TOPIC == True:
-            Mqttc.publish(TopicAvailability, payload=PayloadNotAvailable,
+            MqttConn.publish(TopicAvailability, payload=PayloadNotAvailable,
                 qos=QOS, retain=True)
-        Mqttc.disconnect()  # disconnect from MQTT broker
-        Mqttc.loop_stop()   # will wait until disconnected
+        MqttConn.stop()     # disconnect from MQTT broker and wait
         print("RGB Floodlight: Disconnecting from broker: mqtt://%s:%d"
               % (Mqttc._host, Mqttc._port))
     # try to cancel existing save state file timer
@@ -669,5 +1107,7 @@ finally:
     except:
         pass
     # We want LED off when this program is not running
-    if led is not None:
-        led.off()           # turn off the Light
+    if renderer is not None:
+        renderer.off()      # turn off the Light
+        # after the render process reported its last frames
+        printJitter()
@@ -20,6 +20,7 @@
 # SOFTWARE.
 from PCA9685 import PCA9685
 from color import Color
+from calibration import Calibration
 import logging
 
 # Common Values
@@ -31,7 +32,8 @@ logger = logging.getLogger(__name__)
 """RGB led controller through PCA9685 PWM IC."""
 class RgbLed:
     def __init__(self, freq=200, address=0x40, gamma=1.0,
-                 scaleR=1.0, scaleG=1.0, scaleB=1.0):
+                 scaleR=1.0, scaleG=1.0, scaleB=1.0, matrix=None, curves=None,
+                 limiter=None, i2c=None, busnum=None, recorder=None):
         """
         Initialize the driver.
 
@@ -39,17 +41,51 @@ class RgbLed:
         :param address: The address of the PCA9685.
         :param gamma: Gamma value used for gamma correction.
                       A value of 1 means no correction.
+        :param matrix: 3x3 or 4x4 color correction matrix, see calibration.py.
+        :param curves: Measured response curves, see calibration.py.
+        :param limiter: PowerLimiter that keeps the pwm values within the
+                        power budget, None for no limit.
+        :param i2c: Module with get_i2c_device() for the I2C bus, None for
+                    Adafruit_GPIO.I2C.
+        :param busnum: I2C bus number, None for the default bus.
+        :param recorder: FrameRecorder every write of pwm values is added
+                         to, None to not record them.
         """
-        self._device = PCA9685(address)
+        self._device = PCA9685(address, i2c=i2c, busnum=busnum)
         logger.debug("Setting PCA9685 address to 0x%02x" % (address))
         self._device.set_pwm_freq(freq)
-        self._gamma = gamma
         self._color = Color(0,0,0)
         self._is_on = False
         self._brightness = 1.0
-        self._scaleR = scaleR
-        self._scaleG = scaleG
-        self._scaleB = scaleB
+        self._calibration = Calibration(gamma, (scaleR, scaleG, scaleB),
+                                        matrix, curves)
+        self._limiter = limiter
+        self.recorder = recorder
+
+    def setfrequency(self, freq):
+        """
+        Change the pwm frequency.
+
+        :param freq: The pwm frequency.
+        """
+        self._device.set_pwm_freq(freq)
+
+    def setcorrection(self, gamma=1.0, scaleR=1.0, scaleG=1.0, scaleB=1.0,
+                      matrix=None, curves=None):
+        """
+        Change the color correction and update pwm values.
+
+        :param gamma: Gamma value used for gamma correction.
+                      A value of 1 means no correction.
+        :param scaleR: Scale factor for the red pwm value.
+        :param scaleG: Scale factor for the green pwm value.
+        :param scaleB: Scale factor for the blue pwm value.
+        :param matrix: 3x3 or 4x4 color correction matrix, see calibration.py.
+        :param curves: Measured response curves, see calibration.py.
+        """
+        self._calibration = Calibration(gamma, (scaleR, scaleG, scaleB),
+                                        matrix, curves)
+        self._set_pwm()
 
     def on(self):
         """Turn the led on."""
@@ -113,28 +149,72 @@ class RgbLed:
         # time to update the pwm Values
         self._set_pwm()
 
-    def _set_pwm(self):
+    def pwmvalues(self, color=None, direct=False):
         """
-        Set pwm values for current settings.
+        Compute the pwm values without writing them.
+
+        :param color: Color to compute the values for, None for the color
+                      of the led. The on-off state and brightness of the
+                      led are used.
+        :param direct: True to use the color as it is, without the on-off
+                       state and brightness of the led.
+
+        :return: Returns the list of pwm values.
         """
-        # adjust color brightness
-        color = Color(self._color.r * self._brightness / 255,
-                      self._color.g * self._brightness / 255,
-                      self._color.b * self._brightness / 255)
         # pwm goes to 0% if led is not on
-        if not self._is_on:
-            color = Color(0,0,0)
-        # gamma correction?
-        if self._gamma != 1.0:
-            # gamma correction with output sized for 12-bit pwm
-            pwmValues = color.gamma(gamma=GAMMA, max=4095)
+        if not self._is_on and not direct:
+            pwmValues = [0] * self._calibration.channels
         else:
-            # size output for 12-bit pmw with NO gamma correction
-            pwmValues = [(x * 4096 / 255) for x in color]
-        # scale pwm values based on scale factors
-        pwmValues[0] = round(pwmValues[0] * self._scaleR)
-        pwmValues[1] = round(pwmValues[1] * self._scaleG)
-        pwmValues[2] = round(pwmValues[2] * self._scaleB)
-        # finally set the pwm values
+            if color is None:
+                color = self._color
+            # adjust color brightness, the calibration tables do the rest
+            scale = 1.0 if direct else self._brightness / 255
+            pwmValues = self._calibration.apply(color.r * scale,
+                                                color.g * scale,
+                                                color.b * scale)
+        # stay within the power budget
+        if self._limiter is not None:
+            self._limiter.limit(pwmValues)
+        return pwmValues
+
+    def pwmarray(self, r, g, b):
+        """
+        Compute the pwm values of many colors at once, the same values
+        pwmvalues() computes for each. Needs numpy.
+
+        :param r: numpy array of red values 0 - 255.
+        :param g: numpy array of green values 0 - 255.
+        :param b: numpy array of blue values 0 - 255.
+
+        :return: Returns a numpy array with a row of pwm values for each
+                 color.
+        """
+        import numpy
+        if not self._is_on:
+            return numpy.zeros((len(r), self._calibration.channels),
+                               dtype=numpy.int64)
+        scale = self._brightness / 255
+        pwmValues = self._calibration.applyarray(r * scale, g * scale,
+                                                 b * scale)
+        if self._limiter is not None:
+            self._limiter.limitarray(pwmValues)
+        return pwmValues
+
+    def setpwm(self, pwmValues):
+        """
+        Write pwm values computed by pwmvalues().
+
+        :param pwmValues: The list of pwm values.
+        """
         self._device.set_multiple_pwm(pwmValues)
-        #print("R=%d, G=%d, B=%d"% (pwmValues[0], pwmValues[1], pwmValues[2]))
+        # the power changes when the values reach the LED
+        if self._limiter is not None:
+            self._limiter.account(pwmValues)
+        if self.recorder is not None:
+            self.recorder.add(pwmValues)
+
+    def _set_pwm(self):
+        """
+        Set pwm values for current settings.
+        """
+        self.setpwm(self.pwmvalues())
@@ -0,0 +1,131 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Real-time scheduling for the frame loop.
+#
+# Every option is opt-in and falls back to normal scheduling when the
+# process doesn't have the privileges (root, or CAP_SYS_NICE and
+# CAP_IPC_LOCK) to use it.
+#
+import logging
+import os
+
+# logger for this module
+logger = logging.getLogger(__name__)
+
+# mlockall() flags from <sys/mman.h>
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+# scheduling policies for the RT_Policy setting
+Policies = ['none', 'fifo', 'rr']
+
+def setpolicy(policy, priority):
+    """
+    Set the real-time scheduling policy of the calling thread.
+
+    Threads started by the calling thread afterwards get the same policy,
+    so call it after starting the threads that should not get it.
+
+    :param policy: 'fifo' or 'rr'.
+    :param priority: Real-time priority 1 - 99.
+
+    :return: Returns True when the policy was set.
+    """
+    if policy == 'fifo':
+        osPolicy = os.SCHED_FIFO
+    else:
+        osPolicy = os.SCHED_RR
+    low = os.sched_get_priority_min(osPolicy)
+    high = os.sched_get_priority_max(osPolicy)
+    priority = min(max(priority, low), high)
+    try:
+        os.sched_setscheduler(0, osPolicy, os.sched_param(priority))
+    except OSError as e:
+        print("RGB Floodlight: Can't use %s scheduling (needs root or "
+              "CAP_SYS_NICE), continuing with normal scheduling: %s"
+              % (policy.upper(), e.strerror))
+        return False
+    return True
+
+def setcpu(cpu):
+    """
+    Pin the calling thread to one CPU.
+
+    :param cpu: The CPU number.
+
+    :return: Returns True when the thread was pinned.
+    """
+    try:
+        os.sched_setaffinity(0, {cpu})
+    except OSError as e:
+        print("RGB Floodlight: Can't pin the frame loop to CPU %d, "
+              "continuing on all CPUs: %s" % (cpu, e.strerror))
+        return False
+    return True
+
+def lockmemory():
+    """
+    Lock the memory of the process so it is never paged out.
+
+    Memory allocated later is only locked when there is no limit on locked
+    memory, otherwise an allocation over the limit would fail.
+
+    :return: Returns True when the memory was locked.
+    """
+    import ctypes
+    import ctypes.util
+    import resource
+    flags = MCL_CURRENT
+    soft, _hard = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+    if os.geteuid() == 0 or soft == resource.RLIM_INFINITY:
+        flags |= MCL_FUTURE
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    if libc.mlockall(flags) != 0:
+        print("RGB Floodlight: Can't lock memory (needs root or "
+              "CAP_IPC_LOCK), continuing without: %s"
+              % os.strerror(ctypes.get_errno()))
+        return False
+    return True
+
+def setrealtime(policy='none', priority=50, cpu=-1, memory=False):
+    """
+    Apply the real-time options to the calling thread.
+
+    :param policy: 'none', 'fifo' or 'rr'.
+    :param priority: Real-time priority 1 - 99 for 'fifo' and 'rr'.
+    :param cpu: CPU to pin the thread to, -1 for any CPU.
+    :param memory: Lock the memory of the process.
+
+    :return: Returns a description of the options that were applied.
+    """
+    applied = []
+    if policy != 'none' and setpolicy(policy, priority):
+        applied.append("%s %d" % (policy.upper(), priority))
+    if cpu >= 0 and setcpu(cpu):
+        applied.append("CPU %d" % cpu)
+    if memory and lockmemory():
+        applied.append("memory locked")
+    if len(applied) == 0:
+        return "normal scheduling"
+    return ", ".join(applied)
@@ -0,0 +1,512 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Scheduled commands are read from a JSON file that looks like this...
+#
+# {
+#   "events": [
+#     {"name": "On at dusk", "sun": "sunset", "offset": -15,
+#      "command": {"state": "ON", "effect": "Primary Blend"}},
+#     {"name": "Calm", "cron": "0 22 * * *",
+#      "command": {"effect": "Single Color", "color": {"r": 255, "g": 80,
+#                                                       "b": 0}}},
+#     {"name": "Off", "cron": "0 0 * * *", "command": {"state": "OFF"}}
+#   ]
+# }
+#
+# "cron" is minute, hour, day of month, month and day of week like crontab,
+# each a *, a number, a range like 1-5, a list like 1,15 or a step like */10
+# or 8-18/2. Days of the week are 0 - 7 with 0 and 7 for Sunday, months and
+# days of the week can also be names (jan, mon). As in crontab an event with
+# both a day of month and a day of week runs on either.
+# "sun" is one of SunEvents, computed for the Latitude and Longitude of the
+# config file. Sun events are skipped with an error when they are not set.
+# "offset" moves it by minutes, "days" limits it to days of the
+# week in the cron day of week format.
+# "command" has the same keys and values as the JSON commands of the MQTT
+# command topic and may have several of them.
+#
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+import calendar
+import heapq
+import json
+import logging
+import math
+import threading
+import time
+
+from commands import CommandKeys, checkcommand
+
+# logger for this module
+logger = logging.getLogger(__name__)
+
+# zenith angle of the sun for each event, None is solar noon
+SunEvents = {
+    'dawn': 96.0,
+    'sunrise': 90.833,
+    'noon': None,
+    'sunset': 90.833,
+    'dusk': 96.0,
+}
+
+# longest sleep of the scheduler, it checks for a stepped wall clock then
+CLOCKCHECK = 60.0
+# wall clock change in seconds that counts as a step (NTP sync at boot)
+CLOCKSTEP = 2.0
+# how far ahead in days the next time of an event is searched
+SEARCHDAYS = 5 * 366
+
+MONTHNAMES = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep',
+              'oct', 'nov', 'dec']
+DAYNAMES = ['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat']
+
+"""A scheduled command, when is a CronTime or SunTime."""
+ScheduleEntry = namedtuple('ScheduleEntry', ['name', 'when', 'command'])
+
+class ScheduleError(ValueError):
+    """Raised when a schedule event is not valid."""
+    pass
+
+def parsefield(text, low, high, names=None):
+    """
+    Convert a cron field to the set of values it matches.
+
+    :param text: The field, like '*', '5', '1-5', '*/10' or '1,15'.
+    :param low: Lowest value of the field.
+    :param high: Highest value of the field.
+    :param names: Optional list of names for the values from low up.
+
+    :return: Returns a frozenset of values. Raises ScheduleError if not
+             valid.
+    """
+    def value(item):
+        item = item.strip().lower()
+        if names is not None and item in names:
+            return names.index(item) + low
+        if not item.isdigit() or not low <= int(item) <= high:
+            raise ScheduleError("'%s' is not %d - %d" % (item, low, high))
+        return int(item)
+
+    values = set()
+    for part in text.split(','):
+        span, _slash, step = part.partition('/')
+        if span == '*':
+            start, end = low, high
+        elif '-' in span:
+            start, end = (value(item) for item in span.split('-', 1))
+        else:
+            start = end = value(span)
+            if step:
+                end = high
+        if step:
+            if not step.isdigit() or int(step) == 0:
+                raise ScheduleError("step '%s' is not a number > 0" % step)
+            step = int(step)
+        else:
+            step = 1
+        if start > end:
+            raise ScheduleError("range '%s' is backwards" % span)
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+def parsedays(text):
+    """
+    Convert a cron day of week field to a set of days, 0 is Sunday.
+
+    :param text: The field, like '1-5' or 'sat,sun'.
+
+    :return: Returns a frozenset of days 0 - 6.
+    """
+    return frozenset(day % 7 for day in parsefield(text, 0, 7, DAYNAMES))
+
+def cronweekday(day):
+    """Day of the week of a date the way cron counts, 0 is Sunday."""
+    return (day.weekday() + 1) % 7
+
+"""Times of a crontab line in local time."""
+class CronTime:
+    def __init__(self, text):
+        """
+        Parse the crontab time fields.
+
+        :param text: Minute, hour, day of month, month and day of week.
+        """
+        fields = text.split()
+        if len(fields) != 5:
+            raise ScheduleError("cron '%s' needs 5 fields" % text)
+        self.text = text
+        self.minutes = sorted(parsefield(fields[0], 0, 59))
+        self.hours = sorted(parsefield(fields[1], 0, 23))
+        self.monthdays = parsefield(fields[2], 1, 31)
+        self.months = parsefield(fields[3], 1, 12, MONTHNAMES)
+        self.weekdays = parsedays(fields[4])
+        # a day matches either field when both are restricted
+        self._either = (not fields[2].startswith('*')
+                        and not fields[4].startswith('*'))
+        self._anyday = fields[2].startswith('*') and fields[4].startswith('*')
+
+    def __str__(self):
+        return "cron %s" % self.text
+
+    def matchday(self, day):
+        """
+        Check the day of month, month and day of week of a date.
+
+        :param day: The date.
+
+        :return: Returns True if the event runs on that date.
+        """
+        if day.month not in self.months:
+            return False
+        if self._anyday:
+            return True
+        monthday = day.day in self.monthdays
+        weekday = cronweekday(day) in self.weekdays
+        if self._either:
+            return monthday or weekday
+        return monthday and weekday
+
+    def next(self, after):
+        """
+        Get the first time of the event after a time.
+
+        :param after: Time in seconds since the epoch.
+
+        :return: Returns the time in seconds since the epoch, None if it
+                 never runs.
+        """
+        start = datetime.fromtimestamp(after).replace(second=0,
+                                                      microsecond=0)
+        start += timedelta(minutes=1)
+        for offset in range(SEARCHDAYS):
+            day = start.date() + timedelta(days=offset)
+            if not self.matchday(day):
+                continue
+            for hour in self.hours:
+                if offset == 0 and hour < start.hour:
+                    continue
+                for minute in self.minutes:
+                    if offset == 0 and hour == start.hour \
+                            and minute < start.minute:
+                        continue
+                    # local time, mktime works out daylight saving time
+                    when = time.mktime((day.year, day.month, day.day, hour,
+                                        minute, 0, 0, 0, -1))
+                    if when > after:
+                        return when
+        return None
+
+def sunevent(day, event, latitude, longitude):
+    """
+    Compute the time of a sun event with the NOAA solar equations.
+
+    The result is within about a minute for latitudes between the polar
+    circles.
+
+    :param day: The date.
+    :param event: One of SunEvents.
+    :param latitude: Latitude in degrees, north is positive.
+    :param longitude: Longitude in degrees, east is positive.
+
+    :return: Returns the time in seconds since the epoch, None if the sun
+             doesn't reach the event that day.
+    """
+    midnight = calendar.timegm(day.timetuple())
+    leap = calendar.isleap(day.year)
+    yearday = day.timetuple().tm_yday
+    zenith = SunEvents[event]
+    latitude = math.radians(latitude)
+    # twice, the second time for the hour of the event
+    minutes = 720.0
+    for _i in range(2):
+        gamma = 2 * math.pi / (366 if leap else 365) * (
+            yearday - 1 + (minutes / 60 - 12) / 24)
+        eqtime = 229.18 * (0.000075 + 0.001868 * math.cos(gamma)
+                           - 0.032077 * math.sin(gamma)
+                           - 0.014615 * math.cos(2 * gamma)
+                           - 0.040849 * math.sin(2 * gamma))
+        decl = (0.006918 - 0.399912 * math.cos(gamma)
+                + 0.070257 * math.sin(gamma)
+                - 0.006758 * math.cos(2 * gamma)
+                + 0.000907 * math.sin(2 * gamma)
+                - 0.002697 * math.cos(3 * gamma)
+                + 0.00148 * math.sin(3 * gamma))
+        if zenith is None:
+            angle = 0.0
+        else:
+            cosangle = (math.cos(math.radians(zenith))
+                        / (math.cos(latitude) * math.cos(decl))
+                        - math.tan(latitude) * math.tan(decl))
+            if not -1.0 <= cosangle <= 1.0:
+                # midnight sun or polar night
+                return None
+            angle = math.degrees(math.acos(cosangle))
+            if event in ('sunset', 'dusk'):
+                angle = -angle
+        minutes = 720 - 4 * (longitude + angle) - eqtime
+    return midnight + minutes * 60
+
+"""Times of a sun event at a place."""
+class SunTime:
+    def __init__(self, event, offset=0.0, days='*', latitude=None,
+                 longitude=None):
+        """
+        Initialize the sun event.
+
+        :param event: One of SunEvents.
+        :param offset: Minutes the event is moved by.
+        :param days: Days of the week in the cron format.
+        :param latitude: Latitude in degrees, north is positive.
+        :param longitude: Longitude in degrees, east is positive.
+        """
+        if event not in SunEvents:
+            raise ScheduleError("sun must be one of %s"
+                                % ", ".join(SunEvents))
+        if latitude is None or longitude is None:
+            raise ScheduleError("sun events need Latitude and Longitude in "
+                                "[Schedule]")
+        self.event = event
+        self.offset = offset
+        self.days = days
+        self.weekdays = parsedays(days)
+        self.latitude = latitude
+        self.longitude = longitude
+
+    def __str__(self):
+        text = self.event
+        if self.offset != 0:
+            text += " %+g min" % self.offset
+        if self.days != '*':
+            text += " on %s" % self.days
+        return text
+
+    def next(self, after):
+        """
+        Get the first time of the event after a time.
+
+        :param after: Time in seconds since the epoch.
+
+        :return: Returns the time in seconds since the epoch, None if it
+                 never runs.
+        """
+        # the day before too, the event may be on the next UTC day
+        start = date.fromtimestamp(after) - timedelta(days=1)
+        for offset in range(SEARCHDAYS):
+            when = sunevent(start + timedelta(days=offset), self.event,
+                            self.latitude, self.longitude)
+            if when is None:
+                continue
+            when += self.offset * 60
+            if (when > after and cronweekday(date.fromtimestamp(when))
+                    in self.weekdays):
+                return when
+        return None
+
+def parsecommand(command):
+    """
+    Check a command of the schedule file.
+
+    :param command: Dictionary like a JSON command of the MQTT command topic.
+
+    :return: Returns the command. Raises ScheduleError if not valid.
+    """
+    if not isinstance(command, dict) or len(command) == 0:
+        raise ScheduleError("command must be an object with %s"
+                            % ", ".join(CommandKeys))
+    for key in command:
+        if key not in CommandKeys:
+            raise ScheduleError("command key '%s' is not one of %s"
+                                % (key, ", ".join(CommandKeys)))
+    return checkcommand(command)
+
+def parseentry(index, definition, latitude, longitude):
+    """
+    Convert an event of the schedule file to a ScheduleEntry.
+
+    :param index: Position of the event in the file.
+    :param definition: Dictionary with the event definition.
+    :param latitude: Latitude in degrees for sun events, None when not set.
+    :param longitude: Longitude in degrees for sun events, None when not
+                      set.
+
+    :return: Returns the ScheduleEntry. Raises ScheduleError if not valid.
+    """
+    if not isinstance(definition, dict):
+        raise ScheduleError("event must be an object")
+    if ('cron' in definition) == ('sun' in definition):
+        raise ScheduleError("event needs either cron or sun")
+    if 'cron' in definition:
+        if not isinstance(definition['cron'], str):
+            raise ScheduleError("cron must be a string")
+        when = CronTime(definition['cron'])
+    else:
+        offset = definition.get('offset', 0)
+        if not isinstance(offset, (int, float)):
+            raise ScheduleError("offset must be minutes")
+        days = definition.get('days', '*')
+        if not isinstance(days, str):
+            raise ScheduleError("days must be a string")
+        when = SunTime(definition['sun'], offset, days, latitude, longitude)
+    command = parsecommand(definition.get('command'))
+    name = str(definition.get('name', 'event %d' % (index + 1)))
+    return ScheduleEntry(name, when, command)
+
+def loadschedule(filename, latitude=None, longitude=None):
+    """
+    Load the scheduled commands.
+
+    Events that are not valid are skipped with an error message, so are
+    sun events without a location.
+
+    :param filename: The JSON schedule file.
+    :param latitude: Latitude in degrees for sun events, None when not set.
+    :param longitude: Longitude in degrees for sun events, None when not
+                      set.
+
+    :return: Returns a list of ScheduleEntry in the order of the file.
+    """
+    with open(filename, 'r') as infile:
+        data = json.load(infile)
+    if not isinstance(data, dict) or not isinstance(data.get('events', []),
+                                                    list):
+        raise ScheduleError("'%s' needs a list of events" % filename)
+    entries = []
+    for index, definition in enumerate(data.get('events', [])):
+        try:
+            entries.append(parseentry(index, definition, latitude,
+                                      longitude))
+        except ValueError as e:
+            print("RGB Floodlight: Schedule event %d in '%s' is not valid: %s"
+                  % (index + 1, filename, e))
+    return entries
+
+"""Runs scheduled commands at their time from a thread."""
+class Scheduler:
+    def __init__(self, callback):
+        """
+        Initialize the scheduler.
+
+        The thread sleeps until the next event is due. It wakes up at
+        least every CLOCKCHECK seconds to notice a stepped wall clock, the
+        events are then computed again from the new time and the ones that
+        were skipped over don't run.
+
+        :param callback: Function called with the ScheduleEntry when it is
+                         due, from the scheduler thread.
+        """
+        self._callback = callback
+        self._entries = []
+        self._queue = []
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self._wall = time.time()
+        self._mono = time.monotonic()
+
+    def start(self):
+        """Start the scheduler thread."""
+        self._thread = threading.Thread(target=self._run, name="Scheduler",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """
+        Stop the scheduler thread.
+
+        :param timeout: Seconds to wait for the thread to end.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def setentries(self, entries):
+        """
+        Replace the scheduled commands.
+
+        :param entries: List of ScheduleEntry.
+        """
+        with self._cond:
+            self._entries = list(entries)
+            self._fill(time.time())
+            self._cond.notify()
+
+    def upcoming(self):
+        """
+        Get the next time of each scheduled command.
+
+        :return: Returns a sorted list of (time, ScheduleEntry).
+        """
+        with self._cond:
+            return [(when, entry) for when, _index, entry
+                    in sorted(self._queue)]
+
+    def _fill(self, now):
+        """Queue the next time of every entry after now, with the lock."""
+        self._queue = []
+        for index, entry in enumerate(self._entries):
+            when = entry.when.next(now)
+            if when is not None:
+                self._queue.append((when, index, entry))
+        heapq.heapify(self._queue)
+
+    def _run(self):
+        """Wait for the next event and run it."""
+        while True:
+            due = []
+            with self._cond:
+                if self._stopped:
+                    return
+                now = time.time()
+                mono = time.monotonic()
+                if abs((now - self._wall) - (mono - self._mono)) > CLOCKSTEP:
+                    logger.info("Wall clock stepped %+.1f s, schedule "
+                                "computed again",
+                                (now - self._wall) - (mono - self._mono))
+                    self._fill(now)
+                self._wall = now
+                self._mono = mono
+                while len(self._queue) > 0 and self._queue[0][0] <= now:
+                    _when, index, entry = self._queue[0]
+                    due.append(entry)
+                    when = entry.when.next(now)
+                    if when is None:
+                        heapq.heappop(self._queue)
+                    else:
+                        heapq.heapreplace(self._queue, (when, index, entry))
+                if len(due) == 0:
+                    if len(self._queue) > 0:
+                        timeout = min(self._queue[0][0] - now, CLOCKCHECK)
+                    else:
+                        timeout = CLOCKCHECK
+                    self._cond.wait(timeout)
+                    continue
+            for entry in due:
+                try:
+                    self._callback(entry)
+                except Exception:
+                    # the next events may well work
+                    logger.exception("Scheduled event '%s' failed",
+                                     entry.name)
@@ -0,0 +1,259 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+from collections import namedtuple
+from color import BlendModes
+from rtsched import Policies
+import configparser
+
+# protocols DMX_Protocol can select, none turns the input off
+Protocols = ['none', 'e131', 'artnet']
+
+# the ways audio comes in, audio.py is only imported when it is used since
+# it needs numpy
+AudioInputs = ['none', 'fifo', 'socket']
+
+# (section, option, field name, type, default) for every setting
+Options = [
+    ('MQTT', 'Broker', 'broker', str, '127.0.0.1'),
+    ('MQTT', 'Port', 'port', int, '1883'),
+    ('MQTT', 'KeepAlive', 'keepalive', int, '60'),
+    ('MQTT', 'UserName', 'username', str, ''),
+    ('MQTT', 'Password', 'password', str, ''),
+    ('MQTT', 'Reconnect_Min_Delay', 'reconnect_min_delay', float, '1.0'),
+    ('MQTT', 'Reconnect_Max_Delay', 'reconnect_max_delay', float, '120.0'),
+    ('MQTT', 'Publish_Queue_Size', 'publish_queue_size', int, '100'),
+    ('Home Assistant', 'Discovery_Enabled', 'discovery_enabled', bool,
+     'false'),
+    ('Home Assistant', 'Discovery_Prefix', 'discovery_prefix', str,
+     'homeassistant'),
+    ('Home Assistant', 'Node_ID', 'node_id', str, 'default_node_id'),
+    ('Home Assistant', 'Node_Name', 'node_name', str, 'Default Node Name'),
+    ('Home Assistant', 'Group_Enabled', 'group_enabled', bool, 'false'),
+    ('Home Assistant', 'Group_Master', 'group_master', bool, 'false'),
+    ('Home Assistant', 'Group_ID', 'group_id', str, 'default_group_id'),
+    ('Home Assistant', 'Group_Name', 'group_name', str,
+     'Default Group Name'),
+    ('Home Assistant', 'Group_Sync', 'group_sync', bool, 'false'),
+    ('Home Assistant', 'Group_Sync_Rate', 'group_sync_rate', float, '10.0'),
+    ('Home Assistant', 'Group_State_Interval', 'group_state_interval', float,
+     '1.0'),
+    ('Home Assistant', 'Stream_Enabled', 'stream_enabled', bool, 'false'),
+    ('Home Assistant', 'Stream_Fixture', 'stream_fixture', int, '1'),
+    ('Home Assistant', 'Stream_Timeout', 'stream_timeout', float, '2.5'),
+    ('Home Assistant', 'Stream_State_Interval', 'stream_state_interval',
+     float, '5.0'),
+    ('RGB Floodlight', 'Temp_Measurement_Time', 'temp_measurement_time', int,
+     '10'),
+    ('RGB Floodlight', 'Temp_Publish_Rate', 'temp_publish_rate', int, '300'),
+    ('RGB Floodlight', 'Temp_Alarm', 'temp_alarm', float, '85.0'),
+    ('RGB Floodlight', 'LED_Update_Rate', 'led_update_rate', int, '30'),
+    ('RGB Floodlight', 'Save_File_Delay', 'save_file_delay', float, '60.0'),
+    ('RGB Floodlight', 'Effects_File', 'effects_file', str,
+     'rgbfloodlighteffects.json'),
+    ('RGB Floodlight', 'Effect_Plugins', 'effect_plugins', 'list', ''),
+    ('RGB Floodlight', 'Blend_Mode', 'blend_mode', str, 'srgb'),
+    ('RGB Floodlight', 'PWM_Frequency', 'pwm_frequency', int, '200'),
+    ('RGB Floodlight', 'PWM_Address', 'pwm_address', 'address', '0x40'),
+    ('RGB Floodlight', 'I2C_Bus', 'i2c_bus', str, 'auto'),
+    ('RGB Floodlight', 'Gamma', 'gamma', float, '1.8'),
+    ('RGB Floodlight', 'Scale_Red', 'scale_red', float, '1.0'),
+    ('RGB Floodlight', 'Scale_Green', 'scale_green', float, '0.75'),
+    ('RGB Floodlight', 'Scale_Blue', 'scale_blue', float, '1.0'),
+    ('RGB Floodlight', 'Calibration_File', 'calibration_file', str, ''),
+    ('RGB Floodlight', 'Channel_Watts', 'channel_watts', 'floats',
+     '20.0, 20.0, 20.0'),
+    ('RGB Floodlight', 'Power_Budget', 'power_budget', float, '60.0'),
+    ('RGB Floodlight', 'Render_Process', 'render_process', bool, 'false'),
+    ('RGB Floodlight', 'Pipeline_Depth', 'pipeline_depth', int, '0'),
+    ('RGB Floodlight', 'Max_Frame_Load', 'max_frame_load', float, '0.5'),
+    ('RGB Floodlight', 'RT_Policy', 'rt_policy', str, 'none'),
+    ('RGB Floodlight', 'RT_Priority', 'rt_priority', int, '50'),
+    ('RGB Floodlight', 'RT_CPU', 'rt_cpu', int, '-1'),
+    ('RGB Floodlight', 'Lock_Memory', 'lock_memory', bool, 'false'),
+    ('RGB Floodlight', 'Jitter_Report_Rate', 'jitter_report_rate', int, '0'),
+    ('RGB Floodlight', 'Record_File', 'record_file', str, ''),
+    ('DMX', 'DMX_Protocol', 'dmx_protocol', str, 'none'),
+    ('DMX', 'DMX_Bind', 'dmx_bind', str, ''),
+    ('DMX', 'DMX_Universe', 'dmx_universe', int, '1'),
+    ('DMX', 'DMX_Address', 'dmx_address', int, '1'),
+    ('DMX', 'DMX_Channels', 'dmx_channels', int, '3'),
+    ('DMX', 'DMX_Merge', 'dmx_merge', str, 'override'),
+    ('DMX', 'DMX_Timeout', 'dmx_timeout', float, '2.5'),
+    ('Audio', 'Audio_Input', 'audio_input', str, 'none'),
+    ('Audio', 'Audio_Path', 'audio_path', str, '/tmp/rgbfloodlight-audio'),
+    ('Audio', 'Audio_Rate', 'audio_rate', int, '44100'),
+    ('Audio', 'Audio_Channels', 'audio_channels', int, '1'),
+    ('Audio', 'Audio_Window', 'audio_window', int, '1024'),
+    ('Audio', 'Audio_Attack', 'audio_attack', float, '0.02'),
+    ('Audio', 'Audio_Decay', 'audio_decay', float, '0.3'),
+    ('Audio', 'Audio_Timeout', 'audio_timeout', float, '2.0'),
+    ('Schedule', 'Schedule_File', 'schedule_file', str,
+     'rgbfloodlightschedule.json'),
+    ('Schedule', 'Latitude', 'latitude', 'optfloat', ''),
+    ('Schedule', 'Longitude', 'longitude', 'optfloat', ''),
+]
+
+"""Immutable settings parsed from the config file."""
+Settings = namedtuple('Settings', [option[2] for option in Options])
+
+def loadsettings(filename):
+    """
+    Parse a config file into a Settings object.
+
+    Every value is converted to its type once so nothing has to be parsed
+    again when the settings are used.
+
+    :param filename: The config file to read.
+
+    :return: Returns the Settings. Raises ValueError for a bad value or a
+             malformed file.
+    """
+    config = configparser.ConfigParser()
+    try:
+        if len(config.read(filename)) == 0:
+            raise ValueError("Can't read config file '%s'" % filename)
+    except configparser.Error as e:
+        raise ValueError(str(e))
+    values = {}
+    for section, option, field, kind, default in Options:
+        if config.has_option(section, option):
+            text = config.get(section, option)
+        else:
+            text = default
+        try:
+            if kind is bool:
+                value = config.BOOLEAN_STATES[text.strip().lower()]
+            elif kind == 'address':
+                value = int(text, 0)
+            elif kind == 'list':
+                value = tuple(item.strip() for item in text.split(',')
+                              if item.strip() != '')
+            elif kind == 'optfloat':
+                # empty when not set
+                value = float(text) if text.strip() != '' else None
+            elif kind == 'floats':
+                value = tuple(float(item) for item in text.split(',')
+                              if item.strip() != '')
+            else:
+                value = kind(text)
+        except (KeyError, ValueError):
+            raise ValueError("[%s] %s = '%s' is not a valid value"
+                             % (section, option, text))
+        values[field] = value
+    settings = Settings(**values)
+    if not 0 < settings.led_update_rate <= settings.pwm_frequency:
+        raise ValueError("[RGB Floodlight] LED_Update_Rate must be > 0 and "
+                         "<= PWM_Frequency")
+    if settings.blend_mode not in BlendModes:
+        raise ValueError("[RGB Floodlight] Blend_Mode must be one of %s"
+                         % ", ".join(BlendModes))
+    if settings.group_sync_rate <= 0:
+        raise ValueError("[Home Assistant] Group_Sync_Rate must be > 0")
+    if settings.group_state_interval < 0:
+        raise ValueError("[Home Assistant] Group_State_Interval must be >= 0")
+    if not 1 <= settings.stream_fixture <= 255:
+        raise ValueError("[Home Assistant] Stream_Fixture must be 1 - 255")
+    if settings.stream_timeout <= 0:
+        raise ValueError("[Home Assistant] Stream_Timeout must be > 0")
+    if settings.stream_state_interval <= 0:
+        raise ValueError("[Home Assistant] Stream_State_Interval must be > 0")
+    if settings.temp_measurement_time <= 0:
+        raise ValueError("[RGB Floodlight] Temp_Measurement_Time must be > 0")
+    if (len(settings.channel_watts) not in (3, 4)
+            or min(settings.channel_watts) < 0):
+        raise ValueError("[RGB Floodlight] Channel_Watts needs 3 or 4 "
+                         "values >= 0")
+    if (settings.i2c_bus not in ('auto', 'fake')
+            and not settings.i2c_bus.isdigit()):
+        raise ValueError("[RGB Floodlight] I2C_Bus must be auto, fake or a "
+                         "bus number")
+    if settings.rt_policy not in Policies:
+        raise ValueError("[RGB Floodlight] RT_Policy must be one of %s"
+                         % ", ".join(Policies))
+    if not 1 <= settings.rt_priority <= 99:
+        raise ValueError("[RGB Floodlight] RT_Priority must be 1 - 99")
+    if settings.power_budget <= 0:
+        raise ValueError("[RGB Floodlight] Power_Budget must be > 0")
+    if not 0 <= settings.pipeline_depth <= 10:
+        raise ValueError("[RGB Floodlight] Pipeline_Depth must be 0 - 10")
+    if not 0 <= settings.max_frame_load <= 1:
+        raise ValueError("[RGB Floodlight] Max_Frame_Load must be 0 - 1")
+    if settings.dmx_protocol not in Protocols:
+        raise ValueError("[DMX] DMX_Protocol must be one of %s"
+                         % ", ".join(Protocols))
+    if settings.dmx_protocol == 'e131':
+        if not 1 <= settings.dmx_universe <= 63999:
+            raise ValueError("[DMX] DMX_Universe must be 1 - 63999 for e131")
+    elif not 0 <= settings.dmx_universe <= 32767:
+        raise ValueError("[DMX] DMX_Universe must be 0 - 32767")
+    if settings.dmx_channels not in (3, 4):
+        raise ValueError("[DMX] DMX_Channels must be 3 or 4")
+    if not 1 <= settings.dmx_address <= 513 - settings.dmx_channels:
+        raise ValueError("[DMX] DMX_Address must be 1 - %d"
+                         % (513 - settings.dmx_channels))
+    if settings.dmx_merge not in ('override', 'htp'):
+        raise ValueError("[DMX] DMX_Merge must be override or htp")
+    if settings.dmx_timeout <= 0:
+        raise ValueError("[DMX] DMX_Timeout must be > 0")
+    if settings.audio_input not in AudioInputs:
+        raise ValueError("[Audio] Audio_Input must be one of %s"
+                         % ", ".join(AudioInputs))
+    if settings.audio_input != 'none' and settings.audio_path == '':
+        raise ValueError("[Audio] Audio_Path is needed for %s"
+                         % settings.audio_input)
+    if not 8000 <= settings.audio_rate <= 192000:
+        raise ValueError("[Audio] Audio_Rate must be 8000 - 192000")
+    if not 1 <= settings.audio_channels <= 8:
+        raise ValueError("[Audio] Audio_Channels must be 1 - 8")
+    window = settings.audio_window
+    if not 256 <= window <= 16384 or window & (window - 1) != 0:
+        raise ValueError("[Audio] Audio_Window must be a power of 2 from 256 "
+                         "to 16384")
+    if settings.audio_attack < 0 or settings.audio_decay < 0:
+        raise ValueError("[Audio] Audio_Attack and Audio_Decay must be >= 0")
+    if settings.audio_timeout <= 0:
+        raise ValueError("[Audio] Audio_Timeout must be > 0")
+    if (settings.latitude is None) != (settings.longitude is None):
+        raise ValueError("[Schedule] Latitude and Longitude must be set "
+                         "together")
+    if settings.latitude is not None:
+        if not -90 <= settings.latitude <= 90:
+            raise ValueError("[Schedule] Latitude must be -90 - 90")
+        if not -180 <= settings.longitude <= 180:
+            raise ValueError("[Schedule] Longitude must be -180 - 180")
+    return settings
+
+def changedsections(old, new):
+    """
+    Get the config file sections that have different values.
+
+    :param old: The previous Settings.
+    :param new: The new Settings.
+
+    :return: Returns a set of section names.
+    """
+    sections = set()
+    for section, _option, field, _kind, _default in Options:
+        if getattr(old, field) != getattr(new, field):
+            sections.add(section)
+    return sections
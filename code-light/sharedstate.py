@@ -0,0 +1,117 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Lock free blocks of shared memory between the main and the render process.
+#
+# Each block has a single writer. The writer makes the sequence number odd,
+# writes the values and makes it even again. A reader that sees an odd
+# sequence number, or a different one after reading the values, caught the
+# writer in the middle and reads again. Neither side ever waits on a lock
+# the other side holds, so the render process can't be stalled by the main
+# process and the other way around.
+#
+import logging
+import struct
+from multiprocessing import shared_memory
+
+# logger for this module
+logger = logging.getLogger(__name__)
+
+# sequence number at the start of every block
+SEQUENCE = struct.Struct('<I')
+
+"""Shared memory block with a single writer protected by a sequence lock."""
+class SeqBlock:
+    def __init__(self, fmt, name=None):
+        """
+        Create a new block or attach to an existing one.
+
+        :param fmt: struct format of the values in the block.
+        :param name: Name of the block to attach to, None creates a new one.
+        """
+        self._struct = struct.Struct('<' + fmt)
+        if name is None:
+            self._memory = shared_memory.SharedMemory(
+                create=True, size=SEQUENCE.size + self._struct.size)
+            self._memory.buf[:SEQUENCE.size + self._struct.size] = bytes(
+                SEQUENCE.size + self._struct.size)
+            self._owner = True
+        else:
+            self._memory = shared_memory.SharedMemory(name=name)
+            self._owner = False
+        self._buf = self._memory.buf
+        self._seq = 0
+
+    @property
+    def name(self):
+        """
+        The name property.
+
+        :return: Name used to attach to this block from another process.
+        """
+        return self._memory.name
+
+    def sequence(self):
+        """
+        Get the sequence number, it changes with every write.
+
+        :return: Returns the sequence number.
+        """
+        return SEQUENCE.unpack_from(self._buf, 0)[0]
+
+    def write(self, *values):
+        """
+        Write all values of the block. Only one process may write a block.
+
+        :param values: The values in the order of the struct format.
+        """
+        self._seq += 1
+        SEQUENCE.pack_into(self._buf, 0, self._seq)
+        self._struct.pack_into(self._buf, SEQUENCE.size, *values)
+        self._seq += 1
+        SEQUENCE.pack_into(self._buf, 0, self._seq)
+
+    def read(self, retries=100):
+        """
+        Read all values of the block.
+
+        :param retries: Number of times to try when a write is in progress.
+
+        :return: Returns a (sequence, values) tuple or None when the values
+                 were being written every time.
+        """
+        for _i in range(retries):
+            before = SEQUENCE.unpack_from(self._buf, 0)[0]
+            if before & 1:
+                continue
+            values = self._struct.unpack_from(self._buf, SEQUENCE.size)
+            if SEQUENCE.unpack_from(self._buf, 0)[0] == before:
+                return before, values
+        return None
+
+    def close(self):
+        """Detach from the block, the creator also removes it."""
+        self._buf.release()
+        self._memory.close()
+        if self._owner:
+            self._memory.unlink()
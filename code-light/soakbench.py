@@ -0,0 +1,370 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Frame jitter soak benchmark for the RGB Floodlight application.
+#
+# Runs rgbfloodlight.py on the simulated I2C bus (fakei2c.py) with a local
+# stand-in MQTT broker (minibroker.py) for a long time while other
+# processes load the CPU and churn memory and the light command topic is
+# flooded. Every frame written to the simulated PCA9685 is logged with its
+# timestamp. At the end the frame interval histogram, the missed frame
+# deadlines and the memory use over time are reported and checked against
+# thresholds, the exit status is 1 when a check failed.
+#
+#   ./soakbench.py --duration 3600 --cpu 3 --memory 128 --rate 100
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import statistics
+import sys
+import tempfile
+import threading
+from time import monotonic, sleep
+
+from fakei2c import readframes
+from jitterbench import (floodMessages, prepareWorkdir, startApplication,
+                         startFlood, stopApplication)
+from minibroker import MiniBroker
+# number of memory samples listed in the report
+RSSROWS = 10
+
+def burnCpu(stop):
+    """
+    Keep a CPU busy until stop is set.
+
+    :param stop: multiprocessing.Event that ends the load.
+    """
+    value = 0
+    while not stop.is_set():
+        for i in range(100000):
+            value += i * i
+
+def churnMemory(megabytes, stop):
+    """
+    Allocate, touch and free memory until stop is set.
+
+    :param megabytes: Size of the memory to churn.
+    :param stop: multiprocessing.Event that ends the load.
+    """
+    chunk = 1024 * 1024
+    while not stop.is_set():
+        blocks = []
+        for _i in range(megabytes):
+            block = bytearray(chunk)
+            # touch every page so it is really used
+            for offset in range(0, chunk, 4096):
+                block[offset] = 1
+            blocks.append(block)
+        sleep(0.1)
+        del blocks
+
+def processTree(pid):
+    """
+    Get a process and all of its child processes.
+
+    :param pid: The process id.
+
+    :return: Returns a list of process ids.
+    """
+    children = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % name, 'r') as infile:
+                stat = infile.read()
+        except OSError:
+            continue
+        # the process name is in parenthesis and may have spaces
+        ppid = int(stat.rsplit(')', 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(name))
+    tree = [pid]
+    for parent in tree:
+        tree.extend(children.get(parent, []))
+    return tree
+
+def readRss(pid):
+    """
+    Get the resident memory of a process and its child processes.
+
+    :param pid: The process id.
+
+    :return: Returns the resident memory in kB.
+    """
+    total = 0
+    for member in processTree(pid):
+        try:
+            with open('/proc/%d/status' % member, 'r') as infile:
+                for line in infile:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return total
+
+def histogram(values, width):
+    """
+    Count values in bins.
+
+    :param values: The values.
+    :param width: Width of a bin.
+
+    :return: Returns a sorted list of (bin start, count) tuples.
+    """
+    bins = {}
+    for value in values:
+        start = (value // width) * width
+        bins[start] = bins.get(start, 0) + 1
+    return sorted(bins.items())
+
+def percentile(values, percent):
+    """
+    Get a percentile of values.
+
+    :param values: Sorted list of values.
+    :param percent: The percentile 0 - 100.
+
+    :return: Returns the value at the percentile.
+    """
+    if len(values) == 0:
+        return 0.0
+    index = min(int(len(values) * percent / 100), len(values) - 1)
+    return values[index]
+
+def analyzeFrames(frames, start, period, width):
+    """
+    Analyze the frame intervals.
+
+    :param frames: List of (timestamp, pwm values) tuples.
+    :param start: Frames before this time.monotonic() time are ignored.
+    :param period: Seconds between frames.
+    :param width: Histogram bin width in seconds.
+
+    :return: Returns a dictionary with the results.
+    """
+    times = [stamp for stamp, _values in frames if stamp >= start]
+    intervals = [b - a for a, b in zip(times, times[1:])]
+    deviations = sorted(abs(interval - period) for interval in intervals)
+    # a frame more than half a period late missed its deadline
+    misses = sum(1 for interval in intervals if interval > period * 1.5)
+    return {
+        'frames': len(times),
+        'misses': misses,
+        'miss_percent': 100.0 * misses / max(len(intervals), 1),
+        'p50_ms': percentile(deviations, 50) * 1000,
+        'p99_ms': percentile(deviations, 99) * 1000,
+        'max_ms': (deviations[-1] if deviations else 0.0) * 1000,
+        'histogram': [(start * 1000, count) for start, count
+                      in histogram(deviations, width)],
+    }
+
+def analyzeRss(samples):
+    """
+    Estimate the memory growth from the memory samples.
+
+    The first fifth of the samples is warm up, the growth is the mean of the
+    last fifth minus the mean of the second fifth.
+
+    :param samples: List of (seconds, kB) tuples.
+
+    :return: Returns the growth in MB.
+    """
+    fifth = len(samples) // 5
+    if fifth == 0:
+        return 0.0
+    early = statistics.mean(kb for _t, kb in samples[fifth:2 * fifth])
+    late = statistics.mean(kb for _t, kb in samples[-fifth:])
+    return (late - early) / 1024
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(
+        description="Soak test RGB Floodlight frame jitter and memory use "
+                    "under load.")
+    parser.add_argument('-C', '--cwd', default=here,
+                        help="directory with the config file")
+    parser.add_argument('-d', '--duration', type=float, default=300.0,
+                        help="seconds to run (default 300)")
+    parser.add_argument('-r', '--rate', type=float, default=100.0,
+                        help="MQTT messages per second (default 100)")
+    parser.add_argument('--changing', action='store_true',
+                        help="every message changes the light state")
+    parser.add_argument('--cpu', type=int, default=2,
+                        help="processes keeping a CPU busy (default 2)")
+    parser.add_argument('--memory', type=int, default=64,
+                        help="MB of memory to churn, 0 for none (default 64)")
+    parser.add_argument('-s', '--set', action='append', default=[],
+                        metavar='NAME=VALUE',
+                        help="change an [RGB Floodlight] setting, can be "
+                             "repeated")
+    parser.add_argument('--bin', type=float, default=0.5,
+                        help="histogram bin width in ms (default 0.5)")
+    parser.add_argument('--max-p99', type=float, default=5.0,
+                        help="p99 frame interval deviation limit in ms "
+                             "(default 5.0)")
+    parser.add_argument('--max-miss', type=float, default=0.1,
+                        help="missed frame limit in percent (default 0.1)")
+    parser.add_argument('--max-growth', type=float, default=2.0,
+                        help="memory growth limit in MB (default 2.0)")
+    parser.add_argument('--frames', help="keep the frame log in this file")
+    parser.add_argument('--report', help="write the results to this JSON "
+                                         "file")
+    parser.add_argument('-t', '--timeout', type=float, default=30.0,
+                        help="seconds to wait for the first frame")
+    args = parser.parse_args()
+    script = os.path.join(here, 'rgbfloodlight.py')
+
+    broker = MiniBroker()
+    broker.start()
+    workdir = tempfile.mkdtemp(prefix='soakbench')
+    frameLog = os.path.join(workdir, 'frames.bin')
+    # the sensor timer runs often so it gets soaked too
+    overrides = {'Broker': '127.0.0.1', 'Port': str(broker.port),
+                 'I2C_Bus': 'fake', 'Temp_Measurement_Time': '1',
+                 'Temp_Publish_Rate': '5'}
+    for item in args.set:
+        name, sep, value = item.partition('=')
+        if sep == '':
+            parser.error("--set needs NAME=VALUE, not '%s'" % item)
+        overrides[name.strip()] = value.strip()
+    try:
+        settings = prepareWorkdir(args.cwd, workdir, overrides)
+    except ValueError as e:
+        broker.stop()
+        sys.exit("Config file error: %s" % e)
+
+    env = dict(os.environ, RGBFLOODLIGHT_FAKE_I2C_LOG=frameLog)
+    proc, lines, reader, output = startApplication(script, workdir,
+                                                   args.timeout, env)
+    if proc is None:
+        broker.stop()
+        sys.exit("No first frame within %.0f seconds:\n%s"
+                 % (args.timeout, "".join(output)))
+    stop = multiprocessing.Event()
+    floodStop = threading.Event()
+    loads = []
+    samples = []
+    flooder = None
+    floodError = None
+    messages = []
+    try:
+        # start the load
+        for _i in range(args.cpu):
+            loads.append(multiprocessing.Process(target=burnCpu,
+                                                 args=(stop,), daemon=True))
+        if args.memory > 0:
+            loads.append(multiprocessing.Process(
+                target=churnMemory, args=(args.memory, stop), daemon=True))
+        for load in loads:
+            load.start()
+        if args.rate > 0:
+            flooder, floodResult = startFlood(settings, args.rate, floodStop,
+                                              args.changing)
+        start = monotonic()
+        print("Soaking for %.0f seconds with %d CPU loads, %d MB memory "
+              "churn and %.0f messages per second."
+              % (args.duration, args.cpu, args.memory, args.rate))
+        while monotonic() - start < args.duration:
+            samples.append((monotonic() - start, readRss(proc.pid)))
+            if proc.poll() is not None:
+                break
+            sleep(1.0)
+    finally:
+        floodStop.set()
+        stop.set()
+        if flooder is not None:
+            try:
+                messages.append(floodMessages(flooder, floodResult, 10))
+            except RuntimeError as e:
+                floodError = e
+        for load in loads:
+            load.join(5)
+        stopApplication(proc, reader, lines, output)
+        broker.stop()
+    if proc.returncode not in (0, -signal.SIGTERM):
+        print("".join(output))
+        sys.exit("rgbfloodlight.py exited with %d." % proc.returncode)
+    if floodError is not None:
+        shutil.rmtree(workdir, ignore_errors=True)
+        sys.exit("FAIL: %s" % floodError)
+
+    frames = readframes(frameLog) if os.path.isfile(frameLog) else []
+    if args.frames:
+        shutil.copy(frameLog, args.frames)
+    shutil.rmtree(workdir, ignore_errors=True)
+    period = 1 / settings.led_update_rate
+    result = analyzeFrames(frames, start, period, args.bin / 1000)
+    result['rss_growth_mb'] = analyzeRss(samples)
+    result['rss_kb'] = samples
+    result['messages'] = messages[0] if messages else 0
+    result['delivered'] = broker.delivered
+    result['duration'] = args.duration
+
+    print("")
+    print("Frames: %d at %d per second, %d missed deadlines (%.3f%%)"
+          % (result['frames'], settings.led_update_rate, result['misses'],
+             result['miss_percent']))
+    print("Messages: %d commands sent, %d messages delivered by the broker"
+          % (result['messages'], result['delivered']))
+    print("Frame interval deviation: p50 %.2f ms, p99 %.2f ms, max %.2f ms"
+          % (result['p50_ms'], result['p99_ms'], result['max_ms']))
+    print("")
+    print("Frame interval deviation histogram:")
+    largest = max([count for _start, count in result['histogram']] + [1])
+    for binStart, count in result['histogram']:
+        print("  %6.1f ms %8d %s" % (binStart, count,
+                                     '#' * max(1, 50 * count // largest)))
+    print("")
+    print("Memory (RSS of rgbfloodlight.py and its children):")
+    step = max(1, len(samples) // RSSROWS)
+    for seconds, kb in samples[::step]:
+        print("  %8.0f s %8.1f MB" % (seconds, kb / 1024))
+    print("Memory growth: %.2f MB" % result['rss_growth_mb'])
+
+    failures = []
+    if result['p99_ms'] > args.max_p99:
+        failures.append("p99 %.2f ms > %.2f ms" % (result['p99_ms'],
+                                                   args.max_p99))
+    if result['miss_percent'] > args.max_miss:
+        failures.append("missed %.3f%% > %.3f%%" % (result['miss_percent'],
+                                                    args.max_miss))
+    if result['rss_growth_mb'] > args.max_growth:
+        failures.append("memory growth %.2f MB > %.2f MB"
+                        % (result['rss_growth_mb'], args.max_growth))
+    result['passed'] = len(failures) == 0
+    if args.report:
+        with open(args.report, 'w') as outfile:
+            json.dump(result, outfile, indent=2)
+    print("")
+    if failures:
+        print("FAIL: " + ", ".join(failures))
+        sys.exit(1)
+    print("PASS")
+
+if __name__ == '__main__':
+    main()
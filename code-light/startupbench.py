@@ -0,0 +1,250 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Startup benchmark for the RGB Floodlight application.
+#
+# Starts rgbfloodlight.py with '-X importtime' several times, waits for the
+# "First frame rendered" message and stops it again. The time-to-first-frame
+# and the import time spent before and after the first frame are reported
+# and appended to a CSV history file so changes can be tracked over time.
+# Each run uses a copy of the config, state and effects files in a temporary
+# directory so the real state file is left alone. Settings can be changed
+# with --set and --fake-bus runs the light on the simulated I2C bus
+# (fakei2c.py), for example to measure on a machine without the HAT...
+#
+#   ./startupbench.py --fake-bus --set Render_Process=true
+
+import argparse
+import csv
+import os
+import re
+import queue
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import datetime
+from time import time
+
+FIRSTFRAME = re.compile(r"First frame rendered (\d+) ms")
+IMPORTTIME = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+HISTORYFILE = "startupbench.csv"
+# number of output lines shown when the application fails
+TAILLINES = 20
+
+def readLines(stream, lines):
+    """Put each line of stream on the lines queue followed by None."""
+    for line in iter(stream.readline, ''):
+        lines.put(line)
+    lines.put(None)
+
+def runOnce(script, cwd, timeout):
+    """
+    Run the application once and collect the startup measurements.
+
+    :param script: Path of the application to start.
+    :param cwd: Working directory (where the config and state files are).
+    :param timeout: Seconds to wait for the first frame.
+
+    :return: Tuple of (first frame ms, critical imports, deferred imports)
+             where the imports are lists of (self us, module) tuples.
+             Raises RuntimeError with the exit status and the last lines
+             of the output when there is no first frame.
+    """
+    # stderr is merged with stdout so import lines and the first frame
+    # message arrive in the order they happened
+    proc = subprocess.Popen([sys.executable, '-u', '-X', 'importtime',
+                             script], cwd=cwd, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT,
+                            universal_newlines=True)
+    # read the output on a thread so the timeout works on a silent process
+    lines = queue.Queue()
+    reader = threading.Thread(target=readLines, args=(proc.stdout, lines),
+                              daemon=True)
+    reader.start()
+    firstFrame = None
+    critical = []
+    deferred = []
+    # everything that isn't an import time line, to show when it fails
+    output = []
+    deadline = time() + timeout
+    try:
+        while time() < deadline:
+            try:
+                line = lines.get(timeout=deadline - time())
+            except queue.Empty:
+                break
+            if line is None:
+                break
+            match = IMPORTTIME.search(line)
+            if match:
+                entry = (int(match.group(1)), match.group(4))
+                if firstFrame is None:
+                    critical.append(entry)
+                else:
+                    deferred.append(entry)
+                continue
+            if not line.startswith('import time:'):
+                output.append(line.rstrip('\n'))
+            match = FIRSTFRAME.search(line)
+            if match:
+                firstFrame = int(match.group(1))
+                # give the background imports a moment to show up
+                deadline = min(deadline, time() + 2.0)
+        if firstFrame is None:
+            try:
+                status = proc.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                status = None
+    finally:
+        if proc.poll() is None:
+            proc.send_signal(signal.SIGTERM)
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+    if firstFrame is None:
+        if status is None:
+            reason = "no first frame within %.0f seconds" % timeout
+        elif status < 0:
+            reason = "the application was killed by signal %d" % -status
+        else:
+            reason = ("the application exited with status %d before the "
+                      "first frame" % status)
+        raise RuntimeError("\n".join([reason + ", its last output:"] +
+                                      output[-TAILLINES:]))
+    return firstFrame, critical, deferred
+
+def getRevision(cwd):
+    """Get the current git revision or an empty string."""
+    try:
+        return subprocess.check_output(['git', 'describe', '--always',
+                                        '--dirty'], cwd=cwd,
+                                       stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(
+        description="Measure RGB Floodlight time-to-first-frame.")
+    parser.add_argument('-n', '--runs', type=int, default=5,
+                        help="number of runs (default 5)")
+    parser.add_argument('-C', '--cwd', default=here,
+                        help="directory with the config file")
+    parser.add_argument('-t', '--timeout', type=float, default=30.0,
+                        help="seconds to wait for the first frame")
+    parser.add_argument('--history', default=os.path.join(here, HISTORYFILE),
+                        help="CSV file the results are appended to")
+    parser.add_argument('--top', type=int, default=10,
+                        help="number of slowest imports to list")
+    parser.add_argument('--fake-bus', action='store_true',
+                        help="run the light on the simulated I2C bus")
+    parser.add_argument('-s', '--set', action='append', default=[],
+                        metavar='NAME=VALUE',
+                        help="change a setting for the runs, can be "
+                             "repeated")
+    args = parser.parse_args()
+    overrides = {}
+    if args.fake_bus:
+        overrides['I2C_Bus'] = 'fake'
+    for item in args.set:
+        name, sep, value = item.partition('=')
+        if sep == '':
+            parser.error("--set needs NAME=VALUE, not '%s'" % item)
+        overrides[name.strip()] = value.strip()
+    script = os.path.join(here, 'rgbfloodlight.py')
+    # imported here, jitterbench imports this module
+    from jitterbench import prepareWorkdir
+
+    frames = []
+    criticalTotals = []
+    deferredTotals = []
+    slowest = {}
+    workdir = tempfile.mkdtemp(prefix='startupbench')
+    try:
+        try:
+            prepareWorkdir(args.cwd, workdir, overrides)
+        except ValueError as e:
+            sys.exit("Config file error: %s" % e)
+        for run in range(args.runs):
+            try:
+                firstFrame, critical, deferred = runOnce(script, workdir,
+                                                         args.timeout)
+            except RuntimeError as e:
+                sys.exit("Run %d: %s" % (run + 1, e))
+            frames.append(firstFrame)
+            criticalTotals.append(sum(us for us, _ in critical) / 1000)
+            deferredTotals.append(sum(us for us, _ in deferred) / 1000)
+            for us, module in critical:
+                slowest[module] = max(slowest.get(module, 0), us)
+            print("Run %d: first frame %d ms, imports before %.1f ms, after "
+                  "%.1f ms" % (run + 1, firstFrame, criticalTotals[-1],
+                               deferredTotals[-1]))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'revision': getRevision(here),
+        'runs': args.runs,
+        'first_frame_ms': statistics.median(frames),
+        'critical_import_ms': round(statistics.median(criticalTotals), 1),
+        'deferred_import_ms': round(statistics.median(deferredTotals), 1),
+    }
+    print("")
+    print("Median time-to-first-frame: %d ms" % result['first_frame_ms'])
+    print("Median import time before first frame: %.1f ms"
+          % result['critical_import_ms'])
+    print("Median import time after first frame: %.1f ms"
+          % result['deferred_import_ms'])
+    print("")
+    print("Slowest imports before the first frame (self time):")
+    for module, us in sorted(slowest.items(), key=lambda x: -x[1])[:args.top]:
+        print("  %8.1f ms  %s" % (us / 1000, module))
+
+    # compare with the last entry and append this one to the history file
+    previous = None
+    if os.path.isfile(args.history):
+        with open(args.history, 'r', newline='') as f:
+            for previous in csv.DictReader(f):
+                pass
+    if previous is not None:
+        delta = result['first_frame_ms'] - float(previous['first_frame_ms'])
+        print("")
+        print("Change since %s (%s): %+.0f ms" % (previous['date'],
+              previous['revision'] or 'unknown', delta))
+    newFile = not os.path.isfile(args.history)
+    with open(args.history, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(result.keys()))
+        if newFile:
+            writer.writeheader()
+        writer.writerow(result)
+
+if __name__ == '__main__':
+    main()
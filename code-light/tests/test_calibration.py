@@ -0,0 +1,115 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import json
+
+import fakei2c
+import pytest
+
+from calibration import (LINEARMAX, PWMMAX, Calibration, inversecurve,
+                         loadcalibration)
+from color import Color
+from rgbled import RgbLed
+
+def test_gamma():
+    calibration = Calibration(gamma=1.0)
+    assert calibration.apply(0, 0, 0) == [0, 0, 0]
+    assert calibration.apply(255, 255, 255) == [PWMMAX] * 3
+    half = calibration.apply(127.5, 0, 0)[0]
+    assert abs(half - PWMMAX / 2) <= 2
+    # more gamma is darker in the middle, the ends stay put
+    assert Calibration(gamma=2.2).apply(127.5, 0, 0)[0] < half
+
+def test_scales():
+    assert Calibration(scales=(1.0, 0.5, 0.0)).apply(255, 255, 255) == [
+        PWMMAX, round(PWMMAX / 2), 0]
+
+def test_monotonic():
+    calibration = Calibration(gamma=1.8)
+    values = [calibration.apply(i, 0, 0)[0] for i in range(256)]
+    assert values == sorted(values)
+
+@pytest.mark.parametrize('matrix', [
+    None,
+    [[1.0, 0.1, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]],
+    [[1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0], [0.0, 0.0, 1.0, 0.0],
+     [0.0, 0.0, 0.0, 1.0]],
+])
+def test_out_of_range_is_clamped(matrix):
+    calibration = Calibration(gamma=2.2, matrix=matrix)
+    assert calibration.apply(300, 0, -5) == calibration.apply(255, 0, 0)
+    assert calibration.apply(-5, -5, -5) == calibration.apply(0, 0, 0)
+
+def test_applyarray_matches_apply():
+    numpy = pytest.importorskip('numpy')
+    calibration = Calibration(gamma=2.2, matrix=[[1.0, 0.1, 0.0],
+                                                 [0.0, 1.0, 0.0],
+                                                 [0.1, 0.0, 1.0]])
+    r = numpy.array([0.0, 12.5, 128.0, 255.0, 300.0, -5.0])
+    g = numpy.array([255.0, 0.0, 64.0, 255.0, 0.0, 0.0])
+    b = numpy.array([0.0, 200.0, 32.0, 255.0, -5.0, 300.0])
+    expected = [calibration.apply(*color) for color in zip(r, g, b)]
+    assert calibration.applyarray(r, g, b).tolist() == expected
+
+def test_inversecurve():
+    table = inversecurve([(0.0, 0.0), (2048.0, 0.25), (PWMMAX, 1.0)])
+    assert len(table) == LINEARMAX + 1
+    assert table[0] == 0.0
+    assert table[LINEARMAX // 4] == pytest.approx(2048 / PWMMAX, abs=0.001)
+    assert table[-1] == 1.0
+
+def test_out_of_range_color():
+    led = RgbLed(i2c=fakei2c)
+    led.set(is_on=True, brightness=255)
+    assert led.pwmvalues(Color(300, -5, 0)) == led.pwmvalues(Color(255, 0,
+                                                                   0))
+
+def writecalibration(tmp_path, data):
+    """Write a calibration file and return its path."""
+    path = tmp_path / 'calibration.json'
+    path.write_text(data if isinstance(data, str) else json.dumps(data))
+    return str(path)
+
+def test_loadcalibration(tmp_path):
+    matrix, curves = loadcalibration(writecalibration(tmp_path, {
+        'matrix': [[1, 0, 0], [0.05, 0.9, 0], [0, 0, 1]],
+        'curves': {'red': [[4095, 1.0], [0, 0.0], [2048, 0.47]]}}))
+    assert matrix[1] == [0.05, 0.9, 0.0]
+    assert curves == {'red': [(0.0, 0.0), (2048.0, 0.47), (4095.0, 1.0)]}
+    assert loadcalibration(writecalibration(tmp_path, {})) == (None, {})
+
+@pytest.mark.parametrize('data', [
+    '[1, 2]',
+    {'matrix': [[1, 0, 0], [0, 1, 0]]},
+    {'matrix': [[1, 0, 0], [0, None, 0], [0, 0, 1]]},
+    {'matrix': [[1, 0, 0], [0, '1', 0], [0, 0, 1]]},
+    {'curves': [1]},
+    {'curves': {'purple': [[0, 0.0], [4095, 1.0]]}},
+    {'curves': {'red': [[0, 0.0]]}},
+    {'curves': {'red': [[0, 0.0], [4095, None]]}},
+    {'curves': {'red': [[0, 0.0], 4095]}},
+    {'curves': {'red': [[0, 0.5], [4095, 0.5]]}},
+    'not json',
+])
+def test_loadcalibration_bad_file(tmp_path, data):
+    with pytest.raises(ValueError):
+        loadcalibration(writecalibration(tmp_path, data))
@@ -0,0 +1,41 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import colorwheel
+from color import Color
+
+def test_keyframe_cursor():
+    colors = [Color(255, 0, 0), Color(0, 255, 0), Color(0, 0, 255),
+              Color(255, 255, 255)]
+    wheel = colorwheel.KeyframeWheel(colors, [10, 20, 200, 300])
+    state = dict(vars(wheel))
+    cursor = wheel.cursor()
+    # forwards, backwards and jumps give the same colors as the search
+    for angle in list(range(0, 720, 7)) + list(range(360, 0, -13)) + [
+            350, 5, 190, 15, 360]:
+        assert cursor.getrgb(angle) == wheel.getrgb(angle)
+    # the shared wheel is not changed by its cursors
+    assert vars(wheel) == state
+
+def test_cursor_of_stateless_wheel():
+    wheel = colorwheel.getcolorwheelfromname('Rainbow Blend', Color(0, 0, 0))
+    assert wheel.cursor() is wheel
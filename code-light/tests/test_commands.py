@@ -0,0 +1,58 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import pytest
+
+from commands import CommandError, checkcommand
+
+@pytest.mark.parametrize('command', [
+    {},
+    {'state': 'ON'},
+    {'state': 'off', 'brightness': 0},
+    {'brightness': 255, 'transition': 2.5},
+    {'color': {'r': 255, 'g': 127.5, 'b': 0}},
+    {'effect': 'Rainbow'},
+    # keys this light doesn't use are left alone
+    {'state': 'ON', 'white_value': 3},
+])
+def test_valid(command):
+    assert checkcommand(command) is command
+
+@pytest.mark.parametrize('command', [
+    'ON',
+    ['state', 'ON'],
+    {'state': 1},
+    {'state': 'DIM'},
+    {'brightness': 300},
+    {'brightness': -1},
+    {'brightness': '255'},
+    {'brightness': True},
+    {'color': {'r': 255, 'g': 0}},
+    {'color': {'r': 256, 'g': 0, 'b': 0}},
+    {'color': {'r': -5, 'g': 0, 'b': 0}},
+    {'color': [255, 0, 0]},
+    {'effect': 5},
+    {'transition': -1},
+])
+def test_invalid(command):
+    with pytest.raises(CommandError):
+        checkcommand(command)
@@ -0,0 +1,103 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import json
+
+import pytest
+
+import colorwheel
+import effects
+from color import Color
+from effects import EffectError, loadeffects, parseeffect
+
+def writeeffects(tmp_path, data):
+    """Write an effects file and return its path."""
+    path = tmp_path / 'effects.json'
+    path.write_text(data if isinstance(data, str) else json.dumps(data))
+    return str(path)
+
+def test_parseeffect_defaults():
+    effect = parseeffect('Test', {'colors': [[255, 0, 0], [0, 0, 255]]}, {})
+    assert effect.kind == 'blend'
+    assert effect.positions == [0, 360]
+    assert effect.easing == 'linear'
+    assert effect.getrgb(0) == Color(255, 0, 0)
+
+def test_parseeffect_palette():
+    effect = parseeffect('Test', {'type': 'bounce', 'colors': 'Two'},
+                         {'Two': [[255, 0, 0], [0, 255, 0]]})
+    assert effect.colors == [Color(255, 0, 0), Color(0, 255, 0)]
+
+@pytest.mark.parametrize('definition', [
+    [],
+    {'type': 'flash', 'colors': [[255, 0, 0], [0, 0, 255]]},
+    {'colors': 'Missing'},
+    {'colors': [[255, 0, 0]]},
+    {'colors': [[256, 0, 0], [0, 0, 255]]},
+    {'colors': [[255, 0, 0], [0, 0, 255]], 'positions': [0, 180]},
+    {'colors': [[255, 0, 0], [0, 0, 255]], 'positions': [360, 0]},
+    {'colors': [[255, 0, 0], [0, 0, 255]], 'easing': 'bouncy'},
+    {'colors': [[255, 0, 0], [0, 0, 255]], 'blend_mode': 'cmyk'},
+])
+def test_parseeffect_bad(definition):
+    with pytest.raises(EffectError):
+        parseeffect('Test', definition, {})
+
+def test_loadeffects(tmp_path, capsys):
+    path = writeeffects(tmp_path, {
+        'palettes': {'Sea': [[0, 0, 255], [0, 255, 255], [0, 0, 255]]},
+        'effects': {
+            'Test Sea': {'colors': 'Sea', 'blend_mode': 'oklab'},
+            'Test Bad': {'colors': 'Missing'},
+            'a' * 127 + 'é': {'colors': 'Sea'},
+        }})
+    assert loadeffects(path) == ['Test Sea']
+    out = capsys.readouterr().out
+    assert "Test Bad" in out
+    assert "longer than 128 bytes" in out
+    assert colorwheel.iscolorwheel('Test Sea')
+    assert not colorwheel.iscolorwheel('Test Bad')
+    # compiled after loading, not on the first frame that shows it
+    effect = effects.Loaded['Test Sea']
+    assert effect._wheel is None
+    assert effects.compileeffects() >= 1
+    assert effect._wheel is not None
+    assert effects.compileeffects() == 0
+    wheel = colorwheel.getcolorwheelfromname('Test Sea', Color(0, 0, 0))
+    assert wheel is effect._wheel
+
+def test_compile_on_first_use(tmp_path):
+    path = writeeffects(tmp_path, {
+        'effects': {'Test First Use': {'colors': [[255, 0, 0], [0, 0, 255]]}}})
+    loadeffects(path)
+    wheel = colorwheel.getcolorwheelfromname('Test First Use', Color(0, 0, 0))
+    assert wheel is effects.Loaded['Test First Use']._wheel
+
+@pytest.mark.parametrize('data', [
+    '[1, 2]',
+    '{"effects": []}',
+    '{"palettes": 3, "effects": {}}',
+    'not json',
+])
+def test_loadeffects_bad_file(tmp_path, data):
+    with pytest.raises(ValueError):
+        loadeffects(writeeffects(tmp_path, data))
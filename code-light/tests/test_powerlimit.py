@@ -0,0 +1,88 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import fakei2c
+import pytest
+
+from color import Color
+from powerlimit import PowerLimiter
+from rgbled import RgbLed
+
+def test_under_budget():
+    limiter = PowerLimiter(watts=(20.0, 20.0, 20.0), budget=60.0)
+    values = limiter.limit([4095, 4095, 4095])
+    assert values == [4095, 4095, 4095]
+    limiter.account(values)
+    assert limiter.power == pytest.approx(60.0, rel=0.01)
+
+def test_over_budget():
+    limiter = PowerLimiter(watts=(20.0, 20.0, 20.0), budget=30.0)
+    values = limiter.limit([4095, 4095, 4095])
+    # scaled evenly so the color stays the same
+    assert values[0] == values[1] == values[2]
+    assert values[0] == pytest.approx(4095 / 2, abs=4)
+    limiter.account(values)
+    assert limiter.power == pytest.approx(30.0, rel=0.01)
+
+def test_weights():
+    # only the expensive channel counts against the budget
+    limiter = PowerLimiter(watts=(30.0, 0.0, 0.0), budget=15.0)
+    assert limiter.limit([0, 4095, 4095]) == [0, 4095, 4095]
+    values = limiter.limit([4095, 4095, 0])
+    assert values[0] == pytest.approx(4095 / 2, abs=4)
+
+def test_configure():
+    limiter = PowerLimiter(watts=(20.0, 20.0, 20.0), budget=60.0)
+    limiter.configure((20.0, 20.0, 20.0), 20.0)
+    assert sum(limiter.limit([4095, 4095, 4095])) == pytest.approx(4095,
+                                                                   abs=6)
+
+def test_energy():
+    limiter = PowerLimiter()
+    assert limiter.energy == pytest.approx(0.0)
+    limiter.account(limiter.limit([4095, 0, 0]))
+    assert limiter.energy >= 0.0
+
+def test_counted_when_written():
+    limiter = PowerLimiter()
+    led = RgbLed(i2c=fakei2c, limiter=limiter)
+    led.set(is_on=True, brightness=255, color=Color(255, 255, 255))
+    power = limiter.power
+    assert power > 0.0
+    # values computed but not written don't change the power
+    led.pwmvalues(Color(0, 0, 0))
+    assert limiter.power == power
+    led.setpwm(led.pwmvalues(Color(0, 0, 0)))
+    assert limiter.power == 0.0
+
+def test_limitarray_matches_limit():
+    numpy = pytest.importorskip('numpy')
+    rows = [[4095, 4095, 4095], [100, 200, 300], [4095, 0, 4095], [0, 0, 0]]
+    expected = [PowerLimiter(budget=30.0).limit(list(row)) for row in rows]
+    values = PowerLimiter(budget=30.0).limitarray(numpy.array(rows))
+    assert values.tolist() == expected
+
+def test_power_limit():
+    led = RgbLed(i2c=fakei2c, limiter=PowerLimiter(budget=30.0))
+    led.set(is_on=True, brightness=255, color=Color(255, 255, 255))
+    values = led.pwmvalues()
+    assert values[0] == values[1] == values[2] < 4095
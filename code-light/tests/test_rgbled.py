@@ -0,0 +1,48 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import fakei2c
+from color import Color
+from rgbled import RgbLed
+
+def makeled(**kwargs):
+    """RgbLed on the simulated I2C bus."""
+    return RgbLed(freq=200, i2c=fakei2c, **kwargs)
+
+def test_off_is_dark():
+    led = makeled()
+    led.set(is_on=False, brightness=255, color=Color(255, 255, 255))
+    assert led.pwmvalues() == [0, 0, 0]
+
+def test_brightness():
+    led = makeled()
+    led.set(is_on=True, brightness=255, color=Color(255, 0, 0))
+    full = led.pwmvalues()
+    led.set(brightness=64)
+    dim = led.pwmvalues()
+    assert full == [4095, 0, 0]
+    assert 0 < dim[0] < full[0]
+
+def test_direct():
+    led = makeled()
+    led.set(is_on=False, brightness=10)
+    assert led.pwmvalues(Color(255, 0, 0), direct=True) == [4095, 0, 0]
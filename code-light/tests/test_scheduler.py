@@ -0,0 +1,136 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import calendar
+import time
+from datetime import date
+
+import pytest
+
+from scheduler import (CronTime, ScheduleError, SunTime, loadschedule,
+                       parsecommand, parsefield, sunevent)
+
+@pytest.fixture
+def utc(monkeypatch):
+    """Run a test in UTC so cron times don't depend on the machine."""
+    monkeypatch.setenv('TZ', 'UTC')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+def utctime(*fields):
+    """Seconds since the epoch of a UTC date and time."""
+    return calendar.timegm(fields + (0,) * (6 - len(fields)))
+
+def test_parsefield():
+    assert parsefield('*', 0, 5) == {0, 1, 2, 3, 4, 5}
+    assert parsefield('1-3,5', 0, 5) == {1, 2, 3, 5}
+    assert parsefield('*/15', 0, 59) == {0, 15, 30, 45}
+    assert parsefield('10/20', 0, 59) == {10, 30, 50}
+    assert parsefield('jan,mar', 1, 12, ['jan', 'feb', 'mar']) == {1, 3}
+
+@pytest.mark.parametrize('text', ['60', '5-1', '*/0', 'x', '-1'])
+def test_parsefield_bad(text):
+    with pytest.raises(ScheduleError):
+        parsefield(text, 0, 59)
+
+def test_cron_next(utc):
+    # 2024-06-21 is a Friday
+    cron = CronTime('30 7 * * mon-fri')
+    assert cron.next(utctime(2024, 6, 21, 7, 0)) == utctime(2024, 6, 21, 7,
+                                                            30)
+    # past the time on Friday, the next one is Monday
+    assert cron.next(utctime(2024, 6, 21, 7, 30)) == utctime(2024, 6, 24, 7,
+                                                             30)
+
+def test_cron_day_fields(utc):
+    # day of month or day of week when both are given, as cron does
+    cron = CronTime('0 12 1 * sun')
+    assert cron.next(utctime(2024, 6, 21)) == utctime(2024, 6, 23, 12)
+    assert cron.next(utctime(2024, 6, 30, 13)) == utctime(2024, 7, 1, 12)
+
+def test_cron_never(utc):
+    assert CronTime('0 0 31 2 *').next(utctime(2024, 1, 1)) is None
+
+def test_cron_bad():
+    with pytest.raises(ScheduleError):
+        CronTime('0 12 * *')
+
+def test_sunevent():
+    # London on the longest day, sunrise 03:43 and sunset 20:21 UTC
+    day = date(2024, 6, 21)
+    sunrise = sunevent(day, 'sunrise', 51.5074, -0.1278)
+    sunset = sunevent(day, 'sunset', 51.5074, -0.1278)
+    assert abs(sunrise - utctime(2024, 6, 21, 3, 43)) < 120
+    assert abs(sunset - utctime(2024, 6, 21, 20, 21)) < 120
+
+def test_sunevent_midnight_sun():
+    assert sunevent(date(2024, 6, 21), 'sunset', 80.0, 0.0) is None
+
+def test_suntime_offset_and_days():
+    sun = SunTime('sunset', offset=-30, days='sat', latitude=51.5074,
+                  longitude=-0.1278)
+    when = sun.next(utctime(2024, 6, 21))
+    # the Saturday after, half an hour before sunset
+    sunset = sunevent(date(2024, 6, 22), 'sunset', 51.5074, -0.1278)
+    assert when == sunset - 30 * 60
+
+def test_suntime_bad_event():
+    with pytest.raises(ScheduleError):
+        SunTime('noonish')
+
+def test_parsecommand():
+    assert parsecommand({'state': 'ON', 'brightness': 128}) == {
+        'state': 'ON', 'brightness': 128}
+    for command in ({}, [], {'state': 'ON', 'volume': 11},
+                    {'brightness': 300}):
+        with pytest.raises(ValueError):
+            parsecommand(command)
+
+def test_loadschedule(tmp_path, capsys):
+    path = tmp_path / 'schedule.json'
+    path.write_text("""{"events": [
+        {"name": "wake", "cron": "0 7 * * *", "command": {"state": "ON"}},
+        {"sun": "sunset", "offset": 15, "command": {"effect": "Rainbow"}},
+        {"cron": "0 7 * * *", "command": {"state": 1}}
+    ]}""")
+    entries = loadschedule(str(path), 51.5074, -0.1278)
+    assert [entry.name for entry in entries] == ['wake', 'event 2']
+    assert "event 3" in capsys.readouterr().out
+
+def test_loadschedule_no_location(tmp_path, capsys):
+    path = tmp_path / 'schedule.json'
+    path.write_text("""{"events": [
+        {"name": "wake", "cron": "0 7 * * *", "command": {"state": "ON"}},
+        {"sun": "sunset", "command": {"state": "ON"}}
+    ]}""")
+    # sun events are skipped instead of running at 0, 0
+    entries = loadschedule(str(path))
+    assert [entry.name for entry in entries] == ['wake']
+    assert "Latitude and Longitude" in capsys.readouterr().out
+
+def test_loadschedule_not_a_list(tmp_path):
+    path = tmp_path / 'schedule.json'
+    path.write_text('{"events": {}}')
+    with pytest.raises(ScheduleError):
+        loadschedule(str(path))
@@ -0,0 +1,94 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import pytest
+
+from settings import changedsections, loadsettings
+
+def writeconf(tmp_path, text):
+    """Write a config file and return its path."""
+    path = tmp_path / 'rgbfloodlight.conf'
+    path.write_text(text)
+    return str(path)
+
+def test_defaults(tmp_path):
+    settings = loadsettings(writeconf(tmp_path, "[MQTT]\n"))
+    assert settings.broker == '127.0.0.1'
+    assert settings.port == 1883
+    assert settings.discovery_enabled is False
+    assert settings.pwm_address == 0x40
+    assert settings.channel_watts == (20.0, 20.0, 20.0)
+    assert settings.effect_plugins == ()
+    # no location unless one is set
+    assert settings.latitude is None
+    assert settings.longitude is None
+
+def test_types(tmp_path):
+    settings = loadsettings(writeconf(tmp_path, """
+[MQTT]
+Port = 18830
+[Home Assistant]
+Discovery_Enabled = yes
+[RGB Floodlight]
+PWM_Address = 0x41
+Channel_Watts = 10, 20.5, 30, 5
+Effect_Plugins = one, , two
+Gamma = 2.2
+[Schedule]
+Latitude = 51.5
+Longitude = -0.13
+"""))
+    assert settings.port == 18830
+    assert settings.discovery_enabled is True
+    assert settings.pwm_address == 0x41
+    assert settings.channel_watts == (10.0, 20.5, 30.0, 5.0)
+    assert settings.effect_plugins == ('one', 'two')
+    assert settings.gamma == 2.2
+    assert (settings.latitude, settings.longitude) == (51.5, -0.13)
+
+@pytest.mark.parametrize('text', [
+    "[MQTT]\nPort = many\n",
+    "[Home Assistant]\nGroup_Enabled = maybe\n",
+    "[RGB Floodlight]\nBlend_Mode = cmyk\n",
+    "[RGB Floodlight]\nLED_Update_Rate = 500\n",
+    "[RGB Floodlight]\nChannel_Watts = 10, 20\n",
+    "[RGB Floodlight]\nI2C_Bus = usb\n",
+    "[DMX]\nDMX_Protocol = dante\n",
+    "[DMX]\nDMX_Address = 511\n",
+    "[Audio]\nAudio_Window = 1000\n",
+    "[Schedule]\nLatitude = 91\nLongitude = 0\n",
+    "[Schedule]\nLatitude = 51.5\n",
+    "no section header\n",
+])
+def test_bad_values(tmp_path, text):
+    with pytest.raises(ValueError):
+        loadsettings(writeconf(tmp_path, text))
+
+def test_missing_file(tmp_path):
+    with pytest.raises(ValueError):
+        loadsettings(str(tmp_path / 'missing.conf'))
+
+def test_changed_sections(tmp_path):
+    old = loadsettings(writeconf(tmp_path, "[MQTT]\n"))
+    new = old._replace(gamma=2.2, dmx_universe=2)
+    assert changedsections(old, old) == set()
+    assert changedsections(old, new) == {'RGB Floodlight', 'DMX'}
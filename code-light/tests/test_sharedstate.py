@@ -0,0 +1,76 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (c) 2018 Mike Lawrence
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+from color import Color
+from renderprocess import STATEFORMAT, packstate, unpackstate
+from sharedstate import SEQUENCE, SeqBlock
+
+def test_write_read():
+    block = SeqBlock('?Id')
+    try:
+        assert block.read() == (0, (False, 0, 0.0))
+        block.write(True, 7, 1.5)
+        seq, values = block.read()
+        assert values == (True, 7, 1.5)
+        # even when no write is in progress
+        assert seq % 2 == 0
+        assert block.sequence() == seq
+        block.write(False, 8, 2.5)
+        assert block.sequence() != seq
+    finally:
+        block.close()
+
+def test_attach():
+    block = SeqBlock('I')
+    try:
+        other = SeqBlock('I', name=block.name)
+        block.write(42)
+        assert other.read()[1] == (42,)
+        other.close()
+    finally:
+        block.close()
+
+def test_write_in_progress():
+    block = SeqBlock('I')
+    try:
+        block.write(1)
+        # an odd sequence number means the writer is in the middle of it
+        SEQUENCE.pack_into(block._buf, 0, block.sequence() + 1)
+        assert block.read(retries=3) is None
+    finally:
+        SEQUENCE.pack_into(block._buf, 0, 0)
+        block.close()
+
+def test_state_block():
+    block = SeqBlock(STATEFORMAT)
+    try:
+        state = {'state': True, 'brightness': 200, 'color': Color(255, 0, 0),
+                 'effect': 'Single Color Bounce', 'transition': 1.5,
+                 'epoch': 10.0}
+        block.write(*packstate(state))
+        assert unpackstate(block.read()[1]) == state
+        # a name cut in the middle of a character falls back to Single Color
+        state['effect'] = 'a' * 127 + 'é'
+        block.write(*packstate(state))
+        assert unpackstate(block.read()[1])['effect'] == 'Single Color'
+    finally:
+        block.close()
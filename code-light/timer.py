@@ -21,7 +21,11 @@ class InfiniteTimer(threading.Thread):
     def run(self):
         starttime = time.time()
         while True:
-            self.f()
+            try:
+                self.f()
+            except Exception:
+                # keep the timer going, the next call may well work
+                logger.exception("InfiniteTimer function failed")
             # figure out how much sleep remains, after f() was executed
             delay = self.t - ((time.time() - starttime) % self.t)
             # logger.debug("Delay: {}".format(delay))